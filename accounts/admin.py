@@ -10,7 +10,7 @@ class UserAdmin(ImportExportMixin, BaseUserAdmin):
     ordering = ("-date_joined",)
     list_display = ("email", "first_name", "last_name", "is_staff", "is_active", "date_joined")
     list_filter = ("is_staff", "is_active")
-    search_fields = ("email", "first_name", "last_name")
+    search_fields = ("^email", "^name_key", "^name_key_rev")  # indexed prefix search (accounts.directory)
     fieldsets = (
         (None, {"fields": ("email", "password")}),
         ("Personal info", {"fields": ("first_name", "last_name")}),
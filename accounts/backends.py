@@ -0,0 +1,89 @@
+"""
+ModelBackend with cached user, permission and group lookups.
+
+AuthenticationMiddleware loads request.user through get_user() on every
+request, and has_perm()/group checks query groups and permissions again.
+Here each of those is cached per user for AUTH_CACHE_TTL seconds; the
+handlers in accounts.signals drop the entries whenever the user, their
+groups or a group's permissions change.
+
+Only the columns requests read are cached (USER_FIELDS), never the
+password hash: get_user() rebuilds a User with the rest deferred and
+carries the session auth hash so the session check needs no query.
+Invalidation only reaches other workers through a shared cache, so
+settings turn the caching off (AUTH_CACHE_TTL = 0) on a per-process one.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import router
+
+TTL = getattr(settings, "AUTH_CACHE_TTL", 300)
+USER_FIELDS = ("id", "uid", "email", "first_name", "last_name", "is_active", "is_staff", "is_superuser")
+
+
+def _keys(user_id) -> list[str]:
+    return [f"auth:user:{user_id}", f"auth:perms:{user_id}", f"auth:groups:{user_id}"]
+
+
+def invalidate(*user_ids) -> None:
+    keys = [k for uid in user_ids if uid is not None for k in _keys(uid)]
+    if keys:
+        cache.delete_many(keys)
+
+
+def group_names(user) -> frozenset:
+    """Names of the user's groups (cached)."""
+    if not user.is_authenticated:
+        return frozenset()
+    if not hasattr(user, "_group_names"):
+        key = f"auth:groups:{user.pk}"
+        names = cache.get(key) if TTL else None
+        if names is None:
+            names = frozenset(user.groups.values_list("name", flat=True))
+            if TTL:
+                cache.set(key, names, TTL)
+        user._group_names = names
+    return user._group_names
+
+
+def _from_row(row: dict):
+    model = get_user_model()
+    auth_hash = row["session_auth_hash"]
+    # from_db wants the values in field order
+    names = [f.attname for f in model._meta.concrete_fields if f.attname in row]
+    user = model.from_db(router.db_for_read(model), names, [row[n] for n in names])
+    # the password is deferred; don't load it just to check the session
+    user.get_session_auth_hash = lambda: auth_hash
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        if not TTL:
+            return super().get_user(user_id)
+        key = f"auth:user:{user_id}"
+        row = cache.get(key)
+        if row is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                row = {f: getattr(user, f) for f in USER_FIELDS}
+                row["session_auth_hash"] = user.get_session_auth_hash()
+                cache.set(key, row, TTL)
+            return user
+        user = _from_row(row)
+        return user if self.user_can_authenticate(user) else None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, "_perm_cache"):
+            key = f"auth:perms:{user_obj.pk}"
+            perms = cache.get(key) if TTL else None
+            if perms is None:
+                perms = super().get_all_permissions(user_obj)
+                if TTL:
+                    cache.set(key, perms, TTL)
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
@@ -0,0 +1,89 @@
+"""
+User directory: prefix search and keyset pagination for the users screen
+and the staff typeahead.
+
+A query matches when it is a prefix of the normalized "first last" name
+(User.name_key), of "last first" (name_key_rev) or of the email. All three
+are indexed, and a prefix LIKE can use the index, unlike icontains. Pages
+are ordered by (-date_joined, -id), and the cursor is the last row's
+"<microseconds since epoch>_<id>", so a deep page costs the same as the first.
+"""
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.models import Group
+from django.db.models import Prefetch, Q
+
+from .models import User, search_key
+
+PAGE_SIZE = 50
+TYPEAHEAD_LIMIT = 10
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_US = timedelta(microseconds=1)
+
+
+def search(qs, q: str):
+    q = (q or "").strip()
+    if not q:
+        return qs
+    key = search_key(q)
+    cond = Q(email__istartswith=q)
+    if key:
+        cond |= Q(name_key__startswith=key) | Q(name_key_rev__startswith=key)
+    return qs.filter(cond)
+
+
+def with_roles(qs):
+    return qs.prefetch_related(Prefetch("groups", queryset=Group.objects.only("id", "name")))
+
+
+def encode_cursor(user) -> str:
+    return f"{(user.date_joined - _EPOCH) // _US}_{user.pk}"
+
+
+def decode_cursor(cursor: str):
+    try:
+        us, pk = (cursor or "").split("_", 1)
+        return _EPOCH + int(us) * _US, int(pk)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def page(qs, cursor: str = "", size: int = PAGE_SIZE):
+    """(rows, next cursor or "") for one keyset page of qs."""
+    qs = qs.order_by("-date_joined", "-id")
+    after = decode_cursor(cursor)
+    if after:
+        joined, pk = after
+        qs = qs.filter(Q(date_joined__lt=joined) | Q(date_joined=joined, id__lt=pk))
+    rows = list(qs[:size + 1])
+    if len(rows) > size:
+        return rows[:size], encode_cursor(rows[size - 1])
+    return rows, ""
+
+
+def typeahead(q: str, limit: int = TYPEAHEAD_LIMIT) -> list[dict]:
+    """Best matches for the staff typeahead: exact name/email prefixes, newest accounts first."""
+    if not (q or "").strip():
+        return []
+    qs = search(User.objects.only("id", "uid", "first_name", "last_name", "email"), q)
+    rows = list(with_roles(qs).order_by("-date_joined", "-id")[:limit])
+    return [
+        {"uid": str(u.uid), "name": u.name, "email": u.email, "roles": [g.name for g in u.groups.all()]}
+        for u in rows
+    ]
+
+
+def rebuild_search_keys(batch_size=2000, log=print) -> int:
+    """Recompute name_key/name_key_rev for every user (rows written before the columns existed)."""
+    done, last = 0, 0
+    while True:
+        batch = list(User.objects.filter(id__gt=last).order_by("id").only("id", "first_name", "last_name")[:batch_size])
+        if not batch:
+            return done
+        for u in batch:
+            u.name_key = search_key(u.first_name, u.last_name)
+            u.name_key_rev = search_key(u.last_name, u.first_name)
+        User.objects.bulk_update(batch, ["name_key", "name_key_rev"])
+        done += len(batch)
+        last = batch[-1].id
+        log(f"  {done} users")
@@ -0,0 +1,170 @@
+"""
+KPIs for the home dashboard (accounts.views.dashboard).
+
+Counts are folded into conditional aggregates (Count(filter=Q(...))) so
+Member and Family each take one query; status and gender share one
+GROUP BY; age buckets are a CASE over dob compared with birthday cutoffs,
+evaluated in SQL. The whole payload is cached per (campus, window) for
+KPI_CACHE_TTL seconds under a version key that accounts.signals bumps
+whenever a Member, Family, Campus or Attendance row is saved or deleted.
+That bump only reaches other workers through a shared cache, so settings
+turn the caching off (KPI_CACHE_TTL = 0) on a per-process one.
+
+The member/attendance apps are optional: models are looked up lazily and
+their panels come back empty when the app isn't installed.
+"""
+from datetime import date, timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, Q, Value, When
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+TTL = getattr(settings, "KPI_CACHE_TTL", 300)
+VERSION_KEY = "kpis:version"
+# (upper age bound, label); an age is in the first bucket whose bound it is below
+AGE_BUCKETS = [(13, "0-12"), (18, "13-17"), (25, "18-24"), (35, "25-34"), (45, "35-44"), (60, "45-59")]
+AGE_LABELS = [label for _, label in AGE_BUCKETS] + ["60+"]
+# models whose writes make cached KPIs stale (see accounts.signals)
+SOURCES = ("member.Member", "member.Family", "member.Campus", "attendance.Attendance")
+
+
+def model(label: str):
+    try:
+        return apps.get_model(label)
+    except (LookupError, ValueError):
+        return None
+
+
+def bump(*args, **kwargs) -> None:
+    """Invalidate every cached KPI payload (signal receiver)."""
+    if not cache.add(VERSION_KEY, 1, None):
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 1, None)
+
+
+def _birthday_cutoff(today: date, years: int) -> date:
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:  # Feb 29 -> Feb 28
+        return today.replace(year=today.year - years, day=28)
+
+
+def age_bucket_expr(today: date) -> Case:
+    """CASE mapping dob to an AGE_BUCKETS label: age < N exactly when dob is after today minus N years."""
+    return Case(
+        *[When(dob__gt=_birthday_cutoff(today, n), then=Value(label)) for n, label in AGE_BUCKETS],
+        default=Value("60+"),
+        output_field=CharField(),
+    )
+
+
+def _age_years(dob: date, today: date) -> int:
+    years = today.year - dob.year
+    if (today.month, today.day) < (dob.month, dob.day):
+        years -= 1
+    return years
+
+
+def _pct(part, whole) -> str:
+    return f"{(part / whole * 100):.0f}%" if whole else "-"
+
+
+def compute(campus_id: str, start_dt, end_dt) -> dict:
+    Member, Family, Campus = model("member.Member"), model("member.Family"), model("member.Campus")
+    Attendance = model("attendance.Attendance")
+    tz = timezone.get_current_timezone()
+    now = timezone.now().astimezone(tz)
+    today = now.date()
+    week_ago = now - timedelta(days=7)
+    thirty_days_ago = now - timedelta(days=30)
+    out = {}
+
+    # totals, new this week, conversions and the retention proxy: one query
+    # (totals and ratios are global; the campus/window filters apply to the breakdowns)
+    m = Member.objects.aggregate(
+        total=Count("id"),
+        new_week=Count("id", filter=Q(created_at__gte=week_ago)),
+        active_month=Count("id", filter=Q(created_at__gte=thirty_days_ago)),
+        cohort=Count("id", filter=Q(created_at__lt=thirty_days_ago)),
+        retained=Count("id", filter=Q(created_at__lt=thirty_days_ago) & ~Q(status="new")),
+        workers=Count("id", filter=Q(status="worker")),
+        leaders=Count("id", filter=Q(status="leader")),
+    )
+    f = Family.objects.aggregate(total=Count("id"), new_week=Count("id", filter=Q(created_at__gte=week_ago)))
+    out.update(
+        total_members=m["total"], total_families=f["total"],
+        new_members_week=m["new_week"], new_families_week=f["new_week"],
+        active_this_month=m["active_month"],
+        retention_30d=_pct(m["retained"], m["cohort"]),
+        conversion_worker=_pct(m["workers"], m["total"]),
+        conversion_leader=_pct(m["leaders"], m["total"]),
+    )
+
+    members = Member.objects.all()
+    if campus_id:
+        members = members.filter(campus_id=campus_id)
+
+    # status and gender within the window from one GROUP BY
+    by_status, by_gender = {}, {}
+    for row in members.filter(created_at__gte=start_dt, created_at__lt=end_dt).values("status", "gender").annotate(
+        count=Count("id")
+    ).order_by():
+        by_status[row["status"]] = by_status.get(row["status"], 0) + row["count"]
+        by_gender[row["gender"]] = by_gender.get(row["gender"], 0) + row["count"]
+    out["by_status"] = [{"status": k, "count": v} for k, v in by_status.items()]
+    out["by_gender"] = [{"gender": k, "count": v} for k, v in by_gender.items()]
+
+    out["by_campus"] = list(
+        Member.objects.values("campus__name").annotate(count=Count("id")).order_by("-count")[:8]
+    )
+    out["by_month"] = [
+        {"month": (r["month"].strftime("%Y-%m") if r["month"] else "-"), "count": r["count"]}
+        for r in members.annotate(month=TruncMonth("created_at", tzinfo=tz)).values("month")
+        .annotate(count=Count("id")).order_by("month")
+    ]
+
+    ages = dict(
+        members.filter(dob__isnull=False).annotate(bucket=age_bucket_expr(today))
+        .values("bucket").annotate(count=Count("id")).order_by().values_list("bucket", "count")
+    )
+    out["by_age"] = [{"bucket": b, "count": ages.get(b, 0)} for b in AGE_LABELS]
+
+    out["upcoming_birthdays"] = [
+        {"uid": b.uid, "first_name": b.first_name, "last_name": b.last_name, "dob": b.dob,
+         "age": _age_years(b.dob, today)}
+        for b in members.filter(dob__isnull=False, dob__month=today.month)
+        .only("uid", "first_name", "last_name", "dob")
+    ]
+
+    out["attendance_summary"] = []
+    if Attendance:
+        att = Attendance.objects.filter(attended_at__gte=now - timedelta(weeks=8),
+                                        attended_at__lt=now + timedelta(days=1))
+        if campus_id:
+            att = att.filter(member__campus_id=campus_id)
+        out["attendance_summary"] = [
+            {"week": w["week"].strftime("%G-W%V"), "count": w["count"]}
+            for w in att.annotate(week=TruncWeek("attended_at", tzinfo=tz)).values("week")
+            .annotate(count=Count("id")).order_by("week")
+        ]
+
+    out["campuses"] = [{"id": c.id, "name": c.name} for c in Campus.objects.only("id", "name").order_by("name")]
+    return out
+
+
+def dashboard_kpis(campus_id: str, start_dt, end_dt, window=("", "")) -> dict:
+    """Cached compute(); `window` is the raw (start, end) request values, so the rolling default shares a key."""
+    if not TTL:
+        return compute(campus_id, start_dt, end_dt)
+    version = cache.get(VERSION_KEY, 0)
+    key = f"kpis:v{version}:{campus_id}:{window[0]}:{window[1]}"
+    data = cache.get(key)
+    if data is None:
+        data = compute(campus_id, start_dt, end_dt)
+        cache.set(key, data, TTL)
+    return data
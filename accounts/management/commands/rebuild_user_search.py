@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts.directory import rebuild_search_keys
+
+
+class Command(BaseCommand):
+    help = "Fill User.name_key / name_key_rev (directory prefix search) for existing accounts, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        n = rebuild_search_keys(batch_size=opts["batch_size"], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt search keys for {n} users"))
@@ -0,0 +1,298 @@
+"""
+Member export for the dashboard toolbar: CSV, gzipped CSV or XLSX.
+
+The filtered queryset is split into keyset ranges (newest id first, one
+cheap index probe per range). A small thread pool fetches and encodes the
+ranges while the response is consumed in range order, so output order is
+stable and at most 2 x MEMBER_EXPORT_WORKERS chunks are held in memory.
+"csv.gz" compresses every chunk as its own gzip member (a valid
+multi-member gzip stream), so compression runs in the workers too. XLSX
+(needs openpyxl) is written in write-only mode to a temp file, because a
+zip can't be streamed before it is complete.
+
+Every finished export is saved in MEMBER_EXPORT_DIR. That is a private
+directory on local disk, never default (media) storage, because exports
+hold member personal data. The file name is an HMAC (keyed by SECRET_KEY)
+of the filter, format and member data version (accounts.kpis.VERSION_KEY),
+so names can't be guessed. For MEMBER_EXPORT_TTL seconds the same export
+is served from there, with HTTP Range support, so a dropped download
+resumes instead of restarting. Files are only ever read back through
+serve(), behind the staff-only dashboard_export_csv view. Each host keeps
+its own copies.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from . import kpis
+
+EXPORT_DIR = Path(getattr(settings, "MEMBER_EXPORT_DIR", Path(settings.BASE_DIR) / "var" / "member-exports"))
+TTL = getattr(settings, "MEMBER_EXPORT_TTL", 600)
+WORKERS = getattr(settings, "MEMBER_EXPORT_WORKERS", 4)
+CHUNK_SIZE = 5000  # members per keyset range
+READ_SIZE = 64 * 1024
+FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "csv.gz": ("application/gzip", ".csv.gz"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+}
+HEADER = ["UID", "First Name", "Last Name", "Gender", "Status", "dob", "Family", "Campus", "Created At"]
+
+
+def member_queryset(start_dt, end_dt, campus_id=""):
+    from member.models import Member
+
+    qs = Member.objects.filter(created_at__gte=start_dt, created_at__lt=end_dt)
+    if campus_id:
+        qs = qs.filter(campus_id=campus_id)
+    return qs.select_related("family", "campus").only(
+        "id", "uid", "first_name", "last_name", "gender", "status", "created_at",
+        "dob", "family__name", "campus__name"
+    )
+
+
+def member_row(m) -> list:
+    return [
+        str(m.uid),
+        m.first_name or "",
+        m.last_name or "",
+        m.gender or "",
+        m.status or "",
+        m.dob.isoformat() if getattr(m, "dob", None) else "",
+        m.family.name if m.family_id else "",
+        m.campus.name if m.campus_id else "",
+        timezone.localtime(m.created_at).strftime("%Y-%m-%d %H:%M"),
+    ]
+
+
+def check_format(fmt: str) -> None:
+    """Raise ValueError for formats that can't be written here."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r} (choose from {', '.join(FORMATS)})")
+    if fmt == "xlsx":
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise ValueError("XLSX export needs openpyxl (pip install openpyxl)")
+
+
+# -------- keyset ranges + ordered parallel rendering --------
+
+def key_ranges(qs, size=CHUNK_SIZE):
+    """Yield (below, from_id) bounds covering qs in descending id order: from_id <= id < below."""
+    ids = qs.order_by("-id").values_list("id", flat=True)
+    below = None
+    while True:
+        page = ids if below is None else ids.filter(id__lt=below)
+        edge = list(page[size - 1:size])
+        if not edge:
+            if page.exists():
+                yield below, None
+            return
+        yield below, edge[0]
+        below = edge[0]
+
+
+def _range_rows(qs, below, from_id, row_fn):
+    if below is not None:
+        qs = qs.filter(id__lt=below)
+    if from_id is not None:
+        qs = qs.filter(id__gte=from_id)
+    return [row_fn(obj) for obj in qs.order_by("-id")]
+
+
+def _csv_bytes(rows) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+ENCODERS = {
+    "csv": _csv_bytes,
+    "csv.gz": lambda rows: gzip.compress(_csv_bytes(rows), compresslevel=6),
+    "rows": lambda rows: rows,
+}
+
+
+def _render(qs, below, from_id, row_fn, encode):
+    try:
+        return encode(_range_rows(qs, below, from_id, row_fn))
+    finally:
+        connections.close_all()  # this worker thread's connections only
+
+
+def iter_chunks(qs, encoding: str, row_fn=member_row, workers=WORKERS, size=CHUNK_SIZE):
+    """Encoded chunks in id-descending order (header first); ranges render `workers` at a time."""
+    encode = ENCODERS[encoding]
+    yield encode([HEADER])
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="member-export") as pool:
+        pending = deque()
+        for below, from_id in key_ranges(qs, size):
+            pending.append(pool.submit(_render, qs, below, from_id, row_fn, encode))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_xlsx(qs, fileobj, row_fn=member_row) -> None:
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Members")
+    for rows in iter_chunks(qs, "rows", row_fn):
+        for row in rows:
+            ws.append(row)
+    wb.save(fileobj)
+
+
+# -------- storage cache --------
+
+storage = FileSystemStorage(location=EXPORT_DIR, file_permissions_mode=0o600, directory_permissions_mode=0o700)
+
+
+def export_name(params: dict, fmt: str) -> str:
+    version = cache.get(kpis.VERSION_KEY, 0)
+    digest = salted_hmac("accounts.member_export", json.dumps([params, fmt, version], sort_keys=True)).hexdigest()
+    return f"members-{digest}{FORMATS[fmt][1]}"
+
+
+def is_fresh(name: str) -> bool:
+    try:
+        if not storage.exists(name):
+            return False
+        age = (timezone.now() - storage.get_modified_time(name)).total_seconds()
+    except (NotImplementedError, OSError):
+        return False
+    return age < TTL
+
+
+def _store(tmp, name: str) -> None:
+    tmp.flush()
+    tmp.seek(0)
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, File(tmp))
+
+
+def build(qs, fmt: str, name: str, row_fn=member_row) -> None:
+    """Write the whole export to storage under `name`."""
+    with NamedTemporaryFile(suffix=FORMATS[fmt][1]) as tmp:
+        if fmt == "xlsx":
+            write_xlsx(qs, tmp, row_fn)
+        else:
+            for chunk in iter_chunks(qs, fmt, row_fn):
+                tmp.write(chunk)
+        _store(tmp, name)
+
+
+def stream_and_store(qs, fmt: str, name: str, row_fn=member_row):
+    """Yield the export while also saving it; an interrupted download saves nothing."""
+    with NamedTemporaryFile(suffix=FORMATS[fmt][1]) as tmp:
+        for chunk in iter_chunks(qs, fmt, row_fn):
+            tmp.write(chunk)
+            yield chunk
+        _store(tmp, name)
+
+
+# -------- HTTP --------
+
+def parse_range(header: str, size: int):
+    """(start, end) inclusive for a single "bytes=" range; None if unsatisfiable; "full" if ignored."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return "full"  # multi-range: answering with the whole body is allowed
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:  # suffix range: the last N bytes
+            n = int(last)
+            if n <= 0:
+                return None
+            return max(size - n, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return "full"
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _read(f, start: int, length: int):
+    try:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(READ_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        f.close()
+
+
+def _etag(name: str) -> str:
+    return '"' + os.path.basename(name) + '"'
+
+
+def _disposition(fmt: str) -> str:
+    return f'attachment; filename="members_export{FORMATS[fmt][1]}"'
+
+
+def serve(request, name: str, fmt: str):
+    """Serve a stored export, honouring Range / If-Range."""
+    size = storage.size(name)
+    etag = _etag(name)
+    start, end, status = 0, size - 1, 200
+    header = request.META.get("HTTP_RANGE")
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if header and (not if_range or if_range == etag):
+        parsed = parse_range(header, size)
+        if parsed is None:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        if parsed != "full":
+            (start, end), status = parsed, 206
+
+    response = StreamingHttpResponse(
+        _read(storage.open(name, "rb"), start, end - start + 1 if size else 0),
+        status=status, content_type=FORMATS[fmt][0],
+    )
+    response["Content-Length"] = str(end - start + 1 if size else 0)
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Content-Disposition"] = _disposition(fmt)
+    if status == 206:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
+
+
+def export_response(request, qs, params: dict, fmt: str, row_fn=member_row):
+    """Cached export if fresh, else generate it (streamed for csv/csv.gz) and keep a copy."""
+    check_format(fmt)
+    name = export_name(params, fmt)
+    if is_fresh(name):
+        return serve(request, name, fmt)
+    if fmt == "xlsx" or "HTTP_RANGE" in request.META:
+        build(qs, fmt, name, row_fn)
+        return serve(request, name, fmt)
+    response = StreamingHttpResponse(stream_and_store(qs, fmt, name, row_fn), content_type=FORMATS[fmt][0])
+    response["ETag"] = _etag(name)  # lets a client resume later with If-Range
+    response["Content-Disposition"] = _disposition(fmt)
+    return response
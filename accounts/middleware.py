@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+
+REFRESH_S = getattr(settings, "SESSION_REFRESH_S", 300)
+_KEY = "_refreshed"
+
+
+class SessionRefreshMiddleware:
+    """
+    Throttled stand-in for SESSION_SAVE_EVERY_REQUEST: an unchanged session is
+    marked for saving at most every SESSION_REFRESH_S seconds, which keeps its
+    expiry sliding without a session write per request. Place right after
+    SessionMiddleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        session = getattr(request, "session", None)
+        if session is None or session.is_empty():
+            return response
+        now = int(time.time())
+        if session.modified or now - session.get(_KEY, 0) >= REFRESH_S:
+            session[_KEY] = now  # marks the session modified; SessionMiddleware saves it
+        return response
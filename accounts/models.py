@@ -1,4 +1,5 @@
 # accounts/models.py
+import unicodedata
 import uuid
 from django.db import models
 from django.contrib.auth.models import (
@@ -31,6 +32,14 @@ class UserManager(BaseUserManager):
         return self.create_user(email, password, **extra_fields)
 
 
+def search_key(*parts) -> str:
+    """Lowercase, accent-free, single-spaced text for prefix search ("José  Núñez" -> "jose nunez")."""
+    text = " ".join(p for p in parts if p)
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.lower().split())
+
+
 class User(AbstractBaseUser, PermissionsMixin):
     uid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
 
@@ -45,6 +54,11 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     date_joined = models.DateTimeField(default=timezone.now)
 
+    # Directory search: "first last" and "last first", normalized by search_key(), for
+    # index-friendly prefix lookups (accounts.directory)
+    name_key = models.CharField(max_length=301, blank=True, default="", editable=False, db_index=True)
+    name_key_rev = models.CharField(max_length=301, blank=True, default="", editable=False, db_index=True)
+
     objects = UserManager()
 
     USERNAME_FIELD = "email"
@@ -52,11 +66,22 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     class Meta:
         ordering = ["-date_joined"]
-        indexes = [models.Index(fields=["email"])]
+        indexes = [
+            models.Index(fields=["email"]),
+            models.Index(fields=["-date_joined", "-id"], name="accounts_user_joined_id"),  # keyset pages
+        ]
 
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        self.name_key = search_key(self.first_name, self.last_name)
+        self.name_key_rev = search_key(self.last_name, self.first_name)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"first_name", "last_name"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"name_key", "name_key_rev"}
+        super().save(*args, **kwargs)
+
     @property
     def name(self):
         return (f"{self.first_name} {self.last_name}").strip() or self.email
@@ -0,0 +1,189 @@
+"""
+Role groups and their permissions, applied in bulk.
+
+ROLES maps a group name to the permissions it should hold: ALL, or a list of
+("app_label.Model", actions). Models from apps that aren't installed are
+skipped (and reported), so one spec serves every deployment.
+
+plan() reads all permissions (one query, content types joined) and the
+current group/permission rows (one query) and diffs them in memory; apply()
+writes the difference straight to the through table (bulk insert + delete)
+and then reconciles is_staff for the members of the changed groups with one
+UPDATE.
+"""
+from dataclasses import dataclass, field
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.db.models import Case, Exists, OuterRef, Q, Value, When
+
+from .backends import invalidate
+
+ALL = "__all__"
+STAFF_GROUP_NAMES = {"Admin", "IT Support"}
+VIEW_ADD_CHANGE = ("view", "add", "change")
+VIEW = ("view",)
+
+ROLES = {
+    "Admin": ALL,
+    "IT Support": [
+        # allow password resets but not full user admin UI
+        ("accounts.User", ("change",)),
+        # People directory
+        *[(m, VIEW_ADD_CHANGE) for m in ("member.Campus", "member.Family", "member.Member",
+                                         "member.Department", "member.DepartmentMembership")],
+        # Events + Attendance
+        *[(m, VIEW_ADD_CHANGE) for m in ("events.Event", "events.EventRegistration", "events.Guest",
+                                         "events.WomenFellowshipGroup", "events.WomenFellowshipMembership",
+                                         "attendance.Attendance")],
+        # Cards (incl. view logs)
+        ("cards.MemberCard", VIEW_ADD_CHANGE),
+        ("cards.CardValidationLog", VIEW),
+        # Support (onboarding via application)
+        *[(m, VIEW_ADD_CHANGE) for m in ("support.Applicant", "support.Invite", "support.SupportTeamMember",
+                                         "support.OnboardingTask", "support.StaffNote")],
+        # Follow-up: view only
+        *[(m, VIEW) for m in ("followup.FollowUpCase", "followup.CaseNote", "followup.CaseTask",
+                              "followup.CaseAttachment", "followup.ActivityLog")],
+    ],
+    "Socials": [
+        # bulk email tool (mailer)
+        *[(m, ("view", "add", "change", "delete")) for m in ("mailer.Campaign", "mailer.CampaignAttachment",
+                                                            "mailer.CampaignRecipient")],
+    ],
+}
+
+
+@dataclass
+class GroupDiff:
+    name: str
+    group_id: int | None  # None: the group doesn't exist yet
+    add: set = field(default_factory=set)
+    remove: set = field(default_factory=set)
+
+
+@dataclass
+class Plan:
+    groups: list
+    skipped: list  # "app_label.Model" labels that aren't installed
+    codenames: dict  # permission id -> "app_label.codename"
+
+    @property
+    def changed(self) -> bool:
+        return any(g.add or g.remove or g.group_id is None for g in self.groups)
+
+
+def _installed(label: str) -> bool:
+    try:
+        apps.get_model(label)
+    except (LookupError, ValueError):
+        return False
+    return True
+
+
+def plan(roles=None) -> Plan:
+    roles = ROLES if roles is None else roles
+    index, codenames = {}, {}
+    for pk, codename, app_label, model in Permission.objects.values_list(
+        "id", "codename", "content_type__app_label", "content_type__model"
+    ):
+        # "change_member" and a custom "change_member_card" share an action: keep both
+        action = codename.split("_", 1)[0]
+        index.setdefault((app_label, model), {}).setdefault(action, set()).add(pk)
+        codenames[pk] = f"{app_label}.{codename}"
+
+    skipped = []
+    wanted = {}
+    for name, spec in roles.items():
+        if spec == ALL:
+            wanted[name] = set(codenames)
+            continue
+        ids = set()
+        for label, actions in spec:
+            if not _installed(label):
+                if label not in skipped:
+                    skipped.append(label)
+                continue
+            app_label, model = label.lower().split(".", 1)
+            by_action = index.get((app_label, model), {})
+            for a in actions:
+                ids.update(by_action.get(a, ()))
+        wanted[name] = ids
+
+    groups = dict(Group.objects.filter(name__in=wanted).values_list("name", "id"))
+    current = {}
+    for group_id, perm_id in Group.permissions.through.objects.filter(
+        group_id__in=groups.values()
+    ).values_list("group_id", "permission_id"):
+        current.setdefault(group_id, set()).add(perm_id)
+
+    diffs = []
+    for name, ids in wanted.items():
+        gid = groups.get(name)
+        have = current.get(gid, set())
+        diffs.append(GroupDiff(name, gid, add=ids - have, remove=have - ids))
+    return Plan(diffs, skipped, codenames)
+
+
+def affected_user_ids(p: Plan) -> list:
+    """Members of the groups a plan changes; only their is_staff flag and caches are touched."""
+    changed = [g.group_id for g in p.groups if g.group_id is not None and (g.add or g.remove)]
+    if not changed:
+        return []
+    User = get_user_model()
+    return list(User.objects.filter(groups__in=changed).values_list("id", flat=True).distinct())
+
+
+def apply(p: Plan) -> list:
+    """Write a plan; returns ids of users whose is_staff flag changed."""
+    Through = Group.permissions.through
+    affected = affected_user_ids(p)  # new groups have no members yet
+    with transaction.atomic():
+        missing = [g for g in p.groups if g.group_id is None]
+        if missing:
+            Group.objects.bulk_create([Group(name=g.name) for g in missing], ignore_conflicts=True)
+            ids = dict(Group.objects.filter(name__in=[g.name for g in missing]).values_list("name", "id"))
+            for g in missing:
+                g.group_id = ids[g.name]
+
+        Through.objects.bulk_create(
+            [Through(group_id=g.group_id, permission_id=pid) for g in p.groups for pid in g.add],
+            batch_size=1000, ignore_conflicts=True,
+        )
+        removals = Q()
+        for g in p.groups:
+            if g.remove:
+                removals |= Q(group_id=g.group_id, permission_id__in=g.remove)
+        if removals:
+            Through.objects.filter(removals).delete()
+
+        # users outside the changed groups keep whatever is_staff they have (e.g. set by hand)
+        staff_changed = recompute_staff(affected) if affected else []
+
+    # bulk writes skip m2m_changed, so drop the cached permission sets here
+    invalidate(*affected)
+    return staff_changed
+
+
+def _staff_drift(user_ids=None):
+    User = get_user_model()
+    in_staff_group = Exists(User.groups.through.objects.filter(
+        user_id=OuterRef("pk"), group__name__in=STAFF_GROUP_NAMES,
+    ))
+    should = Q(is_superuser=True) | Q(in_staff_group)
+    qs = User.objects.all() if user_ids is None else User.objects.filter(pk__in=user_ids)
+    return qs.filter((should & Q(is_staff=False)) | (~should & Q(is_staff=True))), should
+
+
+def recompute_staff(user_ids=None, dry_run=False) -> list:
+    """Set is_staff = superuser or member of a STAFF_GROUP_NAMES group, in one UPDATE; returns changed ids."""
+    drift, should = _staff_drift(user_ids)
+    ids = list(drift.values_list("pk", flat=True))
+    if ids and not dry_run:
+        get_user_model().objects.filter(pk__in=ids).update(
+            is_staff=Case(When(should, then=Value(True)), default=Value(False))
+        )
+        invalidate(*ids)
+    return ids
@@ -1,10 +1,13 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from django.db.models.signals import m2m_changed
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
+from . import kpis
+from .backends import invalidate
+from .roles import STAFF_GROUP_NAMES, recompute_staff
 
-STAFF_GROUP_NAMES = {"Admin", "IT Support"}
+User = get_user_model()
 
 
 def _recompute_staff_flag(user):
@@ -21,7 +24,60 @@ def _recompute_staff_flag(user):
         pass
 
 
-@receiver(m2m_changed, sender=get_user_model().groups.through)
-def user_groups_changed(sender, instance, action, **kwargs):
-    if action in {"post_add", "post_remove", "post_clear"}:
+def _group_member_ids(group_ids):
+    return list(User.objects.filter(groups__in=group_ids).values_list("id", flat=True).distinct())
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # reverse: group.user_set.add(...) -> instance is the Group, pk_set the user ids
+    if reverse and action == "pre_clear":
+        instance._cleared_user_ids = _group_member_ids([instance.pk])
+        return
+    if action not in {"post_add", "post_remove", "post_clear"}:
+        return
+    if reverse:
+        ids = getattr(instance, "_cleared_user_ids", ()) if action == "post_clear" else (pk_set or ())
+        invalidate(*ids)
+        recompute_staff(ids)
+    else:
+        invalidate(instance.pk)
         _recompute_staff_flag(instance)
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in {"post_add", "post_remove", "post_clear"}:
+        invalidate(*(pk_set or ()) if reverse else (instance.pk,))
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in {"post_add", "post_remove", "post_clear"}:
+        invalidate(*_group_member_ids((pk_set or ()) if reverse else [instance.pk]))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_saved(sender, instance, **kwargs):
+    invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    if not created:  # a rename changes the cached group names
+        invalidate(*_group_member_ids([instance.pk]))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    # the membership rows go with the group without an m2m_changed signal
+    invalidate(*_group_member_ids([instance.pk]))
+
+
+# cached dashboard KPIs go stale when the models they count change
+for _label in kpis.SOURCES:
+    _model = kpis.model(_label)
+    if _model is not None:
+        post_save.connect(kpis.bump, sender=_model, weak=False, dispatch_uid=f"kpis:save:{_label}")
+        post_delete.connect(kpis.bump, sender=_model, weak=False, dispatch_uid=f"kpis:delete:{_label}")
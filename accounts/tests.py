@@ -1,3 +1,119 @@
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import DateField, Value
 from django.test import TestCase
+from django.utils import timezone
+
+from . import backends, kpis, roles
+from .models import User
+
+
+@mock.patch.object(backends, "TTL", 300)
+class CachedBackendTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="staff@example.org", password="s3cret-pass")
+        self.backend = backends.CachedModelBackend()
+
+    def test_cache_holds_no_password_and_checks_session_without_a_query(self):
+        first = self.backend.get_user(self.user.pk)
+        row = cache.get(f"auth:user:{self.user.pk}")
+        self.assertNotIn("password", row)
+        self.assertNotIn(self.user.password, row.values())
+
+        with self.assertNumQueries(0):
+            cached = self.backend.get_user(self.user.pk)
+            self.assertEqual(cached.email, "staff@example.org")
+            self.assertEqual(cached.get_session_auth_hash(), first.get_session_auth_hash())
+
+    def test_deactivation_drops_the_cached_user(self):
+        self.backend.get_user(self.user.pk)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(self.backend.get_user(self.user.pk))
+
+
+class RolePlanTests(TestCase):
+    def test_actions_sharing_a_prefix_are_all_granted(self):
+        ct = ContentType.objects.get_for_model(User)
+        extra = Permission.objects.create(codename="change_user_password", name="Can reset passwords", content_type=ct)
+        default = Permission.objects.get(codename="change_user", content_type=ct)
+
+        p = roles.plan({"Helpdesk": [("accounts.User", ("change",))]})
+
+        self.assertEqual(p.groups[0].add, {default.pk, extra.pk})
+
+    def test_apply_leaves_staff_outside_the_changed_groups_alone(self):
+        manual = User.objects.create_user(email="manual@example.org", password="x", is_staff=True)
+        socials = Group.objects.create(name="Socials")
+        member = User.objects.create_user(email="member@example.org", password="x", is_staff=True)
+        member.groups.add(socials)
+        User.objects.filter(pk=member.pk).update(is_staff=True)  # drifted: Socials isn't a staff group
+        perm = Permission.objects.get(codename="view_user")
+        socials.permissions.add(perm)
+
+        p = roles.plan({"Socials": []})
+        self.assertEqual(roles.affected_user_ids(p), [member.pk])
+        self.assertEqual(roles.apply(p), [member.pk])
+
+        manual.refresh_from_db()
+        member.refresh_from_db()
+        self.assertTrue(manual.is_staff)
+        self.assertFalse(member.is_staff)
+
+
+class AgeBucketTests(TestCase):
+    def setUp(self):
+        User.objects.create_user(email="anyone@example.org", password="x")
+
+    def bucket(self, dob, today):
+        # evaluated in SQL, as compute() does, on an annotated dob
+        return (User.objects.annotate(dob=Value(dob, output_field=DateField()))
+                .annotate(bucket=kpis.age_bucket_expr(today)).values_list("bucket", flat=True).get())
+
+    def expected(self, dob, today):
+        age = kpis._age_years(dob, today)
+        return next((label for bound, label in kpis.AGE_BUCKETS if age < bound), "60+")
+
+    def test_buckets_match_exact_ages_around_each_birthday(self):
+        today = date(2025, 6, 15)
+        for bound, _ in kpis.AGE_BUCKETS:
+            birthday = today.replace(year=today.year - bound)
+            for dob in (birthday - timedelta(days=1), birthday, birthday + timedelta(days=1)):
+                self.assertEqual(self.bucket(dob, today), self.expected(dob, today), dob)
+
+    def test_feb_29(self):
+        # on a leap day the cutoff falls back to Feb 28: born 2011-02-28 is 13, 2011-03-01 is 12
+        leap_day = date(2024, 2, 29)
+        self.assertEqual(self.bucket(date(2011, 2, 28), leap_day), "13-17")
+        self.assertEqual(self.bucket(date(2011, 3, 1), leap_day), "0-12")
+        # born on a leap day: not 13 yet on Feb 28 of a common year, 13 on Mar 1
+        self.assertEqual(self.bucket(date(2012, 2, 29), date(2025, 2, 28)), "0-12")
+        self.assertEqual(self.bucket(date(2012, 2, 29), date(2025, 3, 1)), "13-17")
+
+
+@unittest.skipUnless(kpis.model("member.Member"), "the member app is not installed")
+class DashboardKpiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.window = (timezone.now() - timedelta(days=90), timezone.now() + timedelta(days=1))
+
+    def test_query_count(self):
+        # Member, Family, status/gender, campus, month, age, birthdays, campuses (+ attendance)
+        with self.assertNumQueries(8 + bool(kpis.model("attendance.Attendance"))):
+            kpis.compute("", *self.window)
 
-# Create your tests here.
+    @mock.patch.object(kpis, "TTL", 300)
+    def test_cached_until_a_member_write(self):
+        kpis.dashboard_kpis("", *self.window)
+        with self.assertNumQueries(0):
+            kpis.dashboard_kpis("", *self.window)
+        kpis.bump()
+        with mock.patch.object(kpis, "compute", return_value={}) as compute:
+            kpis.dashboard_kpis("", *self.window)
+        compute.assert_called_once()
@@ -27,6 +27,7 @@ urlpatterns = [
 
     # Users management (Admin-only UI)
     path("users/", views.users_list, name="user_list"),
+    path("users/typeahead/", views.users_typeahead, name="user_typeahead"),
     path("users/new/", views.user_create, name="user_create"),
     path("users/<uuid:uid>/edit/", views.user_edit, name="user_edit"),
 
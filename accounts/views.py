@@ -9,6 +9,7 @@ from django.contrib.auth.views import (
     PasswordResetView, PasswordResetDoneView,
     PasswordResetConfirmView, PasswordResetCompleteView,
 )
+from django.http import JsonResponse
 from django.shortcuts import redirect, render, get_object_or_404
 from django.db.models import Q
 from django.urls import reverse_lazy
@@ -16,6 +17,8 @@ from .forms import (
     RegisterForm, EmailAuthenticationForm,
     UserCreateWithRolesForm, UserEditForm, UserSetPasswordForm,
 )
+from . import directory
+from .backends import group_names
 from .models import User
 
 def login_view(request):
@@ -56,7 +59,7 @@ def profile_view(request, uid):
 # ---- Users management (Admin-only) ----
 
 def _is_admin(user):
-    return user.is_authenticated and user.groups.filter(name="Admin").exists()
+    return user.is_authenticated and "Admin" in group_names(user)
 
 
 def _can_edit_users(user):
@@ -75,14 +78,20 @@ def manage_required(view):
 @admin_required
 def users_list(request):
     q = (request.GET.get("q") or "").strip()
-    qs = User.objects.all().order_by("-date_joined")
-    if q:
-        qs = qs.filter(
-            Q(first_name__icontains=q) | Q(last_name__icontains=q) | Q(email__icontains=q)
-        )
-    users = qs[:200]
+    qs = directory.with_roles(directory.search(User.objects.all(), q))
+    users, next_cursor = directory.page(qs, request.GET.get("after", ""))
     role_names = ["Admin", "IT Support", "Socials", "Followup Supervisors", "Followup Agents"]
-    return render(request, "accounts/user_list.html", {"users": users, "q": q, "role_names": role_names})
+    return render(request, "accounts/user_list.html", {
+        "users": users, "q": q, "role_names": role_names,
+        "next_cursor": next_cursor, "is_first_page": not request.GET.get("after"),
+    })
+
+
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def users_typeahead(request):
+    """JSON matches for the staff user picker: ?q=<name or email prefix>."""
+    return JsonResponse({"results": directory.typeahead(request.GET.get("q", ""))})
 
 
 @admin_required
@@ -158,11 +167,9 @@ class MyPasswordChangeDoneView(PasswordChangeDoneView):
 
 # views.py
 from datetime import date, datetime, timedelta
-from collections import Counter, defaultdict
 
-from django.db.models import Count, Q, F, Value
-from django.db.models.functions import Coalesce, TruncMonth, TruncWeek
-from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.db.models import Count, Q
+from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils import timezone
@@ -171,8 +178,10 @@ try:
 except Exception:
     FollowUpCase = CaseTask = None
 
+from . import kpis, member_export
+
 # Adjust these to your app paths
-from member.models import Member, Family, Campus
+from member.models import Member, Family
 try:
     # You said AuditLog lives in audit.py, not models.py
     from member.audit import AuditLog
@@ -227,32 +236,9 @@ def _daterange_from_get(request: HttpRequest):
 
     return start_dt, end_dt
 
-def _age_years(dob: date, today: date) -> int:
-    if not dob:
-        return -1
-    years = today.year - dob.year
-    if (today.month, today.day) < (dob.month, dob.day):
-        years -= 1
-    return years
-
-def _age_bucket(age: int) -> str:
-    if age < 0:
-        return "-"
-    if age < 13:   return "0-12"
-    if age < 18:   return "13-17"
-    if age < 25:   return "18-24"
-    if age < 35:   return "25-34"
-    if age < 45:   return "35-44"
-    if age < 60:   return "45-59"
-    return "60+"
-
 # -------- main dashboard --------
 @login_required
 def dashboard(request: HttpRequest) -> HttpResponse:
-    tz = timezone.get_current_timezone()
-    now = timezone.now().astimezone(tz)
-    today = now.date()
-
     start_dt, end_dt = _daterange_from_get(request)
     campus_id = request.GET.get("campus") or ""
 
@@ -274,19 +260,9 @@ def dashboard(request: HttpRequest) -> HttpResponse:
     else:
         family_member_filter = Q()  # no restriction
 
-    # ---- KPIs ----
-    # total counts (not constrained to date window unless you want them to-usually totals are global)
-    total_members = Member.objects.all().count()
-    total_families = Family.objects.all().count()
-
-    # new in the week (rolling last 7 days)
-    week_ago = now - timedelta(days=7)
-    new_members_week = Member.objects.filter(created_at__gte=week_ago).count()
-    new_families_week = Family.objects.filter(created_at__gte=week_ago).count()
-
-    # active this month (example: members created in last 30d)
-    active_window = now - timedelta(days=30)
-    active_this_month = Member.objects.filter(created_at__gte=active_window).count()
+    # ---- KPIs, breakdowns, birthdays, campuses (cached, see accounts.kpis) ----
+    kpi = kpis.dashboard_kpis(campus_id, start_dt, end_dt,
+                              window=(request.GET.get("start", ""), request.GET.get("end", "")))
 
     # ---- recent activity ----
     recent_activity = []
@@ -336,128 +312,12 @@ def dashboard(request: HttpRequest) -> HttpResponse:
               .order_by("-checked_in_at")[:15])
         recent_checkins = list(aq)
 
-    # ---- by status / gender (respect campus/date window) ----
-    qs_members_window = Member.objects.filter(member_filter)
-
-    by_status = (
-        qs_members_window
-        .values("status")
-        .annotate(count=Count("id"))
-        .order_by()
-    )
-    by_gender = (
-        qs_members_window
-        .values("gender")
-        .annotate(count=Count("id"))
-        .order_by()
-    )
-
-    # ---- top campuses (global or filtered?) usually show global snapshot, but you asked "top 8 with membersâ€
-    by_campus = (
-        Member.objects
-        .values("campus__name")
-        .annotate(count=Count("id"))
-        .order_by("-count")[:8]
-    )
-
-    # ---- monthly new members (last 12 months, global snapshot or filtered by campus?) ----
-    months_back = 12
-    monthly_qs = Member.objects.all()
-    if campus_id:
-        monthly_qs = monthly_qs.filter(campus_id=campus_id)
-
-    by_month = (
-        monthly_qs
-        .annotate(month=TruncMonth("created_at", tzinfo=tz))
-        .values("month")
-        .annotate(count=Count("id"))
-        .order_by("month")
-    )
-
-    # ---- age buckets (compute in Python to avoid DB-specific expressions) ----
-    by_age = []
-    try:
-        members_with_dob = Member.objects.filter(dob__isnull=False)
-        if campus_id:
-            members_with_dob = members_with_dob.filter(campus_id=campus_id)
-        ages = [_age_years(m.dob, today) for m in members_with_dob.only("dob", "campus")]
-        counter = Counter(_age_bucket(a) for a in ages)
-        # Stable order of buckets
-        buckets = ["0-12", "13-17", "18-24", "25-34", "35-44", "45-59", "60+", "-"]
-        by_age = [{"bucket": b, "count": counter.get(b, 0)} for b in buckets if counter.get(b, 0) or b != "-"]
-    except Exception:
-        by_age = []
-
-    # ---- birthdays (current month) ----
-    upcoming_birthdays = (
-        Member.objects
-        .filter(dob__isnull=False, dob__month=today.month)
-        .only("uid", "first_name", "last_name", "dob")
-    )
-    if campus_id:
-        upcoming_birthdays = upcoming_birthdays.filter(campus_id=campus_id)
-    # annotate age (in Python)
-    _b = []
-    for m in upcoming_birthdays:
-        _b.append({
-            "uid": m.uid,
-            "first_name": m.first_name,
-            "last_name": m.last_name,
-            "dob": m.dob,
-            "age": _age_years(m.dob, today),
-        })
-    upcoming_birthdays = _b
-
-    # ---- attendance last 8 weeks (optional) ----
-    attendance_summary = []
-    if Attendance:
-        att_qs = Attendance.objects.all()
-        if campus_id:
-            att_qs = att_qs.filter(member__campus_id=campus_id)
-        eight_weeks_ago = now - timedelta(weeks=8)
-        att_qs = att_qs.filter(attended_at__gte=eight_weeks_ago, attended_at__lt=now + timedelta(days=1))
-        weekly = (
-            att_qs
-            .annotate(week=TruncWeek("attended_at", tzinfo=tz))
-            .values("week")
-            .annotate(count=Count("id"))
-            .order_by("week")
-        )
-        attendance_summary = [{"week": w["week"].strftime("%G-W%V"), "count": w["count"]} for w in weekly]
-
-    # ---- campuses for filter select ----
-    campuses = list(Campus.objects.only("id", "name").order_by("name"))
-
-    # ---- insights (example placeholders; adjust to your real logic) ----
-    # retention_30d: % of members created >30d ago who still have status!=new (dummy proxy)
-    try:
-        thirty_days_ago = now - timedelta(days=30)
-        cohort = Member.objects.filter(created_at__lt=thirty_days_ago).count()
-        retained = Member.objects.filter(created_at__lt=thirty_days_ago).exclude(status="new").count()
-        retention_30d = f"{(retained / cohort * 100):.0f}%" if cohort else "-"
-    except Exception:
-        retention_30d = "-"
-
-    # conversions (examples)
-    try:
-        total = Member.objects.all().count()
-        conversion_worker = f"{(Member.objects.filter(status='worker').count() / total * 100):.0f}%" if total else "-"
-        conversion_leader = f"{(Member.objects.filter(status='leader').count() / total * 100):.0f}%" if total else "-"
-    except Exception:
-        conversion_worker = conversion_leader = "-"
-
     # ---- export URL (wire to CSV view below) ----
     export_url = reverse("dashboard_export") + (f"?start={request.GET.get('start','')}&end={request.GET.get('end','')}&campus={campus_id}" if (request.GET.get('start') or request.GET.get('end') or campus_id) else "")
 
     context = {
-        # Filters
-        "campuses": campuses,
-        # KPIs
-        "total_members": total_members,
-        "total_families": total_families,
-        "new_members_week": new_members_week,
-        "new_families_week": new_families_week,
-        "active_this_month": active_this_month,
+        # Filters, KPIs, charts / aggregates, birthdays & insights
+        **kpi,
         # Lists
         "recent_activity": recent_activity,
         "recent_members": recent_members,
@@ -465,18 +325,6 @@ def dashboard(request: HttpRequest) -> HttpResponse:
         "recent_guests": recent_guests,
         "recent_registrations": recent_registrations,
         "recent_checkins": recent_checkins,
-        # Charts / aggregates
-        "by_status": list(by_status),
-        "by_gender": list(by_gender),
-        "by_campus": list(by_campus),
-        "by_month": [{"month": (r["month"].strftime("%Y-%m") if r["month"] else "-"), "count": r["count"]} for r in by_month],
-        "by_age": by_age,
-        "attendance_summary": attendance_summary,
-        # Birthdays & insights
-        "upcoming_birthdays": upcoming_birthdays,
-        "retention_30d": retention_30d,
-        "conversion_worker": conversion_worker,
-        "conversion_leader": conversion_leader,
         # Export
         "export_url": export_url,
         # My follow-up (lightweight)
@@ -487,64 +335,39 @@ def dashboard(request: HttpRequest) -> HttpResponse:
         try:
             OPEN = ["new","open","hold"]
             now = timezone.now()
-            fc = FollowUpCase.objects.filter(assigned_to=request.user, status__in=OPEN)
+            fc = FollowUpCase.objects.filter(assigned_to=request.user, status__in=OPEN).aggregate(
+                open=Count("id"), overdue=Count("id", filter=Q(due_at__lt=now)),
+            )
             tk = CaseTask.objects.filter(case__assigned_to=request.user, is_done=False)
+            tk_counts = tk.aggregate(pending=Count("id"), due_today=Count("id", filter=Q(due_at__date=now.date())))
             context["my_followup"] = {
-                "cases_open": fc.count(),
-                "cases_overdue": fc.filter(due_at__lt=now).count(),
-                "tasks_pending": tk.count(),
-                "tasks_due_today": tk.filter(due_at__date=now.date()).count(),
+                "cases_open": fc["open"],
+                "cases_overdue": fc["overdue"],
+                "tasks_pending": tk_counts["pending"],
+                "tasks_due_today": tk_counts["due_today"],
                 "top_tasks": list(tk.order_by("due_at")[:5]),
             }
         except Exception:
             context["my_followup"] = None
     return render(request, "dashboard.html", context)
 
-# -------- simple CSV export for the toolbar --------
-
-import csv
-from io import StringIO
+# -------- member export for the toolbar --------
 
+@login_required
+@user_passes_test(lambda u: u.is_staff)
 def dashboard_export_csv(request: HttpRequest) -> HttpResponse:
     """
-    Example export: dumps members matching the same filter window + campus as a flat CSV
-    Customize columns as you like.
+    Members matching the dashboard window + campus as ?format=csv (default), csv.gz or xlsx.
+    Rendered in parallel keyset ranges and cached in storage briefly (see accounts.member_export).
     """
     start_dt, end_dt = _daterange_from_get(request)
     campus_id = request.GET.get("campus") or ""
+    fmt = request.GET.get("format", "csv")
+    params = {"start": request.GET.get("start", ""), "end": request.GET.get("end", ""), "campus": campus_id}
 
-    qs = Member.objects.filter(created_at__gte=start_dt, created_at__lt=end_dt)
-    if campus_id:
-        qs = qs.filter(campus_id=campus_id)
-
-    qs = qs.select_related("family", "campus").only(
-        "uid", "first_name", "last_name", "gender", "status", "created_at",
-        "dob", "family__name", "campus__name"
-    ).order_by("-created_at")
-
-    # Stream as CSV
-    def row_iter():
-        header = ["UID", "First Name", "Last Name", "Gender", "Status", "dob", "Family", "Campus", "Created At"]
-        yield header
-        for m in qs.iterator(chunk_size=1000):
-            yield [
-                str(m.uid),
-                m.first_name or "",
-                m.last_name or "",
-                m.gender or "",
-                m.status or "",
-                m.dob.isoformat() if getattr(m, "dob", None) else "",
-                m.family.name if m.family_id else "",
-                m.campus.name if m.campus_id else "",
-                timezone.localtime(m.created_at).strftime("%Y-%m-%d %H:%M"),
-            ]
-
-    class Echo:
-        def write(self, value): return value
-
-    pseudo_buffer = Echo()
-    writer = csv.writer(pseudo_buffer)
-    response = StreamingHttpResponse((writer.writerow(r) for r in row_iter()), content_type="text/csv")
-    response["Content-Disposition"] = 'attachment; filename="members_export.csv"'
-    return response
-
+    try:
+        return member_export.export_response(
+            request, member_export.member_queryset(start_dt, end_dt, campus_id), params, fmt
+        )
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
@@ -1,11 +1,65 @@
-from django.contrib import admin
-from import_export import resources
+import os
+
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from import_export import fields, resources
 from import_export.admin import ImportExportModelAdmin
 
-from .models import Event, Visit
+from . import exporting
+from .querybudget import QueryBudgetAdminMixin
+from .models import AttributionDaily, Event, ExportJob, ListeningProfile, LiveSnapshot, Rollup, SermonStats, Visit, VisitSession
+
+
+class StreamingExportMixin:
+    """
+    Admin actions that export the selected rows in constant memory
+    (the import_export "Export" button builds the whole file in memory).
+    """
+    actions = ["stream_csv", "stream_jsonl", "background_jsonl", "background_parquet"]
+
+    def _stream(self, queryset, fmt):
+        exporting.check_format(fmt)
+        content_type, _ = exporting.FORMATS[fmt]
+        response = StreamingHttpResponse(exporting.iter_export(queryset, fmt), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{exporting.export_filename(queryset.model, fmt)}"'
+        return response
+
+    def _background(self, request, queryset, fmt):
+        try:
+            exporting.check_format(fmt)
+        except ValueError as e:
+            messages.error(request, str(e))
+            return
+        job = exporting.start_job(queryset, fmt, user=request.user, description=f"admin action, {queryset.count()} rows")
+        messages.info(request, f"Export #{job.pk} started; follow it under Analytics › Export jobs.")
+
+    @admin.action(description="Download selected as CSV (streamed)")
+    def stream_csv(self, request, queryset):
+        return self._stream(queryset, "csv")
+
+    @admin.action(description="Download selected as JSONL.gz (streamed)")
+    def stream_jsonl(self, request, queryset):
+        return self._stream(queryset, "jsonl.gz")
+
+    @admin.action(description="Export selected to storage as JSONL.gz (background)")
+    def background_jsonl(self, request, queryset):
+        self._background(request, queryset, "jsonl.gz")
+
+    @admin.action(description="Export selected to storage as Parquet (background)")
+    def background_parquet(self, request, queryset):
+        self._background(request, queryset, "parquet")
 
 
 class VisitResource(resources.ModelResource):
+    # export dimension values, not their ids
+    path = fields.Field(attribute="path__value", column_name="path", readonly=True)
+    referer = fields.Field(attribute="referer__value", column_name="referer", readonly=True)
+    ua = fields.Field(attribute="ua__value", column_name="ua", readonly=True)
+
     class Meta:
         model = Visit
         fields = (
@@ -26,11 +80,13 @@ class VisitResource(resources.ModelResource):
 
 
 @admin.register(Visit)
-class VisitAdmin(ImportExportModelAdmin):
+class VisitAdmin(QueryBudgetAdminMixin, StreamingExportMixin, ImportExportModelAdmin):
     resource_class = VisitResource
     list_display = ("ts", "path", "status_code", "visitor_id", "user", "is_bot")
     list_filter = ("is_bot", "status_code")
-    search_fields = ("path", "visitor_id", "referer", "ua")
+    list_select_related = ("path", "user")
+    changelist_query_budget = 8
+    search_fields = ("path__value", "visitor_id", "referer__value", "ua__value")
     date_hierarchy = "ts"
 
 
@@ -53,9 +109,109 @@ class EventResource(resources.ModelResource):
 
 
 @admin.register(Event)
-class EventAdmin(ImportExportModelAdmin):
+class EventAdmin(QueryBudgetAdminMixin, StreamingExportMixin, ImportExportModelAdmin):
     resource_class = EventResource
     list_display = ("ts", "event", "slug", "title", "visitor_id", "user", "country")
+    list_select_related = ("user",)
+    changelist_query_budget = 9
     list_filter = ("event", "country")
     search_fields = ("slug", "title", "path", "ua", "ip_hash")
     date_hierarchy = "ts"
+
+
+@admin.register(LiveSnapshot)
+class LiveSnapshotAdmin(admin.ModelAdmin):
+    list_display = ("ts", "listeners", "peak")
+    date_hierarchy = "ts"
+
+
+@admin.register(Rollup)
+class RollupAdmin(admin.ModelAdmin):
+    list_display = ("day", "kind", "key", "count")
+    list_filter = ("kind",)
+    search_fields = ("key",)
+    date_hierarchy = "day"
+
+
+@admin.register(AttributionDaily)
+class AttributionDailyAdmin(admin.ModelAdmin):
+    list_display = ("day", "kind", "host", "source", "medium", "campaign", "visits", "visitors")
+    list_filter = ("kind",)
+    search_fields = ("host", "source", "campaign")
+    date_hierarchy = "day"
+
+
+@admin.register(SermonStats)
+class SermonStatsAdmin(admin.ModelAdmin):
+    list_display = ("sermon", "plays", "completions", "listen_s", "updated_at")
+    list_select_related = ("sermon",)
+    readonly_fields = ("sermon", "plays", "completions", "listen_s", "trending", "trending_base", "updated_at")
+    ordering = ("-plays",)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ListeningProfile)
+class ListeningProfileAdmin(admin.ModelAdmin):
+    list_display = ("sermon", "sessions", "listeners", "listen_s", "completion_rate", "computed_at")
+    list_select_related = ("sermon",)
+    exclude = ("retention",)
+    readonly_fields = ("sermon", "duration_s", "samples", "sessions", "listeners", "listen_s", "completion_rate",
+                       "through_id", "computed_at")
+    ordering = ("-sessions",)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(VisitSession)
+class VisitSessionAdmin(admin.ModelAdmin):
+    list_display = ("visitor_id", "started_at", "depth", "duration_s", "funnel", "is_return", "entry_path", "exit_path")
+    list_filter = ("funnel", "is_return")
+    list_select_related = ("entry_path", "exit_path")
+    search_fields = ("=visitor_id",)
+    date_hierarchy = "started_at"
+    readonly_fields = [f.name for f in VisitSession._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "model", "fmt", "status", "progress_display", "download", "created_by")
+    list_filter = ("status", "model", "fmt")
+    readonly_fields = [f.name for f in ExportJob._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path("<int:pk>/download/", self.admin_site.admin_view(self.download_view), name="analytics_exportjob_download"),
+        ]
+        return urls + super().get_urls()
+
+    def changelist_view(self, request, extra_context=None):
+        exporting.fail_stale_jobs()
+        return super().changelist_view(request, extra_context)
+
+    def download_view(self, request, pk):
+        """Export files live in private storage; this is the only way to read them."""
+        job = get_object_or_404(ExportJob, pk=pk)
+        if not (request.user.is_staff and self.has_view_permission(request, job)):
+            raise PermissionDenied
+        if job.status != ExportJob.DONE or not job.file or not job.file.storage.exists(job.file.name):
+            raise Http404("export file not available")
+        return FileResponse(job.file.open("rb"), as_attachment=True, filename=os.path.basename(job.file.name))
+
+    @admin.display(description="Progress")
+    def progress_display(self, obj):
+        return f"{obj.progress}% ({obj.rows_done}/{obj.rows_total})"
+
+    @admin.display(description="File")
+    def download(self, obj):
+        if not obj.file:
+            return "—"
+        return format_html('<a href="{}">download</a>', reverse("admin:analytics_exportjob_download", args=[obj.pk]))
@@ -0,0 +1,190 @@
+"""
+Referer parsing and per-day campaign attribution.
+
+Each new RefererDim row is parsed once, when it is first inserted
+(dimensions.referers calls parse_referer). The parse stores the host
+without "www.", a class (internal / search / social / email / referral)
+and the URL without tracking parameters. Reports group by those indexed
+columns, so they no longer group by raw URLs, where every query string
+is its own row.
+
+AttributionDaily holds non-bot visits per local day by (referer class,
+host, utm_source, utm_medium, utm_campaign); visits without a referer are
+"direct". `manage.py rollup_attribution` rebuilds recent complete days,
+and retention.rollup_day rebuilds a day before its raw rows are archived.
+top_sources() reads rolled-up days from the rollup and falls back to raw
+visits for today and for days that haven't been rolled up yet.
+"""
+import re
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import AttributionDaily, RefererDim, Visit
+
+DIRECT, INTERNAL, SEARCH, SOCIAL, EMAIL, REFERRAL = "direct", "internal", "search", "social", "email", "referral"
+KINDS = (DIRECT, INTERNAL, SEARCH, SOCIAL, EMAIL, REFERRAL)
+# checked in this order; a host matches a domain when it is that domain or a subdomain of it
+EMAIL_HOSTS = ("mail.google.com", "com.google.android.gm", "outlook.live.com", "outlook.office.com",
+               "outlook.office365.com", "mail.yahoo.com", "mail.proton.me", "mail.aol.com")
+SEARCH_HOSTS = ("bing.com", "duckduckgo.com", "search.yahoo.com", "yandex.ru", "yandex.com", "baidu.com",
+                "ecosia.org", "search.brave.com", "com.google.android.googlequicksearchbox")
+SOCIAL_HOSTS = ("facebook.com", "fb.com", "fb.me", "instagram.com", "t.co", "twitter.com", "x.com",
+                "linkedin.com", "lnkd.in", "youtube.com", "youtu.be", "tiktok.com", "reddit.com",
+                "pinterest.com", "whatsapp.com", "wa.me", "t.me", "telegram.org", "threads.net", "snapchat.com")
+GOOGLE_SEARCH = re.compile(r"(^|\.)google\.[a-z]{2,3}(\.[a-z]{2})?$")
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "igshid", "mc_cid",
+                   "mc_eid", "_ga", "_gl", "ref_src", "ref_url", "si"}
+INTERNAL_HOSTS = {h.lower().lstrip(".").removeprefix("www.")
+                  for h in getattr(settings, "ANALYTICS_INTERNAL_HOSTS", None) or settings.ALLOWED_HOSTS
+                  if h and h != "*"}
+CHUNK = 2000
+
+
+def _under(host: str, domains) -> bool:
+    return any(host == d or host.endswith("." + d) for d in domains)
+
+
+def classify(host: str) -> str:
+    if not host:
+        return REFERRAL
+    if _under(host, INTERNAL_HOSTS):
+        return INTERNAL
+    if _under(host, EMAIL_HOSTS):
+        return EMAIL
+    if GOOGLE_SEARCH.search(host) or _under(host, SEARCH_HOSTS):
+        return SEARCH
+    if _under(host, SOCIAL_HOSTS):
+        return SOCIAL
+    return REFERRAL
+
+
+def _is_tracking(param: str) -> bool:
+    param = param.lower()
+    return param.startswith("utm_") or param in TRACKING_PARAMS
+
+
+def parse_referer(referer: str) -> dict:
+    """RefererDim's parsed columns (host, kind, url) for a raw Referer header."""
+    try:
+        parts = urlsplit((referer or "").strip())
+        host = (parts.hostname or "").rstrip(".")
+    except ValueError:
+        return {"host": "", "kind": REFERRAL, "url": ""}
+    host = host.removeprefix("www.")[:255]
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not _is_tracking(k)])
+    url = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, "")) if host else ""
+    return {"host": host, "kind": classify(host), "url": url[:1024]}
+
+
+def backfill_referers(batch_size=CHUNK, log=None) -> int:
+    """Parse RefererDim rows stored before the parsed columns existed, in id order (resumable)."""
+    done, last = 0, 0
+    while True:
+        batch = list(RefererDim.objects.filter(kind="", id__gt=last).order_by("id").only("id", "value")[:batch_size])
+        if not batch:
+            return done
+        for r in batch:
+            for field, value in parse_referer(r.value).items():
+                setattr(r, field, value)
+        RefererDim.objects.bulk_update(batch, ["host", "kind", "url"])
+        done += len(batch)
+        last = batch[-1].id
+        if log:
+            log(f"  parsed {done} referers")
+
+
+# -------- daily rollup --------
+
+def _kind(value):
+    """referer__kind from a visits query: NULL is no referer at all, "" a referer not parsed yet."""
+    return DIRECT if value is None else value or REFERRAL
+
+
+def rollup_day(day) -> int:
+    """(Re)build AttributionDaily for one local day from raw visits. Idempotent."""
+    from .retention import _local_bounds
+
+    start, end = _local_bounds(day)
+    # grouped by weight too, so sampled rows (analytics.shedding) are scaled back up
+    rows = (Visit.objects.filter(is_bot=False, ts__gte=start, ts__lt=end)
+            .values("referer__kind", "referer__host", "utm__source", "utm__medium", "utm__campaign", "weight")
+            .annotate(visits=Count("id"), visitors=Count("visitor_id", distinct=True)).order_by())
+    objs = {}
+    for r in rows:
+        key = (_kind(r["referer__kind"]), r["referer__host"] or "", r["utm__source"] or "",
+               r["utm__medium"] or "", r["utm__campaign"] or "")
+        o = objs.get(key)
+        if o is None:
+            o = objs[key] = AttributionDaily(day=day, kind=key[0], host=key[1], source=key[2], medium=key[3],
+                                             campaign=key[4])
+        o.visits += r["visits"] * r["weight"]
+        o.visitors += r["visitors"] * r["weight"]
+    objs = list(objs.values())
+    with transaction.atomic():
+        AttributionDaily.objects.filter(day=day).delete()
+        AttributionDaily.objects.bulk_create(objs, batch_size=1000)
+    return len(objs)
+
+
+def rollup(since=None, until=None, log=None) -> int:
+    """
+    Parse any unparsed referers, then rebuild each complete day from `since`
+    (default yesterday) to `until` (default and at most yesterday). Today is
+    still filling up, so top_sources always reads it from raw visits.
+    """
+    backfill_referers(log=log)
+    yesterday = timezone.localdate() - timedelta(days=1)
+    day, until = since or yesterday, min(until or yesterday, yesterday)
+    n = 0
+    while day <= until:
+        rows = rollup_day(day)
+        if log:
+            log(f"  {day}: {rows} rows")
+        day += timedelta(days=1)
+        n += 1
+    return n
+
+
+# -------- reports --------
+
+GROUPS = {
+    "host": ("kind", "host"),
+    "kind": ("kind",),
+    "campaign": ("source", "medium", "campaign"),
+}
+
+
+def top_sources(start, end, by="host", limit=10, exclude=(INTERNAL,)) -> list[dict]:
+    """Visits per referer host / class / UTM campaign between two local dates (inclusive)."""
+    if by not in GROUPS:
+        raise ValueError(f"unknown grouping {by!r} (choose from {', '.join(GROUPS)})")
+    if by == "host":
+        exclude = {*exclude, DIRECT}
+    fields = GROUPS[by]
+    totals = {}
+
+    # rows for today (left by an older rollup that ran mid-day) would freeze it; read it raw
+    days = AttributionDaily.objects.filter(day__range=(start, end), day__lt=timezone.localdate())
+    rolled = days.exclude(kind__in=exclude)
+    done = set(days.values_list("day", flat=True).distinct())
+    for r in rolled.values(*fields).annotate(n=Sum("visits")).order_by():
+        key = tuple(r[f] for f in fields)
+        totals[key] = totals.get(key, 0) + r["n"]
+
+    raw_fields = {"kind": "referer__kind", "host": "referer__host", "source": "utm__source",
+                  "medium": "utm__medium", "campaign": "utm__campaign"}
+    raw = Visit.objects.filter(is_bot=False, ts__date__range=(start, end)).exclude(ts__date__in=done)
+    if DIRECT in exclude:
+        raw = raw.filter(referer__isnull=False)
+    raw = raw.exclude(referer__kind__in=[k for k in exclude if k != DIRECT])
+    for r in raw.values(*(raw_fields[f] for f in fields)).annotate(n=Sum("weight")).order_by():
+        key = tuple(_kind(r[raw_fields[f]]) if f == "kind" else r[raw_fields[f]] or "" for f in fields)
+        totals[key] = totals.get(key, 0) + r["n"]
+
+    ranked = sorted(totals.items(), key=lambda kv: -kv[1])[:limit]
+    return [{**dict(zip(fields, key)), "count": n} for key, n in ranked]
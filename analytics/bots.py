@@ -0,0 +1,144 @@
+"""
+Bot classification for VisitMiddleware.
+
+A request is a bot when any of these match, cheapest first:
+
+  ua       empty UA, BOT_REGEX or a known crawler/HTTP-library token (lru-cached per UA)
+  ip       address inside a crawler range (built-ins + ANALYTICS_BOT_IP_RANGES)
+  rate     more than ANALYTICS_BOT_RATE_LIMIT page views per ANALYTICS_BOT_WINDOW_S
+           from one ip_hash (sliding window over cache buckets)
+
+Only page views count toward the rate: GET/HEAD requests outside
+RATE_SKIP_PREFIXES (API calls, beacons, metrics), which one open page keeps
+making on its own. A rate verdict applies to the page views over the limit
+only. The window lets the address back in as soon as it slows down, so a
+shared network (church wifi, campus NAT) isn't flagged wholesale for
+minutes after a busy moment. The "ip" verdict (crawler ranges) never
+changes for an address, so it is cached per ip_hash for
+ANALYTICS_BOT_IP_TTL seconds.
+
+ANALYTICS_BOT_MODE decides what happens to bot visits: "store" (keep every
+row, flagged is_bot), "sample" (keep 1 in ANALYTICS_BOT_SAMPLE) or "drop".
+Skipped rows are counted per day and reason in the cache (see counters()).
+"""
+import ipaddress
+import random
+import re
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+BOT_REGEX = re.compile(
+    r"bot|crawl|spider|slurp|bingpreview|crawler|facebookexternalhit|whatsapp|telegram|curl|python-requests|fetch|monitoring",
+    re.I,
+)
+KNOWN_CRAWLERS = (
+    "googlebot", "bingbot", "yandex", "baiduspider", "duckduckbot", "applebot", "petalbot", "bytespider",
+    "ahrefs", "semrush", "mj12bot", "dotbot", "gptbot", "ccbot", "amazonbot", "headlesschrome", "phantomjs",
+    "lighthouse", "pingdom", "uptimerobot", "go-http-client", "okhttp", "wget", "libwww", "java/", "scrapy",
+    "httpclient", "axios", "node-fetch", "aiohttp", "httpx",
+)
+# published crawler ranges (Googlebot, Bingbot); extend with ANALYTICS_BOT_IP_RANGES
+DEFAULT_IP_RANGES = ("66.249.64.0/19", "157.55.39.0/24", "207.46.13.0/24", "40.77.167.0/24")
+
+MODE = getattr(settings, "ANALYTICS_BOT_MODE", "store")
+SAMPLE = max(1, getattr(settings, "ANALYTICS_BOT_SAMPLE", 10))
+RATE_LIMIT = getattr(settings, "ANALYTICS_BOT_RATE_LIMIT", 120)
+WINDOW_S = getattr(settings, "ANALYTICS_BOT_WINDOW_S", 60)
+IP_TTL = getattr(settings, "ANALYTICS_BOT_IP_TTL", 600)
+RATE_SKIP_PREFIXES = tuple(getattr(settings, "ANALYTICS_BOT_RATE_SKIP",
+                                   ("/api/", "/analytics/api/", "/analytics/event/", "/analytics/metrics/")))
+_SLOTS = 6  # the window is tracked as this many cache buckets
+_SLOT_S = max(1, WINDOW_S // _SLOTS)
+REASONS = ("ua", "ip", "rate")
+
+_NETWORKS = tuple(ipaddress.ip_network(c, strict=False)
+                  for c in DEFAULT_IP_RANGES + tuple(getattr(settings, "ANALYTICS_BOT_IP_RANGES", ())))
+
+
+@lru_cache(maxsize=8192)
+def ua_is_bot(ua: str) -> bool:
+    if not ua:
+        return True
+    if BOT_REGEX.search(ua):
+        return True
+    low = ua.lower()
+    return any(token in low for token in KNOWN_CRAWLERS)
+
+
+def ip_in_ranges(ip: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(addr in net for net in _NETWORKS if net.version == addr.version)
+
+
+def is_page_view(request) -> bool:
+    """Whether a request counts toward the rate check."""
+    return request.method in ("GET", "HEAD") and not request.path.startswith(RATE_SKIP_PREFIXES)
+
+
+def _rate(ip_hash: str, now: float) -> int:
+    """Count this request and return the total for ip_hash over the sliding window."""
+    slot = int(now // _SLOT_S)
+    key = f"bots:r:{ip_hash}:{slot}"
+    if not cache.add(key, 1, WINDOW_S + _SLOT_S):
+        try:
+            cache.incr(key)
+        except ValueError:  # expired between add and incr
+            cache.add(key, 1, WINDOW_S + _SLOT_S)
+    counts = cache.get_many([f"bots:r:{ip_hash}:{slot - i}" for i in range(_SLOTS)])
+    return sum(counts.values())
+
+
+def classify(ua: str, ip: str | None, ip_hash: str, now: float | None = None, page_view: bool = True) -> str:
+    """Return the reason the request looks automated ("ua", "ip", "rate") or "" for a human."""
+    if ua_is_bot(ua):
+        return "ua"
+    if not ip_hash:
+        return ""
+    flagged = cache.get(f"bots:ip:{ip_hash}")
+    if flagged is None:
+        flagged = "ip" if ip and ip_in_ranges(ip) else ""
+        if flagged:
+            cache.set(f"bots:ip:{ip_hash}", flagged, IP_TTL)
+    if flagged:
+        return flagged
+    if page_view and RATE_LIMIT and _rate(ip_hash, now or time.time()) > RATE_LIMIT:
+        return "rate"
+    return ""
+
+
+def should_store(reason: str) -> bool:
+    """Apply ANALYTICS_BOT_MODE to a classified request; counts what is skipped."""
+    if not reason or MODE == "store":
+        return True
+    if MODE == "sample" and random.randrange(SAMPLE) == 0:
+        return True
+    _count(reason)
+    return False
+
+
+def _counter_key(day, reason: str) -> str:
+    return f"bots:dropped:{day.isoformat()}:{reason}"
+
+
+def _count(reason: str) -> None:
+    key = _counter_key(timezone.localdate(), reason)
+    if not cache.add(key, 1, 60 * 60 * 24 * 8):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, 60 * 60 * 24 * 8)
+
+
+def counters(day=None) -> dict:
+    """Visits not stored on `day` (default today), by reason."""
+    day = day or timezone.localdate()
+    got = cache.get_many([_counter_key(day, r) for r in REASONS])
+    return {"day": day.isoformat(), "mode": MODE,
+            "dropped": {r: got.get(_counter_key(day, r), 0) for r in REASONS}}
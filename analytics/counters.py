@@ -0,0 +1,248 @@
+"""
+Denormalized play counters (SermonStats), maintained at ingest.
+
+event_collect and the player's progress beacon call record(); increments are summed in a
+per-process buffer keyed by sermon id and written at most every
+ANALYTICS_COUNTER_FLUSH_S seconds as one `UPDATE ... SET plays = plays + CASE id ... END`
+for all touched sermons, so concurrent workers never overwrite each other.
+Reads never flush: top() adds this process's pending increments to the stored values.
+
+Trending uses forward decay: a play at time t adds 2^((t - base) / H) to
+`trending`, where H is ANALYTICS_TRENDING_HALF_LIFE_H and `base` is a
+landmark shared by all rows. All rows are scaled by the same factor, so
+ORDER BY trending ranks by exponentially decayed plays, and the true score is
+trending * 2^(-(now - base) / H). The landmark advances every 30 half-lives
+and the first flush or read after that rescales older rows in one UPDATE,
+which keeps the weights bounded.
+
+"Top" and "trending" lists are then one indexed ORDER BY ... LIMIT on
+SermonStats instead of a GROUP BY over Event.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import BigIntegerField, Case, F, FloatField, Value, When
+from django.db.models.functions import Power
+from django.utils import timezone
+
+log = logging.getLogger(__name__)
+
+FLUSH_S = getattr(settings, "ANALYTICS_COUNTER_FLUSH_S", 10)
+HALF_LIFE_S = getattr(settings, "ANALYTICS_TRENDING_HALF_LIFE_H", 48) * 3600
+REBASE_S = 30 * HALF_LIFE_S
+PROGRESS_STEP_S = 15  # player.js sends a progress beacon every 15s of playback
+COMPLETE_EVENTS = {"complete", "completed", "ended"}
+COMPLETE_TTL = 6 * 60 * 60  # a listener's finish counts once per this window
+SLUG_TTL = 60 * 60
+WRITE_BATCH = 500  # sermons per UPDATE
+
+
+def landmark(now: float) -> int:
+    return int(now // REBASE_S * REBASE_S)
+
+
+def weight(now: float, base: int) -> float:
+    return 2 ** ((now - base) / HALF_LIFE_S)
+
+
+def sermon_id(slug: str) -> int | None:
+    """Sermon id for a slug (cached; unknown slugs are cached as 0)."""
+    if not slug:
+        return None
+    key = f"sermon:id:{slug}"
+    sid = cache.get(key)
+    if sid is None:
+        from stream.models import Sermon
+        sid = Sermon.objects.filter(slug=slug).values_list("id", flat=True).first() or 0
+        cache.set(key, sid, SLUG_TTL)
+    return sid or None
+
+
+_rebased_to = 0
+
+
+def rebase(base: int) -> None:
+    """Rescale rows still relative to an older landmark (a no-op after the first call per landmark)."""
+    global _rebased_to
+    if _rebased_to >= base:
+        return
+    from .models import SermonStats
+    SermonStats.objects.filter(trending_base__lt=base).update(
+        trending=F("trending") * Power(Value(2.0), (F("trending_base") - Value(base)) / Value(float(HALF_LIFE_S))),
+        trending_base=base,
+    )
+    _rebased_to = base
+
+
+class CounterBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}  # sermon id -> [plays, completions, listen_s]
+        self._since = None
+
+    def add(self, sid: int, plays=0, completions=0, listen_s=0, now: float | None = None):
+        now = now or time.time()
+        with self._lock:
+            row = self._pending.setdefault(sid, [0, 0, 0])
+            row[0] += plays
+            row[1] += completions
+            row[2] += listen_s
+            if self._since is None:
+                self._since = now
+            due = now - self._since >= FLUSH_S
+        if due:
+            self.flush(now)
+
+    def pending(self) -> dict:
+        """A copy of the increments not written yet: {sermon id: (plays, completions, listen_s)}."""
+        with self._lock:
+            return {sid: tuple(row) for sid, row in self._pending.items()}
+
+    def flush(self, now: float | None = None) -> int:
+        with self._lock:
+            pending, self._pending, self._since = self._pending, {}, None
+        if not pending:
+            return 0
+        try:
+            write(pending, now or time.time())
+        except Exception:
+            log.exception("flushing %d sermon counters failed", len(pending))
+        return len(pending)
+
+
+def write(pending: dict, now: float) -> None:
+    from .models import SermonStats
+
+    base = landmark(now)
+    rebase(base)
+    w = weight(now, base)
+    ts = timezone.now()
+    SermonStats.objects.bulk_create(
+        [SermonStats(sermon_id=sid, trending_base=base) for sid in pending], ignore_conflicts=True
+    )
+    items = list(pending.items())
+    for i in range(0, len(items), WRITE_BATCH):
+        batch = items[i:i + WRITE_BATCH]
+
+        def delta(column, scale=1, output=BigIntegerField()):
+            return Case(*[When(pk=sid, then=Value(row[column] * scale)) for sid, row in batch],
+                        default=Value(0 * scale), output_field=output)
+
+        SermonStats.objects.filter(pk__in=[sid for sid, _ in batch]).update(
+            plays=F("plays") + delta(0),
+            completions=F("completions") + delta(1),
+            listen_s=F("listen_s") + delta(2),
+            trending=F("trending") + delta(0, w, FloatField()),
+            updated_at=ts,
+        )
+
+
+buffer = CounterBuffer()
+atexit.register(buffer.flush)
+
+
+def record(slug: str, plays=0, completions=0, listen_s=0) -> None:
+    sid = sermon_id(slug)
+    if sid:
+        buffer.add(sid, plays, completions, listen_s)
+
+
+def record_event(event: str, slug: str) -> None:
+    if event == "play":
+        record(slug, plays=1)
+    elif event in COMPLETE_EVENTS:
+        record(slug, completions=1)
+
+
+def record_progress(slug: str, position_s: int, listener: str, completed=False) -> None:
+    """Credit PROGRESS_STEP_S listen-seconds per beacon and one completion per listener; repeats are ignored."""
+    step = max(position_s, 0) // PROGRESS_STEP_S
+    listen = PROGRESS_STEP_S if cache.add(f"listen:{listener}:{slug}:{step}", 1, PROGRESS_STEP_S * 4) else 0
+    done = int(completed and cache.add(f"listen:{listener}:{slug}:done", 1, COMPLETE_TTL))
+    if listen or done:
+        record(slug, completions=done, listen_s=listen)
+
+
+TOP_FIELDS = ("plays", "completions", "listen_s")
+
+
+def top(by: str = "plays", limit: int = 5) -> list[dict]:
+    """
+    Most played ("plays", "completions", "listen_s") or trending ("trending") sermons.
+
+    Stored values plus this process's unflushed increments. Pending counts only
+    grow a row, so only the stored top `limit` and the pending sermons can rank.
+    """
+    from stream.models import Sermon
+    from .models import SermonStats
+
+    if by not in TOP_FIELDS + ("trending",):
+        raise ValueError(f"unknown ordering {by!r}")
+    now = time.time()
+    rebase(landmark(now))
+    rows = {r["sermon_id"]: r for r in (
+        SermonStats.objects.filter(**{f"{by}__gt": 0}).order_by(f"-{by}")
+        .values("sermon_id", "sermon__slug", "sermon__title", *TOP_FIELDS, "trending", "trending_base")[:limit]
+    )}
+    pending = buffer.pending()
+    missing = [sid for sid in pending if sid not in rows]
+    if missing:
+        for r in Sermon.objects.filter(pk__in=missing).values(
+            "slug", "title", sermon_id=F("id"), **{f: F(f"stats__{f}") for f in TOP_FIELDS + ("trending", "trending_base")}
+        ):
+            rows[r["sermon_id"]] = {**r, "sermon__slug": r["slug"], "sermon__title": r["title"]}
+
+    out = []
+    for sid, r in rows.items():
+        plays, completions, listen_s = pending.get(sid, (0, 0, 0))
+        # a just-buffered play has (practically) no decay yet, so it adds 1 to the true score
+        trending = (r["trending"] or 0) / weight(now, r["trending_base"] or landmark(now)) + plays
+        row = {
+            "slug": r["sermon__slug"], "title": r["sermon__title"], "count": (r["plays"] or 0) + plays,
+            "plays": (r["plays"] or 0) + plays, "completions": (r["completions"] or 0) + completions,
+            "listen_s": (r["listen_s"] or 0) + listen_s, "trending": round(trending, 2),
+        }
+        if row[by] > 0:
+            out.append(row)
+    out.sort(key=lambda row: -row[by])
+    return out[:limit]
+
+
+def rebuild(log=print) -> int:
+    """Recompute plays and trending from Event (+ archived "play" rollups); completions and listen_s are kept."""
+    from django.db.models import Sum
+    from stream.models import Sermon
+    from .models import Event, Rollup, SermonStats
+
+    buffer.flush()
+    now = time.time()
+    base = landmark(now)
+    ids = dict(Sermon.objects.values_list("slug", "id"))
+    stats = {}
+
+    def row(slug):
+        sid = ids.get(slug)
+        return stats.setdefault(sid, {"plays": 0, "trending": 0.0}) if sid else None
+
+    for r in Event.objects.filter(event="play").values("slug", "ts__date").annotate(n=Sum("weight")).order_by():
+        s = row(r["slug"])
+        if s:
+            s["plays"] += r["n"]
+            day_ts = time.mktime(r["ts__date"].timetuple()) + 12 * 3600
+            s["trending"] += r["n"] * weight(day_ts, base)
+    for r in Rollup.objects.filter(kind="play").values("key").annotate(n=Sum("count")).order_by():
+        s = row(r["key"])
+        if s:
+            s["plays"] += r["n"]
+
+    existing = set(SermonStats.objects.values_list("sermon_id", flat=True))
+    objs = [SermonStats(sermon_id=sid, trending_base=base, updated_at=timezone.now(), **v) for sid, v in stats.items()]
+    SermonStats.objects.bulk_create([o for o in objs if o.sermon_id not in existing], batch_size=1000)
+    SermonStats.objects.bulk_update([o for o in objs if o.sermon_id in existing],
+                                    ["plays", "trending", "trending_base", "updated_at"], batch_size=1000)
+    log(f"  {len(objs)} sermons with plays")
+    return len(objs)
@@ -0,0 +1,254 @@
+"""
+Id lookups for the Visit dimension tables.
+
+Each DimensionCache keeps a bounded LRU of value-hash -> id in process
+memory, so after warm-up an ingest costs no extra queries; a miss is one
+indexed SELECT, or an INSERT the first time a value is seen. Inside a
+transaction an id is only cached once it commits, so a rollback can't leave
+ids of rows that no longer exist behind.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.db import IntegrityError, connection, transaction
+
+from .attribution import parse_referer
+from .models import PathDim, RefererDim, UserAgentDim, UtmDim
+
+UTM_KEYS = ("utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content")
+
+
+def value_hash(*parts) -> str:
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8", "replace")).hexdigest()
+
+
+class DimensionCache:
+    def __init__(self, model, maxsize=20000, derive=None):
+        self.model = model
+        self.maxsize = maxsize
+        self.derive = derive  # values -> extra columns filled in when a row is first inserted
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def id_for(self, values: dict) -> int:
+        """`values` are the model's value fields; returns the row id, creating it if needed."""
+        h = value_hash(*values.values())
+        with self._lock:
+            pk = self._ids.get(h)
+            if pk is not None:
+                self._ids.move_to_end(h)
+                return pk
+        pk = self.model.objects.filter(value_hash=h).values_list("id", flat=True).first()
+        if pk is None:
+            try:
+                with transaction.atomic():
+                    extra = self.derive(values) if self.derive else {}
+                    pk = self.model.objects.create(value_hash=h, **values, **extra).id
+            except IntegrityError:  # another worker inserted it first
+                pk = self.model.objects.values_list("id", flat=True).get(value_hash=h)
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda: self._remember(h, pk))
+        else:
+            self._remember(h, pk)
+        return pk
+
+    def _remember(self, h: str, pk: int):
+        with self._lock:
+            self._ids[h] = pk
+            if len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+paths = DimensionCache(PathDim)
+referers = DimensionCache(RefererDim, derive=lambda v: parse_referer(v["value"]))
+user_agents = DimensionCache(UserAgentDim)
+utms = DimensionCache(UtmDim, maxsize=5000)
+
+
+def path_id(path: str):
+    return paths.id_for({"value": path[:512]}) if path else None
+
+
+def referer_id(referer: str):
+    return referers.id_for({"value": referer[:1024]}) if referer else None
+
+
+def ua_id(ua: str):
+    return user_agents.id_for({"value": ua}) if ua else None
+
+
+def utm_id(utm: dict):
+    """`utm` maps utm_source..utm_content to strings; all blank -> None."""
+    vals = [(utm.get(k) or "")[:64] for k in UTM_KEYS]
+    if not any(vals):
+        return None
+    return utms.id_for(dict(zip(("source", "medium", "campaign", "term", "content"), vals)))
+
+
+def resolve(rows, field: str, model):
+    """Replace dimension ids in `rows[i][field]` with their values (one IN query)."""
+    rows = list(rows)
+    ids = {r[field] for r in rows if r[field] is not None}
+    values = dict(model.objects.filter(id__in=ids).values_list("id", "value")) if ids else {}
+    for r in rows:
+        r[field] = values.get(r[field], "")
+    return rows
+
+
+# -------- conversion of pre-dimension rows --------
+#
+# No migrations are tracked in this repo, so the conversion of an existing
+# analytics_visit table is shipped as three explicit, re-runnable steps
+# (manage.py migrate_visit_dimensions add|backfill|drop):
+#
+#   add       create the dimension tables and the nullable FK columns + indexes,
+#             and make the legacy columns nullable: new Visit rows only fill the
+#             FKs, which strict MySQL would refuse while those are NOT NULL
+#   backfill  fill the FKs from the legacy columns in id batches (resumable)
+#   drop      drop the legacy inline columns once every row has a path_id
+
+LEGACY_COLUMNS = ("path", "ua", "referer") + UTM_KEYS
+FK_FIELDS = ("path", "referer", "ua", "utm")
+
+
+def _visit_columns() -> set:
+    from .models import Visit
+    with connection.cursor() as cur:
+        return {c.name for c in connection.introspection.get_table_description(cur, Visit._meta.db_table)}
+
+
+def legacy_columns_present() -> bool:
+    return set(LEGACY_COLUMNS) <= _visit_columns()
+
+
+def _relax_legacy_columns(log) -> list:
+    """Make NOT NULL legacy columns nullable; returns the columns changed."""
+    from .models import Visit
+
+    table = Visit._meta.db_table
+    with connection.cursor() as cur:
+        strict = [c.name for c in connection.introspection.get_table_description(cur, table)
+                  if c.name in LEGACY_COLUMNS and not c.null_ok]
+    if not strict:
+        return []
+    qn = connection.ops.quote_name
+    if connection.vendor == "mysql":
+        with connection.cursor() as cur:
+            cur.execute(
+                "SELECT COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", [table],
+            )
+            types = dict(cur.fetchall())
+        statements = [f"ALTER TABLE {qn(table)} MODIFY {qn(c)} {types[c]} NULL" for c in strict]
+    elif connection.vendor == "postgresql":
+        statements = [f"ALTER TABLE {qn(table)} ALTER COLUMN {qn(c)} DROP NOT NULL" for c in strict]
+    else:
+        log(f"can't make {', '.join(strict)} nullable on {connection.vendor}; "
+            f"run backfill and drop before new visits are recorded")
+        return []
+    with connection.cursor() as cur:
+        for sql in statements:
+            cur.execute(sql)
+    for c in strict:
+        log(f"made {table}.{c} nullable")
+    return [f"{table}.{c}" for c in strict]
+
+
+def add_dimension_columns(log=None) -> list:
+    """Step 1: dimension tables, Visit FK columns and their indexes, nullable legacy columns. Returns what changed."""
+    from .models import Visit
+
+    log = log or (lambda msg: None)
+    tables = set(connection.introspection.table_names())
+    columns = _visit_columns()
+    models = [m for m in (PathDim, RefererDim, UserAgentDim, UtmDim) if m._meta.db_table not in tables]
+    fields = [f for f in map(Visit._meta.get_field, FK_FIELDS) if f.column not in columns]
+    added = []
+    if models or fields:
+        with connection.schema_editor() as editor:
+            for model in models:
+                editor.create_model(model)
+                added.append(model._meta.db_table)
+            for field in fields:
+                editor.add_field(Visit, field)  # nullable, no constraint: a plain ADD COLUMN + index
+                added.append(f"{Visit._meta.db_table}.{field.column}")
+    with connection.cursor() as cur:
+        existing = set(connection.introspection.get_constraints(cur, Visit._meta.db_table))
+    indexes = [i for i in Visit._meta.indexes
+               if i.name not in existing and any(f.lstrip("-") in FK_FIELDS for f in i.fields)]
+    if indexes:
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.add_index(Visit, index)
+                added.append(index.name)
+    for item in added:
+        log(f"added {item}")
+    return added + _relax_legacy_columns(log)
+
+
+def drop_legacy_columns(log=None) -> list:
+    """Step 3: drop the inline columns; refuses while rows are still waiting for the backfill."""
+    from .models import Visit
+
+    log = log or (lambda msg: None)
+    table = Visit._meta.db_table
+    columns = _visit_columns()
+    present = [c for c in LEGACY_COLUMNS if c in columns]
+    if not present:
+        return []
+    if "path_id" not in columns or Visit.objects.filter(path__isnull=True).exists():
+        raise ValueError("some visits have no path_id yet; run the backfill step first")
+    with connection.cursor() as cur:
+        constraints = connection.introspection.get_constraints(cur, table)
+    with connection.schema_editor() as editor:
+        # SQLite won't drop an indexed column; MySQL would just shrink the index
+        for name, info in constraints.items():
+            if info["index"] and not info["primary_key"] and set(info["columns"]) & set(present):
+                editor.execute(editor._delete_index_sql(Visit, name))
+        for column in present:
+            editor.execute(editor.sql_delete_column % {
+                "table": editor.quote_name(table), "column": editor.quote_name(column),
+            })
+            log(f"dropped {table}.{column}")
+    return present
+
+
+def backfill_visit_dimensions(batch_size=2000, log=None) -> int:
+    """
+    Fill path/ua/referer/utm FKs from the legacy inline columns, in id order,
+    for rows that don't have a path_id yet (so it can be stopped and resumed).
+    Step 2: run it after add_dimension_columns and before drop_legacy_columns.
+    """
+    from .models import Visit
+
+    log = log or (lambda msg: None)
+    table = connection.ops.quote_name(Visit._meta.db_table)
+    cols = ", ".join(connection.ops.quote_name(c) for c in ("id",) + LEGACY_COLUMNS)
+    sql = (f"SELECT {cols} FROM {table} WHERE {connection.ops.quote_name('path_id')} IS NULL "
+           f"AND {connection.ops.quote_name('id')} > %s ORDER BY {connection.ops.quote_name('id')} LIMIT %s")
+    last_id, done = 0, 0
+    while True:
+        with connection.cursor() as cur:
+            cur.execute(sql, [last_id, batch_size])
+            rows = cur.fetchall()
+        if not rows:
+            break
+        batch = []
+        for pk, path, ua, referer, *utm in rows:
+            batch.append(Visit(
+                id=pk,
+                path_id=path_id(path or "/"),
+                ua_id=ua_id(ua or ""),
+                referer_id=referer_id(referer or ""),
+                utm_id=utm_id(dict(zip(UTM_KEYS, utm))),
+            ))
+        Visit.objects.bulk_update(batch, ["path", "ua", "referer", "utm"])
+        last_id = rows[-1][0]
+        done += len(rows)
+        log(f"converted {done} visits (last id {last_id})")
+    return done
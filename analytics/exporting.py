@@ -0,0 +1,277 @@
+"""
+Constant-memory exports of the raw Visit/Event tables for BI tools.
+
+Rows are read in keyset pages (`id > last`, ordered by id) and each page is
+consumed with `.iterator()`, so neither Django nor the DB driver holds more
+than one page. Writers emit bytes into a small buffer that is drained after
+every page; the same writer feeds a StreamingHttpResponse or a temp file
+that an ExportJob saves to private local storage (analytics.storages).
+
+A background job runs on a daemon thread in the web worker and stamps
+`heartbeat_at` after every page. A restart kills the thread without a
+trace, so fail_stale_jobs() marks pending/running jobs whose heartbeat is
+older than ANALYTICS_EXPORT_STALE_S as failed. It runs whenever jobs are
+started or listed in the admin.
+
+Formats: "csv", "jsonl.gz" and "parquet" (needs pyarrow; one row group per page).
+"""
+import csv
+import gzip
+import json
+import logging
+import threading
+from datetime import timedelta
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import storages
+from .models import ExportJob, PathDim, RefererDim, UserAgentDim, UtmDim
+
+log = logging.getLogger(__name__)
+
+STALE_S = getattr(settings, "ANALYTICS_EXPORT_STALE_S", 900)
+PAGE_SIZE = 20000   # rows per keyset query
+CHUNK_SIZE = 2000   # rows fetched per round trip within a page
+FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "jsonl.gz": ("application/gzip", ".jsonl.gz"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+DIMENSIONS = (PathDim, RefererDim, UserAgentDim)
+
+
+def columns_for(model) -> list[tuple[str, str]]:
+    """(column name, ORM lookup); dimension FKs are exported as their values, other FKs as ids."""
+    cols = []
+    for f in model._meta.concrete_fields:
+        if f.is_relation and f.related_model is UtmDim:
+            cols += [(f"utm_{k}", f"{f.name}__{k}") for k in ("source", "medium", "campaign", "term", "content")]
+        elif f.is_relation and f.related_model in DIMENSIONS:
+            cols.append((f.name, f"{f.name}__value"))
+        else:
+            cols.append((f.attname, f.attname))
+    return cols
+
+
+def iter_pages(queryset, lookups, page_size=PAGE_SIZE, chunk_size=CHUNK_SIZE):
+    """Yield lists of value tuples in id order; the first lookup must be "id"."""
+    qs = queryset.order_by("id").values_list(*lookups)
+    last = None
+    while True:
+        page_qs = qs if last is None else qs.filter(id__gt=last)
+        page = list(page_qs[:page_size].iterator(chunk_size=chunk_size))
+        if not page:
+            return
+        yield page
+        last = page[-1][0]
+        if len(page) < page_size:
+            return
+
+
+# -------- writers --------
+
+class _Buffer:
+    """Write-only file object whose contents are handed out and dropped by drain()."""
+
+    def __init__(self):
+        self._parts, self._pos = [], 0
+
+    def write(self, b):
+        if isinstance(b, str):
+            b = b.encode("utf-8")
+        self._parts.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    @property
+    def closed(self):
+        return False
+
+    def drain(self) -> bytes:
+        out, self._parts = b"".join(self._parts), []
+        return out
+
+
+class CsvWriter:
+    def __init__(self, out, names):
+        self._csv = csv.writer(_TextAdapter(out))
+        self._csv.writerow(names)
+
+    def write_rows(self, rows):
+        self._csv.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class _TextAdapter:
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, s):
+        return self.out.write(s.encode("utf-8"))
+
+
+class JsonlGzWriter:
+    def __init__(self, out, names):
+        self.names = names
+        self._gz = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6)
+
+    def write_rows(self, rows):
+        lines = [json.dumps(dict(zip(self.names, r)), cls=DjangoJSONEncoder, separators=(",", ":")) for r in rows]
+        self._gz.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+    def close(self):
+        self._gz.close()
+
+
+class ParquetWriter:
+    def __init__(self, out, names):
+        self.out, self.names, self._writer = out, names, None
+
+    def write_rows(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_arrays([pa.array(list(col)) for col in zip(*rows)], names=self.names)
+        if self._writer is None:
+            # a column that is all NULL in the first page has no type yet; store it as text
+            schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                                for f in table.schema])
+            self._writer = pq.ParquetWriter(self.out, schema, compression="snappy")
+        if table.schema != self._writer.schema:
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+WRITERS = {"csv": CsvWriter, "jsonl.gz": JsonlGzWriter, "parquet": ParquetWriter}
+
+
+def check_format(fmt: str) -> None:
+    """Raise ValueError for formats that can't be written here."""
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format {fmt!r} (choose from {', '.join(FORMATS)})")
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+
+
+def _writer(fmt, out, names):
+    check_format(fmt)
+    return WRITERS[fmt](out, names)
+
+
+# -------- outputs --------
+
+def iter_export(queryset, fmt: str, page_size=PAGE_SIZE):
+    """Yield the export as byte chunks (one per page) for a StreamingHttpResponse."""
+    cols = columns_for(queryset.model)
+    buf = _Buffer()
+    writer = _writer(fmt, buf, [c for c, _ in cols])
+    for page in iter_pages(queryset, [lookup for _, lookup in cols], page_size):
+        writer.write_rows(page)
+        chunk = buf.drain()
+        if chunk:
+            yield chunk
+    writer.close()
+    yield buf.drain()
+
+
+def export_filename(model, fmt: str) -> str:
+    return f"{model._meta.db_table}-{timezone.now():%Y%m%d-%H%M%S}{FORMATS[fmt][1]}"
+
+
+def write_export(queryset, fmt: str, fileobj, progress=None, page_size=PAGE_SIZE) -> int:
+    """Write the export into a binary file object; progress(rows_done) is called after each page."""
+    cols = columns_for(queryset.model)
+    writer = _writer(fmt, fileobj, [c for c, _ in cols])
+    done = 0
+    for page in iter_pages(queryset, [lookup for _, lookup in cols], page_size):
+        writer.write_rows(page)
+        done += len(page)
+        if progress:
+            progress(done)
+    writer.close()
+    return done
+
+
+def save_export(queryset, fmt: str, progress=None) -> tuple[str, int]:
+    """Export to a temp file, then save it under an HMAC'd name in private export storage."""
+    with NamedTemporaryFile(suffix=FORMATS[fmt][1]) as tmp:
+        n = write_export(queryset, fmt, tmp, progress=progress)
+        tmp.flush()
+        tmp.seek(0)
+        stem = export_filename(queryset.model, fmt)[: -len(FORMATS[fmt][1])]
+        name = storages.exports.save(storages.signed_name(stem, FORMATS[fmt][1]), File(tmp))
+    return name, n
+
+
+# -------- background jobs --------
+
+def run_job(job: ExportJob, queryset) -> ExportJob:
+    """Run an ExportJob in the current thread, recording progress on the row."""
+    ExportJob.objects.filter(pk=job.pk).update(
+        status=ExportJob.RUNNING, rows_total=queryset.count(), heartbeat_at=timezone.now()
+    )
+
+    def progress(n):
+        ExportJob.objects.filter(pk=job.pk).update(rows_done=n, heartbeat_at=timezone.now())
+
+    try:
+        name, n = save_export(queryset, job.fmt, progress=progress)
+        ExportJob.objects.filter(pk=job.pk).update(
+            status=ExportJob.DONE, file=name, rows_done=n, finished_at=timezone.now()
+        )
+    except Exception as e:
+        log.exception("analytics export %s failed", job.pk)
+        ExportJob.objects.filter(pk=job.pk).update(
+            status=ExportJob.FAILED, error=str(e)[:1000], finished_at=timezone.now()
+        )
+    job.refresh_from_db()
+    return job
+
+
+def fail_stale_jobs(now=None) -> int:
+    """Mark pending/running jobs with no heartbeat for STALE_S as failed (their worker is gone)."""
+    now = now or timezone.now()
+    return (ExportJob.objects
+            .filter(status__in=(ExportJob.PENDING, ExportJob.RUNNING))
+            .alias(seen=Coalesce("heartbeat_at", "created_at"))
+            .filter(seen__lt=now - timedelta(seconds=STALE_S))
+            .update(status=ExportJob.FAILED, error="worker stopped before the export finished", finished_at=now))
+
+
+def start_job(queryset, fmt: str, user=None, description: str = "") -> ExportJob:
+    """Create an ExportJob and run it on a daemon thread; poll the row for progress."""
+    check_format(fmt)
+    fail_stale_jobs()
+    job = ExportJob.objects.create(
+        model=queryset.model._meta.label_lower, fmt=fmt, created_by=user, description=description[:255]
+    )
+
+    def target():
+        try:
+            run_job(job, queryset)
+        finally:
+            close_old_connections()
+
+    threading.Thread(target=target, name=f"analytics-export-{job.pk}", daemon=True).start()
+    return job
@@ -0,0 +1,102 @@
+"""
+Anonymous visitor identity for analytics.
+
+ANALYTICS_IDENTITY chooses what identifies a visitor:
+
+  "cookie"   (default) the signed, long-lived `v_id` cookie alone; no session
+             is created for anonymous traffic, so page views and beacons cause
+             no session writes. Sessions still appear when something needs
+             them (login, messages that overflow the cookie, ...).
+  "session"  legacy behaviour: also force a session for every visitor so
+             Visit.session_key is always filled (one session write per new
+             visitor, and per request with SESSION_SAVE_EVERY_REQUEST).
+
+Older unsigned `v_id` cookies (a bare UUID) are migrated by the visit
+middleware: the first page view re-issues the same id signed, so existing
+visitors keep it. Until then an unsigned id is not an identity anywhere else
+(beacons, rate limits), and after ANALYTICS_LEGACY_VID_UNTIL it is ignored and
+the visitor gets a new id.
+
+client_ip()/ip_hash() are the one place the client address is read, for
+visits, events, plays, bot checks and rate limits alike.
+ANALYTICS_TRUSTED_PROXIES is the number of reverse proxies in front of
+the app. Each one appends the address it was connected from to
+X-Forwarded-For, so the client is that many entries from the right.
+Anything further left was sent by the client itself.
+"""
+import datetime
+import hashlib
+import uuid
+
+from django.conf import settings
+
+MODE = getattr(settings, "ANALYTICS_IDENTITY", "cookie")
+TRUSTED_PROXIES = getattr(settings, "ANALYTICS_TRUSTED_PROXIES", 1)
+COOKIE = "v_id"
+SALT = "analytics.v_id"
+MAX_AGE = 60 * 60 * 24 * 365 * 2
+LEGACY_UNTIL = getattr(settings, "ANALYTICS_LEGACY_VID_UNTIL", None)  # ISO date; None: no migration
+
+
+def _legacy(value, today: datetime.date | None = None) -> str | None:
+    """The id in an unsigned legacy cookie, while the migration window is open."""
+    if not LEGACY_UNTIL or (today or datetime.date.today()) > datetime.date.fromisoformat(str(LEGACY_UNTIL)):
+        return None
+    try:
+        return str(uuid.UUID(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def visitor_id(request) -> tuple[str, bool]:
+    """
+    (visitor id, whether the cookie must be (re)issued); a new id is minted if there is none.
+
+    Only the visit middleware calls this, as it is the one place that sets the
+    cookie: a legacy id is returned here exactly when it is re-issued signed.
+    """
+    cached = getattr(request, "_analytics_visitor", None)
+    if cached is not None:
+        return cached
+    vid = request.get_signed_cookie(COOKIE, default=None, salt=SALT)
+    if vid:
+        result = (vid, False)
+    else:
+        result = (_legacy(request.COOKIES.get(COOKIE)) or str(uuid.uuid4()), True)
+    request._analytics_visitor = result
+    return result
+
+
+def existing_visitor_id(request) -> str:
+    """The visitor id from a validly signed cookie, or "" without minting one (unsigned ids don't count)."""
+    return request.get_signed_cookie(COOKIE, default=None, salt=SALT) or ""
+
+
+def client_ip(request) -> str:
+    """The address the outermost trusted proxy saw, else REMOTE_ADDR ("" if neither)."""
+    hops = [h.strip() for h in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if h.strip()]
+    if TRUSTED_PROXIES and len(hops) >= TRUSTED_PROXIES:
+        return hops[-TRUSTED_PROXIES]
+    return request.META.get("REMOTE_ADDR") or ""
+
+
+def ip_hash(ip: str) -> str:
+    return hashlib.sha256(ip.encode()).hexdigest()[:32] if ip else ""
+
+
+def set_cookie(response, vid: str) -> None:
+    response.set_signed_cookie(COOKIE, vid, salt=SALT, max_age=MAX_AGE, httponly=True, samesite="Lax", secure=True)
+
+
+def session_key(request) -> str:
+    """The request's session key, creating the session only in "session" mode."""
+    session = getattr(request, "session", None)
+    if session is None:
+        return ""
+    if not session.session_key and MODE == "session":
+        try:
+            session["__touch__"] = True
+            session.save()
+        except Exception:
+            pass
+    return session.session_key or ""
@@ -0,0 +1,294 @@
+"""
+Per-request timing: query count, DB time and phase timings.
+
+InstrumentationMiddleware (first in MIDDLEWARE) wraps every DB connection
+with execute_wrapper for the duration of the request and times these phases:
+
+  db     all SQL executed while handling the request
+  tpl    Django template rendering, timed by the TimedTemplates backend
+         (TEMPLATES["BACKEND"]); the template_rendered signal only fires in tests
+  ser    serialization of this module's JsonResponse (used by the analytics
+         and stream JSON views)
+  app    whatever is left: view code, middleware, Python-side work
+  other  named blocks marked with `with timed("facets"): ...`
+
+Nothing is patched at import: both hooks are ordinary subclasses.
+
+Results go out as a Server-Timing header (staff, or everyone when
+ANALYTICS_SERVER_TIMING is on) and into in-process per-endpoint latency
+histograms, served by /analytics/api/perf/ (staff) and /analytics/metrics/
+(Prometheus text; bearer ANALYTICS_METRICS_TOKEN), together with the
+analytics ingest mode chosen by analytics.shedding and the requests
+refused by analytics.ratelimit. Numbers are kept per
+worker process, so scrape each worker (or aggregate by instance label).
+
+A fraction (ANALYTICS_TRACE_SAMPLE) of requests also record their SQL; those
+slower than ANALYTICS_SLOW_MS are kept in a small ring buffer.
+"""
+import random
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse as BaseJsonResponse
+from django.template.backends.django import DjangoTemplates, Template
+
+from . import ratelimit, shedding
+
+ENABLED = getattr(settings, "ANALYTICS_INSTRUMENT", True)
+SERVER_TIMING_ALL = getattr(settings, "ANALYTICS_SERVER_TIMING", settings.DEBUG)
+SLOW_MS = getattr(settings, "ANALYTICS_SLOW_MS", 500)
+TRACE_SAMPLE = getattr(settings, "ANALYTICS_TRACE_SAMPLE", 0.1)
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SLOW_KEEP = 50
+SQL_KEEP = 200  # per traced request
+
+_current: ContextVar = ContextVar("analytics_request_trace", default=None)
+
+
+class RequestTrace:
+    __slots__ = ("start", "queries", "db_ms", "phases", "sql")
+
+    def __init__(self, capture_sql=False):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.phases = {}
+        self.sql = [] if capture_sql else None
+
+    def add(self, phase, ms):
+        self.phases[phase] = self.phases.get(phase, 0.0) + ms
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def timed(phase: str):
+    """Attribute the enclosed block to `phase` in the current request's timings."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    t0, db0 = time.perf_counter(), trace.db_ms
+    try:
+        yield
+    finally:
+        # SQL run inside the block (e.g. a lazy queryset evaluated by a template) stays under "db"
+        trace.add(phase, (time.perf_counter() - t0) * 1000 - (trace.db_ms - db0))
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    trace = _current.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    t0 = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        trace.queries += 1
+        trace.db_ms += ms
+        if trace.sql is not None and len(trace.sql) < SQL_KEEP:
+            trace.sql.append({"sql": sql, "ms": round(ms, 2), "alias": context["connection"].alias})
+
+
+# -------- phase hooks --------
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed("tpl"):
+            return super().render(context, request)
+
+
+class TimedTemplates(DjangoTemplates):
+    """DjangoTemplates whose templates count their render() as the "tpl" phase."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class JsonResponse(BaseJsonResponse):
+    """JsonResponse whose serialization counts as the "ser" phase."""
+
+    def __init__(self, *args, **kwargs):
+        with timed("ser"):
+            super().__init__(*args, **kwargs)
+
+
+# -------- aggregation --------
+
+class Histograms:
+    """Per (method, route) latency histogram plus query/DB sums; thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self.slow = deque(maxlen=SLOW_KEEP)
+
+    def observe(self, key, total_ms, trace):
+        with self._lock:
+            h = self._data.get(key)
+            if h is None:
+                h = self._data[key] = {"buckets": [0] * (len(BUCKETS_MS) + 1), "count": 0, "sum_ms": 0.0,
+                                       "queries": 0, "db_ms": 0.0, "max_ms": 0.0}
+            i = next((i for i, b in enumerate(BUCKETS_MS) if total_ms <= b), len(BUCKETS_MS))
+            h["buckets"][i] += 1
+            h["count"] += 1
+            h["sum_ms"] += total_ms
+            h["queries"] += trace.queries
+            h["db_ms"] += trace.db_ms
+            h["max_ms"] = max(h["max_ms"], total_ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {k: {**v, "buckets": list(v["buckets"])} for k, v in self._data.items()}
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+            self.slow.clear()
+
+
+histograms = Histograms()
+
+
+def _quantile(buckets, count, q):
+    """Upper bound of the bucket holding the q-quantile (Prometheus-style estimate)."""
+    if not count:
+        return 0
+    rank, seen = q * count, 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if seen >= rank:
+            return BUCKETS_MS[i] if i < len(BUCKETS_MS) else float("inf")
+    return float("inf")
+
+
+def summary() -> dict:
+    rows = []
+    for (method, route), h in sorted(histograms.snapshot().items(), key=lambda kv: -kv[1]["sum_ms"]):
+        n = h["count"]
+        rows.append({
+            "method": method, "route": route, "count": n,
+            "mean_ms": round(h["sum_ms"] / n, 1), "max_ms": round(h["max_ms"], 1),
+            "p50_ms": _quantile(h["buckets"], n, 0.5), "p95_ms": _quantile(h["buckets"], n, 0.95),
+            "p99_ms": _quantile(h["buckets"], n, 0.99),
+            "queries_mean": round(h["queries"] / n, 1), "db_ms_mean": round(h["db_ms"] / n, 1),
+        })
+    return {"buckets_ms": BUCKETS_MS, "endpoints": rows, "slow": list(histograms.slow),
+            "ingest": shedding.controller.state(), "rate_limited": ratelimit.counters()}
+
+
+def _label(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def prometheus_text() -> str:
+    lines = [
+        "# HELP http_request_duration_ms Request latency by route.",
+        "# TYPE http_request_duration_ms histogram",
+    ]
+    snap = histograms.snapshot()
+    for (method, route), h in sorted(snap.items()):
+        labels = f'method="{_label(method)}",route="{_label(route)}"'
+        cumulative = 0
+        for b, n in zip(BUCKETS_MS + ("+Inf",), h["buckets"]):
+            cumulative += n
+            lines.append(f'http_request_duration_ms_bucket{{{labels},le="{b}"}} {cumulative}')
+        lines.append(f"http_request_duration_ms_sum{{{labels}}} {h['sum_ms']:.3f}")
+        lines.append(f"http_request_duration_ms_count{{{labels}}} {h['count']}")
+    for name, field, help_ in (("http_request_queries_total", "queries", "SQL queries executed."),
+                               ("http_request_db_ms_total", "db_ms", "Time spent in SQL.")):
+        lines += [f"# HELP {name} {help_}", f"# TYPE {name} counter"]
+        for (method, route), h in sorted(snap.items()):
+            lines.append(f'{name}{{method="{_label(method)}",route="{_label(route)}"}} {h[field]:g}')
+    return "\n".join(lines + _ingest_lines()) + "\n"
+
+
+def _ingest_lines() -> list:
+    st = shedding.controller.state()
+    lines = ["# HELP analytics_ingest_mode Analytics ingest mode (1 for the current one).",
+             "# TYPE analytics_ingest_mode gauge"]
+    lines += [f'analytics_ingest_mode{{mode="{m}"}} {int(st["mode"] == m)}'
+              for m in (shedding.FULL, shedding.DROP_BOTS, shedding.SAMPLE)]
+    for name, value, help_ in (("analytics_ingest_weight", st["weight"], "Visitors each stored row stands for."),
+                               ("analytics_ingest_pressure", st["pressure"], "Worst signal over its shedding threshold."),
+                               ("analytics_ingest_write_ms", st["write_ms"], "EWMA of one analytics INSERT statement."),
+                               ("analytics_ingest_backlog_bytes", st["backlog_bytes"], "Spool segments not loaded yet.")):
+        lines += [f"# HELP {name} {help_}", f"# TYPE {name} gauge", f"{name} {value:g}"]
+    lines += ["# HELP analytics_ingest_dropped_total Rows not stored by load shedding.",
+              "# TYPE analytics_ingest_dropped_total counter"]
+    lines += [f'analytics_ingest_dropped_total{{reason="{k}"}} {v}' for k, v in st["dropped"].items()]
+    lines += ["# HELP analytics_rate_limited_total Write requests refused by the token buckets.",
+              "# TYPE analytics_rate_limited_total counter"]
+    for endpoint, by_key in sorted(ratelimit.counters().items()):
+        lines += [f'analytics_rate_limited_total{{endpoint="{_label(endpoint)}",by="{by}"}} {n}'
+                  for by, n in by_key.items()]
+    return lines
+
+
+# -------- middleware --------
+
+def _route(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "<unresolved>"
+    return "/" + (match.route or "").lstrip("^")  # the URL pattern, so /<slug:slug>/ is one series
+
+
+class InstrumentationMiddleware:
+    """Place FIRST in MIDDLEWARE so the timings cover every other middleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not ENABLED:
+            return self.get_response(request)
+
+        trace = RequestTrace(capture_sql=random.random() < TRACE_SAMPLE)
+        token = _current.set(trace)
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(_db_wrapper))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        total = (time.perf_counter() - trace.start) * 1000
+        key = (request.method, _route(request))
+        histograms.observe(key, total, trace)
+
+        if trace.sql is not None and total >= SLOW_MS:
+            histograms.slow.append({
+                "ts": time.time(), "method": request.method, "path": request.path[:512], "route": key[1],
+                "status": response.status_code, "total_ms": round(total, 1), "db_ms": round(trace.db_ms, 1),
+                "queries": trace.queries, "phases": {k: round(v, 1) for k, v in trace.phases.items()},
+                "sql": trace.sql,
+            })
+
+        user = getattr(request, "user", None)
+        if SERVER_TIMING_ALL or (user is not None and user.is_authenticated and user.is_staff):
+            response["Server-Timing"] = server_timing(trace, total)
+        return response
+
+
+def server_timing(trace, total_ms) -> str:
+    parts = [f'db;dur={trace.db_ms:.1f};desc="{trace.queries} queries"']
+    accounted = trace.db_ms
+    for name, ms in trace.phases.items():
+        parts.append(f"{name};dur={ms:.1f}")
+        accounted += ms
+    parts.append(f"app;dur={max(total_ms - accounted, 0):.1f}")
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
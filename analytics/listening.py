@@ -0,0 +1,157 @@
+"""
+Listening-time metrics from PlayEvent progress samples.
+
+The player posts its position every 15 seconds (stream.api.progress_ping),
+and each post becomes one PlayEvent row. `manage.py compute_listening`
+turns those samples into one ListeningProfile per sermon:
+
+- sessions: samples are grouped per (sermon, listener), where a listener is
+  the user or else the visitor id / ip hash. A gap of more than
+  ANALYTICS_LISTENING_GAP_S between samples starts a new session.
+- listen_s: the distinct 15s steps heard in each session, capped at the
+  sermon's duration.
+- retention: for each 1% of the duration, the number of sessions that
+  reached it. completion_rate is the share that reached 90%.
+
+Sermons are read in batches of about ANALYTICS_LISTENING_CHUNK samples
+(a sermon is never split, so its sessions stay whole). Each batch is
+sorted and reduced with NumPy (lexsort, reduceat, bincount) instead of
+per-row Python. By default only sermons with samples newer than the last
+run are recomputed.
+
+Needs numpy (lazily imported, so the web process doesn't load it).
+"""
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .counters import PROGRESS_STEP_S
+
+CHUNK = getattr(settings, "ANALYTICS_LISTENING_CHUNK", 200_000)
+GAP_S = getattr(settings, "ANALYTICS_LISTENING_GAP_S", 30 * 60)
+BINS = 101  # 0% .. 100%
+COMPLETE_PCT = 90
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ValueError("Listening analytics need numpy (pip install numpy)")
+    return numpy
+
+
+def batches(counts: dict, chunk: int = CHUNK):
+    """Group sermon ids so each group holds about `chunk` samples (big sermons get a group of their own)."""
+    group, size = [], 0
+    for sid, n in sorted(counts.items()):
+        if group and size + n > chunk:
+            yield group
+            group, size = [], 0
+        group.append(sid)
+        size += n
+    if group:
+        yield group
+
+
+def _columns(np, rows):
+    """values_list rows -> (sermon, listener code, ts, position) arrays."""
+    sermon, user, listener, started, pos = zip(*rows)
+    codes = {}
+    keys = [codes.setdefault(("u", u) if u else l, len(codes)) for u, l in zip(user, listener)]
+    return (
+        np.array(sermon, dtype=np.int64),
+        np.array(keys, dtype=np.int64),
+        np.array([t.timestamp() for t in started], dtype=np.float64),
+        np.maximum(np.array(pos, dtype=np.float64), 0),
+    )
+
+
+def profile_batch(np, rows, durations: dict) -> dict:
+    """Metrics for every sermon in `rows` (all of their samples): sermon id -> field dict."""
+    sermon, key, ts, pos = _columns(np, rows)
+    order = np.lexsort((ts, key, sermon))
+    sermon, key, ts, pos = sermon[order], key[order], ts[order], pos[order]
+
+    # sessions: a new one starts at each sermon/listener change or after a long gap
+    new = np.ones(len(ts), dtype=bool)
+    new[1:] = (sermon[1:] != sermon[:-1]) | (key[1:] != key[:-1]) | (ts[1:] - ts[:-1] > GAP_S)
+    session = np.cumsum(new) - 1
+    starts = np.flatnonzero(new)
+    reach = np.maximum.reduceat(pos, starts)
+    s_sermon = sermon[starts]
+
+    # per-sermon index and duration (the furthest position heard when the sermon has none)
+    ids, s_idx = np.unique(s_sermon, return_inverse=True)
+    furthest = np.zeros(len(ids))
+    np.maximum.at(furthest, s_idx, reach)
+    duration = np.array([durations.get(int(i)) or 0 for i in ids], dtype=np.float64)
+    duration = np.where(duration > 0, duration, np.maximum(furthest, 1))
+
+    # listen time: distinct PROGRESS_STEP_S steps per session, capped at the duration
+    step = (pos // PROGRESS_STEP_S).astype(np.int64)
+    width = int(step.max()) + 1
+    heard = np.unique(session * width + step) // width
+    listen = np.minimum(np.bincount(heard, minlength=len(starts)) * PROGRESS_STEP_S, duration[s_idx])
+
+    # retention: sessions reaching each percent = reverse cumulative histogram of reach
+    pct = np.clip(np.floor(reach / duration[s_idx] * 100), 0, 100).astype(np.int64)
+    hist = np.bincount(s_idx * BINS + pct, minlength=len(ids) * BINS).reshape(len(ids), BINS)
+    retention = hist[:, ::-1].cumsum(axis=1)[:, ::-1].astype("<u4")
+
+    row_idx = np.searchsorted(ids, sermon)
+    keys = int(key.max()) + 1
+    listeners = np.bincount(np.unique(row_idx * keys + key) // keys, minlength=len(ids))
+    samples = np.bincount(row_idx, minlength=len(ids))
+    listen_s = np.bincount(s_idx, weights=listen, minlength=len(ids))
+
+    out = {}
+    for i, sid in enumerate(ids.tolist()):
+        sessions = int(retention[i, 0])
+        out[sid] = {
+            "duration_s": int(duration[i]),
+            "samples": int(samples[i]),
+            "sessions": sessions,
+            "listeners": int(listeners[i]),
+            "listen_s": int(listen_s[i]),
+            "completion_rate": round(float(retention[i, COMPLETE_PCT]) / sessions, 4) if sessions else 0.0,
+            "retention": retention[i].tobytes(),
+        }
+    return out
+
+
+def compute(full: bool = False, chunk: int = CHUNK, log=print) -> int:
+    """Recompute ListeningProfile rows (only sermons with new samples unless `full`); returns sermons written."""
+    from stream.models import PlayEvent, Sermon
+    from .models import ListeningProfile
+
+    np = _numpy()
+    high = PlayEvent.objects.aggregate(m=Max("id"))["m"]
+    if high is None:
+        return 0
+    samples = PlayEvent.objects.filter(id__lte=high)
+    if not full:
+        since = ListeningProfile.objects.aggregate(m=Max("through_id"))["m"] or 0
+        touched = samples.filter(id__gt=since).values("sermon_id").distinct()
+        samples_for = samples.filter(sermon_id__in=touched)
+    else:
+        samples_for = samples
+    counts = dict(samples_for.values_list("sermon_id").annotate(n=Count("id")).order_by())
+
+    existing = set(ListeningProfile.objects.filter(sermon_id__in=counts).values_list("sermon_id", flat=True))
+    fields = ["duration_s", "samples", "sessions", "listeners", "listen_s", "completion_rate", "retention",
+              "through_id", "computed_at"]
+    done = 0
+    for group in batches(counts, chunk):
+        durations = dict(Sermon.objects.filter(id__in=group).values_list("id", "duration_s"))
+        rows = list(samples.filter(sermon_id__in=group).values_list(
+            "sermon_id", "user_id", "listener", "started_at", "progress_s"
+        ))
+        now = timezone.now()
+        objs = [ListeningProfile(sermon_id=sid, through_id=high, computed_at=now, **v)
+                for sid, v in profile_batch(np, rows, durations).items()]
+        ListeningProfile.objects.bulk_create([o for o in objs if o.sermon_id not in existing], batch_size=500)
+        ListeningProfile.objects.bulk_update([o for o in objs if o.sermon_id in existing], fields, batch_size=500)
+        done += len(objs)
+        log(f"  {done}/{len(counts)} sermons ({len(rows)} samples in this batch)")
+    return done
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.listening import CHUNK, compute
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute per-sermon listening time, completion rate and retention curves from PlayEvent progress "
+        "samples. Only sermons with new samples are recomputed unless --full is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="recompute every sermon")
+        parser.add_argument("--chunk", type=int, default=CHUNK, help="samples per batch")
+
+    def handle(self, *args, **opts):
+        try:
+            n = compute(full=opts["full"], chunk=opts["chunk"], log=self.stdout.write)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Computed listening profiles for {n} sermons"))
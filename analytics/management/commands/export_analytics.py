@@ -0,0 +1,49 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics import exporting
+from analytics.models import Event, ExportJob, Visit
+
+MODELS = {"visit": Visit, "event": Event}
+
+
+class Command(BaseCommand):
+    help = "Stream Visit/Event rows to CSV, gzipped JSONL or Parquet in constant memory (local file or private export storage)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", choices=sorted(MODELS))
+        parser.add_argument("--format", dest="fmt", choices=list(exporting.FORMATS), default="jsonl.gz")
+        parser.add_argument("--since", type=date.fromisoformat, help="First day (YYYY-MM-DD), inclusive")
+        parser.add_argument("--until", type=date.fromisoformat, help="Last day (YYYY-MM-DD), inclusive")
+        parser.add_argument("--include-bots", action="store_true", help="Visits only; bots are skipped by default")
+        parser.add_argument("--out", help="Write to this local path instead of export storage")
+
+    def handle(self, *args, **opts):
+        qs = MODELS[opts["model"]].objects.all()
+        if opts["since"]:
+            qs = qs.filter(ts__date__gte=opts["since"])
+        if opts["until"]:
+            qs = qs.filter(ts__date__lte=opts["until"])
+        if opts["model"] == "visit" and not opts["include_bots"]:
+            qs = qs.filter(is_bot=False)
+        fmt, out = opts["fmt"], opts["out"]
+
+        def progress(n):
+            self.stdout.write(f"  {n} rows")
+
+        try:
+            exporting.check_format(fmt)
+            if out:
+                with open(out, "wb") as fh:
+                    n = exporting.write_export(qs, fmt, fh, progress=progress)
+                self.stdout.write(self.style.SUCCESS(f"Wrote {n} rows to {out}"))
+                return
+            exporting.fail_stale_jobs()
+            job = ExportJob.objects.create(model=qs.model._meta.label_lower, fmt=fmt, description="export_analytics")
+            job = exporting.run_job(job, qs)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if job.status != ExportJob.DONE:
+            raise CommandError(f"Export failed: {job.error}")
+        self.stdout.write(self.style.SUCCESS(f"Saved {job.rows_done} rows to {job.file.path}"))
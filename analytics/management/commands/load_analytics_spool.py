@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from analytics import spool
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-load closed analytics spool segments (ANALYTICS_SPOOL_DIR) into Visit/Event. "
+        "Use from cron when ANALYTICS_SPOOL_LOADER = \"command\"; --follow keeps loading."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--follow", action="store_true", help="keep running, loading new segments as they close")
+        parser.add_argument("--limit", type=int, default=None, help="segments per pass")
+
+    def handle(self, *args, **opts):
+        while True:
+            segments, rows = spool.load(limit=opts["limit"])
+            if segments or not opts["follow"]:
+                self.stdout.write(f"Loaded {rows} rows from {segments} segments")
+            if not opts["follow"]:
+                return
+            time.sleep(spool.LOAD_EVERY_S)
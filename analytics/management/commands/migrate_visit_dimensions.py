@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics import dimensions
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert analytics_visit from the inline ua/path/referer/utm_* columns to dimension FKs: "
+        "`add` the FK columns, `backfill` them in batches, then `drop` the old columns. "
+        "Each step can be re-run; `all` runs them in order."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("step", choices=["add", "backfill", "drop", "all"])
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        step = opts["step"]
+        if step in ("add", "all"):
+            added = dimensions.add_dimension_columns(log=self.stdout.write)
+            self.stdout.write(self.style.SUCCESS(f"Added or changed {len(added)} tables/columns/indexes"))
+        if step in ("backfill", "all"):
+            if not dimensions.legacy_columns_present():
+                if step == "backfill":
+                    raise CommandError("analytics_visit has no legacy inline columns; nothing to convert")
+                self.stdout.write("analytics_visit has no legacy inline columns; nothing to convert")
+            else:
+                n = dimensions.backfill_visit_dimensions(batch_size=opts["batch_size"], log=self.stdout.write)
+                self.stdout.write(self.style.SUCCESS(f"Converted {n} visits"))
+        if step in ("drop", "all"):
+            try:
+                dropped = dimensions.drop_legacy_columns(log=self.stdout.write)
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Dropped {len(dropped)} legacy columns"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from analytics.counters import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute SermonStats plays and trending scores from Event and archived play rollups. "
+        "Run once after adding the table; completions and listen-seconds come from progress beacons and are kept."
+    )
+
+    def handle(self, *args, **opts):
+        n = rebuild(log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {n} sermons"))
@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.attribution import rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Parse referers stored before host/class parsing existed (in chunks), then rebuild the "
+        "AttributionDaily rows for yesterday, or for every complete day since --since. Run it daily after midnight."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="first day to rebuild (YYYY-MM-DD); default yesterday")
+
+    def handle(self, *args, **opts):
+        since = None
+        if opts["since"]:
+            try:
+                since = date.fromisoformat(opts["since"])
+            except ValueError:
+                raise CommandError("--since must be YYYY-MM-DD")
+        n = rollup(since=since, log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"Rolled up attribution for {n} days"))
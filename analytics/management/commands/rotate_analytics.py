@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from analytics import retention
+
+
+class Command(BaseCommand):
+    help = "Roll up, archive and drop Visit/Event months past retention; keep future MySQL partitions ready"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-months", type=int, default=retention.RETENTION_MONTHS)
+        parser.add_argument("--ahead", type=int, default=3, help="Empty monthly partitions to keep ahead of now")
+        parser.add_argument("--init", action="store_true", help="Partition tables that are not partitioned yet (MySQL)")
+        parser.add_argument("--dry-run", action="store_true", help="Print the plan and SQL without changing anything")
+
+    def handle(self, *args, **opts):
+        retention.rotate(
+            keep_months=opts["keep_months"],
+            ahead=opts["ahead"],
+            init=opts["init"],
+            dry_run=opts["dry_run"],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS("Rotation complete"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from analytics import sessions
+
+
+class Command(BaseCommand):
+    help = (
+        "Group visits into VisitSession rows (entry/exit page, duration, depth, funnel step) from the "
+        "last watermark up to a few minutes ago. Safe to run from cron as often as you like."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true",
+                            help="delete all sessions and rebuild from the raw visits that are still kept")
+
+    def handle(self, *args, **opts):
+        if opts["reset"]:
+            sessions.reset()
+        n = sessions.run(log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"Created {n} sessions"))
@@ -1,12 +1,11 @@
-import re, time, uuid, hashlib
-from django.utils import timezone
+import time
 from django.conf import settings
 
-BOT_REGEX = re.compile(
-    r"bot|crawl|spider|slurp|bingpreview|crawler|facebookexternalhit|whatsapp|telegram|curl|python-requests|fetch|monitoring",
-    re.I,
-)
-EXCLUDE_PATHS = ("/admin/", "/static/", "/media/", "/favicon.ico", "/robots.txt", "/health")
+from . import bots, dimensions, identity, shedding, spool
+from .bots import BOT_REGEX
+from .realtime import hub
+
+EXCLUDE_PATHS = ("/admin/", "/static/", "/media/", "/favicon.ico", "/robots.txt", "/health", "/analytics/api/live/heartbeat/", "/analytics/api/stream/")
 
 _geo_reader = None
 def _get_geo_reader():
@@ -44,65 +43,66 @@ class VisitMiddleware:
 
         start = time.perf_counter()
 
-        # ensure session key
-        if not getattr(request, "session", None) or not request.session.session_key:
-            try:
-                request.session["__touch__"] = True
-                request.session.save()
-            except Exception:
-                pass
+        # classify first: bot traffic that won't be stored skips the session, cookie and geo work
+        ua = request.META.get("HTTP_USER_AGENT", "")[:500]
+        ip = identity.client_ip(request) or None
+        ip_hash = identity.ip_hash(ip or "")
+        try:
+            bot_reason = bots.classify(ua, ip, ip_hash, page_view=bots.is_page_view(request))
+        except Exception:
+            bot_reason = "ua" if BOT_REGEX.search(ua) else ""
+        if not bots.should_store(bot_reason):
+            return self.get_response(request)
+        is_bot = bool(bot_reason)
 
-        visitor_id = request.COOKIES.get("v_id") or str(uuid.uuid4())
-        set_cookie = "v_id" not in request.COOKIES
+        # visitors are identified by the signed v_id cookie; a session is only forced in "session" mode
+        session_key = identity.session_key(request)
+        visitor_id, set_cookie = identity.visitor_id(request)
+        # under database pressure the shedding controller drops bots, then samples visitors
+        weight = shedding.controller.admit(visitor_id, is_bot)
 
         response = self.get_response(request)
 
-        try:
-            from .models import Visit
-            ua = request.META.get("HTTP_USER_AGENT", "")[:500]
-            is_bot = bool(BOT_REGEX.search(ua))
-            ip = (request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")[0].strip()
-                  or request.META.get("REMOTE_ADDR"))
-
-            # Privacy: do NOT store raw IP unless enabled
-            store_ip = getattr(settings, "ANALYTICS_STORE_IP", False)
-            ip_to_save = ip if store_ip else None
-            ip_hash = hashlib.sha256((ip or "").encode()).hexdigest()[:32] if ip else ""
+        if weight:
+            try:
+                # Privacy: do NOT store raw IP unless enabled
+                store_ip = getattr(settings, "ANALYTICS_STORE_IP", False)
+                ip_to_save = ip if store_ip else None
 
-            # Geo derivation (we store only derived fields)
-            country, country_name, city = _geo_lookup(ip)
+                # Geo derivation (we store only derived fields)
+                country, country_name, city = _geo_lookup(ip) if not is_bot else ("", "", "")
 
-            utm = {k: request.GET.get(k, "") for k in ("utm_source","utm_medium","utm_campaign","utm_term","utm_content")}
-            dur_ms = int((time.perf_counter() - start) * 1000)
+                utm = {k: request.GET.get(k, "") for k in dimensions.UTM_KEYS}
+                dur_ms = int((time.perf_counter() - start) * 1000)
 
-            Visit.objects.create(
-                ts=timezone.now(),
-                session_key=(getattr(request, "session", None) and request.session.session_key) or "",
-                visitor_id=visitor_id,
-                user=(getattr(request, "user", None) and request.user.is_authenticated) and request.user or None,
-                path=request.path,
-                method=request.method,
-                status_code=getattr(response, "status_code", None),
-                response_ms=dur_ms,
-                referer=request.META.get("HTTP_REFERER", "")[:1024],
-                ua=ua,
-                ip=ip_to_save,
-                ip_hash=ip_hash,
-                is_bot=is_bot,
-                country=country,
-                country_name=country_name,
-                city=city,
-                **utm,
-            )
-        except Exception:
-            pass
+                # appended to the local spool (or inserted inline), see analytics.spool
+                spool.submit("visit", {
+                    "session_key": session_key or (getattr(request, "session", None) and request.session.session_key) or "",
+                    "visitor_id": visitor_id,
+                    "user_id": request.user.pk if getattr(request, "user", None) and request.user.is_authenticated else None,
+                    "path": request.path,
+                    "method": request.method,
+                    "status_code": getattr(response, "status_code", None),
+                    "response_ms": dur_ms,
+                    "referer": request.META.get("HTTP_REFERER", ""),
+                    "ua": ua,
+                    "ip": ip_to_save,
+                    "ip_hash": ip_hash,
+                    "is_bot": is_bot,
+                    "country": country,
+                    "country_name": country_name,
+                    "city": city,
+                    "utm": {k: v for k, v in utm.items() if v},
+                    "weight": weight,
+                })
+            except Exception:
+                pass
+        if not is_bot:
+            hub.record_visit(request.path)
 
         if set_cookie:
             try:
-                response.set_cookie(
-                    "v_id", visitor_id,
-                    max_age=60*60*24*365*2, httponly=True, samesite="Lax", secure=True
-                )
+                identity.set_cookie(response, visitor_id)
             except Exception:
                 pass
         return response
@@ -1,7 +1,66 @@
+import sys
+from array import array
+
 from django.conf import settings
 from django.db import models
 from django.utils import timezone
 
+from . import storages
+
+
+# ---- dimension tables (see analytics.dimensions) ----
+
+class Dimension(models.Model):
+    """A distinct value stored once; facts point at it with a small integer FK."""
+    value_hash = models.CharField(max_length=40, unique=True)  # sha1 of the value(s)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.value
+
+
+class UserAgentDim(Dimension):
+    value = models.TextField()
+
+    class Meta:
+        verbose_name = "user agent"
+
+
+class PathDim(Dimension):
+    value = models.CharField(max_length=512, db_index=True)
+
+    class Meta:
+        verbose_name = "path"
+
+
+class RefererDim(Dimension):
+    value = models.CharField(max_length=1024)
+    # parsed at insert by analytics.attribution.parse_referer ("" kind = not parsed yet)
+    host = models.CharField(max_length=255, blank=True, db_index=True)
+    kind = models.CharField(max_length=12, blank=True, db_index=True)  # internal / search / social / email / referral
+    url = models.CharField(max_length=1024, blank=True)  # value without tracking params or fragment
+
+    class Meta:
+        verbose_name = "referer"
+
+
+class UtmDim(Dimension):
+    source = models.CharField(max_length=64, blank=True)
+    medium = models.CharField(max_length=64, blank=True)
+    campaign = models.CharField(max_length=64, blank=True)
+    term = models.CharField(max_length=64, blank=True)
+    content = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        verbose_name = "UTM combination"
+
+    @property
+    def value(self):
+        return "/".join(v for v in (self.source, self.medium, self.campaign, self.term, self.content) if v)
+
+
 class Visit(models.Model):
     ts = models.DateTimeField(default=timezone.now, db_index=True)
     session_key = models.CharField(max_length=40, db_index=True)
@@ -11,29 +70,28 @@ class Visit(models.Model):
         null=True,
         blank=True,
         on_delete=models.SET_NULL,
+        db_constraint=False,  # MySQL partitioned tables can't carry FKs (see analytics.retention)
     )
-    path = models.CharField(max_length=512, db_index=True)
+    # Repeated strings live in dimension tables; NULL means "empty".
+    # (path is nullable only so the column can be added to a populated table and backfilled.)
+    path = models.ForeignKey(PathDim, null=True, blank=True, on_delete=models.PROTECT, db_constraint=False, related_name="+")
     method = models.CharField(max_length=8)
     status_code = models.SmallIntegerField(null=True, blank=True, db_index=True)
     response_ms = models.IntegerField(null=True, blank=True)
-    referer = models.URLField(max_length=1024, blank=True)
-    ua = models.TextField(blank=True)
+    referer = models.ForeignKey(RefererDim, null=True, blank=True, on_delete=models.PROTECT, db_constraint=False, related_name="+")
+    ua = models.ForeignKey(UserAgentDim, null=True, blank=True, on_delete=models.PROTECT, db_constraint=False, related_name="+")
     ip = models.GenericIPAddressField(null=True, blank=True)
     ip_hash = models.CharField(max_length=64, blank=True)
-    utm_source = models.CharField(max_length=64, blank=True)
-    utm_medium = models.CharField(max_length=64, blank=True)
-    utm_campaign = models.CharField(max_length=64, blank=True)
-    utm_term = models.CharField(max_length=64, blank=True)
-    utm_content = models.CharField(max_length=64, blank=True)
+    utm = models.ForeignKey(UtmDim, null=True, blank=True, on_delete=models.PROTECT, db_constraint=False, related_name="+")
     is_bot = models.BooleanField(default=False, db_index=True)
     country = models.CharField(max_length=2, blank=True)        # ISO-2 (e.g., NG, US)
     country_name = models.CharField(max_length=64, blank=True)  # Nigeria, United States...
     city = models.CharField(max_length=64, blank=True)
+    weight = models.PositiveSmallIntegerField(default=1)  # 1/sample rate when analytics.shedding sampled this row
 
     class Meta:
         indexes = [
             models.Index(fields=["ts"]),
-            models.Index(fields=["path"]),
             models.Index(fields=["-ts", "path"]),
             models.Index(fields=["visitor_id", "ts"]),
         ]
@@ -49,7 +107,8 @@ class Event(models.Model):
     ts = models.DateTimeField(default=timezone.now, db_index=True)
     session_key = models.CharField(max_length=40, blank=True, db_index=True)
     visitor_id = models.CharField(max_length=36, blank=True, db_index=True)
-    user = models.ForeignKey(getattr(settings, 'AUTH_USER_MODEL', 'auth.User'), null=True, blank=True, on_delete=models.SET_NULL)
+    user = models.ForeignKey(getattr(settings, 'AUTH_USER_MODEL', 'auth.User'), null=True, blank=True, on_delete=models.SET_NULL,
+                             db_constraint=False)  # partitioned table, see analytics.retention
 
     event = models.CharField(max_length=32, db_index=True)  # e.g., "play"
     slug = models.CharField(max_length=160, blank=True, db_index=True)
@@ -64,6 +123,7 @@ class Event(models.Model):
     country = models.CharField(max_length=2, blank=True)
     country_name = models.CharField(max_length=64, blank=True)
     city = models.CharField(max_length=64, blank=True)
+    weight = models.PositiveSmallIntegerField(default=1)  # 1/sample rate (analytics.shedding)
 
     class Meta:
         indexes = [
@@ -74,3 +134,192 @@ class Event(models.Model):
 
     def __str__(self):
         return f"{self.event} • {self.slug or self.title} @ {self.ts:%Y-%m-%d %H:%M}"
+
+
+class LiveSnapshot(models.Model):
+    """Periodic concurrent-listener count for the live stream (see analytics.presence)."""
+    ts = models.DateTimeField(default=timezone.now, db_index=True)
+    listeners = models.PositiveIntegerField(default=0)
+    peak = models.PositiveIntegerField(default=0)  # peak so far that day
+
+    class Meta:
+        ordering = ["-ts"]
+
+    def __str__(self):
+        return f"{self.listeners} live @ {self.ts:%Y-%m-%d %H:%M}"
+
+
+class Rollup(models.Model):
+    """
+    Daily aggregate kept after raw Visit/Event rows are archived and dropped.
+    kind: "pageviews" / "visitors" (key=""), "path", "referer" (key=host), "country", "play" (key=slug).
+    """
+    day = models.DateField(db_index=True)
+    kind = models.CharField(max_length=16)
+    key = models.CharField(max_length=512, blank=True)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["day", "kind", "key"], name="analytics_rollup_uniq")]
+        indexes = [models.Index(fields=["kind", "day"])]
+        ordering = ["-day", "kind", "-count"]
+
+    def __str__(self):
+        return f"{self.day} {self.kind}:{self.key or '-'} = {self.count}"
+
+
+class AttributionDaily(models.Model):
+    """
+    Non-bot visits per local day by referer class/host and UTM source/medium/campaign
+    (built by analytics.attribution). `visitors` is distinct within the row only.
+    """
+    day = models.DateField()
+    kind = models.CharField(max_length=12)  # direct / internal / search / social / email / referral
+    host = models.CharField(max_length=255, blank=True)
+    source = models.CharField(max_length=64, blank=True)
+    medium = models.CharField(max_length=64, blank=True)
+    campaign = models.CharField(max_length=64, blank=True)
+    visits = models.PositiveIntegerField(default=0)
+    visitors = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["day", "kind", "host", "source", "medium", "campaign"],
+                                               name="analytics_attribution_uniq")]
+        indexes = [models.Index(fields=["day", "kind"], name="analytics_attribution_day")]
+        verbose_name_plural = "attribution daily"
+
+    def __str__(self):
+        return f"{self.day} {self.kind} {self.host or '-'}: {self.visits}"
+
+
+class SermonStats(models.Model):
+    """
+    Per-sermon play counters maintained at ingest (see analytics.counters).
+    `trending` is a forward-decayed play count relative to `trending_base`
+    (epoch seconds shared by every row), so ordering by it ranks by recency-
+    weighted plays without recomputing anything at read time.
+    """
+    sermon = models.OneToOneField("stream.Sermon", primary_key=True, on_delete=models.CASCADE, related_name="stats")
+    plays = models.PositiveIntegerField(default=0)
+    completions = models.PositiveIntegerField(default=0)
+    listen_s = models.PositiveBigIntegerField(default=0)
+    trending = models.FloatField(default=0)
+    trending_base = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-plays"], name="analytics_stats_plays"),
+            models.Index(fields=["-trending"], name="analytics_stats_trending"),
+        ]
+
+    def __str__(self):
+        return f"{self.sermon_id}: {self.plays} plays"
+
+
+class ListeningProfile(models.Model):
+    """
+    Listening metrics for one sermon, computed in batch from PlayEvent
+    progress samples (see analytics.listening). `retention` packs 101
+    little-endian uint32 counts: element p is the number of listening
+    sessions that reached p% of the sermon.
+    """
+    sermon = models.OneToOneField("stream.Sermon", primary_key=True, on_delete=models.CASCADE, related_name="listening")
+    duration_s = models.PositiveIntegerField(default=0)  # sermon duration, or the furthest position heard if unknown
+    samples = models.PositiveBigIntegerField(default=0)
+    sessions = models.PositiveIntegerField(default=0)
+    listeners = models.PositiveIntegerField(default=0)
+    listen_s = models.PositiveBigIntegerField(default=0)
+    completion_rate = models.FloatField(default=0)
+    retention = models.BinaryField(default=bytes)
+    through_id = models.PositiveBigIntegerField(default=0)  # last PlayEvent id included
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.sermon_id}: {self.sessions} sessions"
+
+    def retention_counts(self) -> list:
+        counts = array("I")
+        counts.frombytes(bytes(self.retention))
+        if sys.byteorder == "big":
+            counts.byteswap()
+        return counts.tolist()
+
+    def retention_curve(self) -> list:
+        """Share of sessions still listening at each 1% of the sermon."""
+        counts = self.retention_counts()
+        return [round(c / counts[0], 4) for c in counts] if counts and counts[0] else []
+
+
+class Watermark(models.Model):
+    """How far an incremental batch job has got (e.g. "sessions": visits up to `ts` are sessionized)."""
+    name = models.CharField(max_length=32, primary_key=True)
+    ts = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.ts:%Y-%m-%d %H:%M:%S}"
+
+
+class VisitSession(models.Model):
+    """
+    A visitor's run of pageviews with no gap longer than ANALYTICS_SESSION_GAP_S
+    (built by analytics.sessions). `week`/`cohort_week` are the Mondays of the
+    session and of the visitor's first session; `funnel` is the furthest step of
+    listing -> detail -> play reached in that order.
+    Reports count Sum("weight"), since sampled visitors stand for `weight` of them.
+    """
+    FUNNEL_STEPS = ["listing", "detail", "play"]
+
+    visitor_id = models.CharField(max_length=36)
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    entry_path = models.ForeignKey(PathDim, null=True, blank=True, on_delete=models.PROTECT, db_constraint=False, related_name="+")
+    exit_path = models.ForeignKey(PathDim, null=True, blank=True, on_delete=models.PROTECT, db_constraint=False, related_name="+")
+    depth = models.PositiveIntegerField(default=0)  # pageviews
+    duration_s = models.PositiveIntegerField(default=0)
+    funnel = models.PositiveSmallIntegerField(default=0)  # 0 none, 1 listing, 2 detail, 3 play
+    is_return = models.BooleanField(default=False)  # the visitor had an earlier session
+    week = models.DateField()
+    cohort_week = models.DateField()
+    weight = models.PositiveSmallIntegerField(default=1)  # sessions this one stands for (the highest visit weight)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["visitor_id", "-ended_at"], name="analytics_vsession_visitor"),
+            models.Index(fields=["started_at"], name="analytics_vsession_started"),
+            models.Index(fields=["cohort_week", "week"], name="analytics_vsession_cohort"),
+        ]
+
+    def __str__(self):
+        return f"{self.visitor_id} {self.started_at:%Y-%m-%d %H:%M} ({self.depth} pages)"
+
+
+class ExportJob(models.Model):
+    """A background export of Visit/Event rows to private storage (see analytics.exporting)."""
+    PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+    STATUS_CHOICES = [(s, s.title()) for s in (PENDING, RUNNING, DONE, FAILED)]
+
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(getattr(settings, "AUTH_USER_MODEL", "auth.User"), null=True, blank=True,
+                                   on_delete=models.SET_NULL)
+    model = models.CharField(max_length=64)            # e.g. "analytics.visit"
+    fmt = models.CharField(max_length=16)              # csv / jsonl.gz / parquet
+    description = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    rows_total = models.PositiveIntegerField(default=0)
+    rows_done = models.PositiveIntegerField(default=0)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # last progress; see exporting.fail_stale_jobs
+    file = models.FileField(max_length=255, blank=True, storage=storages.exports)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.model} {self.fmt} ({self.status})"
+
+    @property
+    def progress(self):
+        return round(100 * self.rows_done / self.rows_total) if self.rows_total else (100 if self.status == self.DONE else 0)
@@ -0,0 +1,116 @@
+"""
+Live-listener presence.
+
+The live page sends a heartbeat every ~20s. Heartbeats land in fixed time
+buckets (ANALYTICS_PRESENCE_BUCKET_S wide) kept in the cache:
+
+  presence:v:<bucket>:<visitor>  marker, so a visitor counts once per bucket
+  presence:b:<bucket>            number of distinct visitors in the bucket
+  presence:peak:<date>           highest bucket count seen that day
+
+"Current listeners" is the larger of the last complete bucket and the one in
+progress, so reads are two cache gets. A LiveSnapshot row is written at most
+once per ANALYTICS_PRESENCE_SNAPSHOT_S (guarded by cache.add), never per
+heartbeat.
+
+Bucket counts come from cache.incr, so each count is handed to exactly one
+heartbeat. The peak only ever grows. It is raised with a write-then-verify
+loop, because the cache API has no compare-and-set: a writer whose value
+was overwritten by a smaller one writes again.
+
+Every count lives in the cache. With a per-process cache (SHARED_CACHE off)
+each worker only counts its own heartbeats, and the first heartbeat logs a
+warning. Use Redis/Memcached when running several workers.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+log = logging.getLogger(__name__)
+
+BUCKET_S = getattr(settings, "ANALYTICS_PRESENCE_BUCKET_S", 30)
+SNAPSHOT_S = getattr(settings, "ANALYTICS_PRESENCE_SNAPSHOT_S", 60)
+SHARED = getattr(settings, "SHARED_CACHE", True)
+PEAK_TTL = 60 * 60 * 36
+PEAK_RETRIES = 5
+_TTL = BUCKET_S * 4
+
+
+def _bucket(now: float) -> int:
+    return int(now // BUCKET_S)
+
+
+def _peak_key() -> str:
+    return f"presence:peak:{timezone.localdate().isoformat()}"
+
+
+def _incr(key: str) -> int:
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, _TTL)
+        return cache.incr(key)
+
+
+def raise_peak(n: int) -> None:
+    """Make today's peak at least `n`; concurrent writers can only leave it at the largest value."""
+    key = _peak_key()
+    if cache.add(key, n, PEAK_TTL):
+        return
+    for _ in range(PEAK_RETRIES):
+        if (cache.get(key) or 0) >= n:
+            return
+        cache.set(key, n, PEAK_TTL)
+
+
+_warned = False
+
+
+def heartbeat(visitor_id: str, now: float | None = None) -> None:
+    global _warned
+    if not SHARED and not _warned:
+        _warned = True
+        log.warning("live listener counts are per process: CACHE_BACKEND is not shared (see SHARED_CACHE)")
+    now = now or time.time()
+    b = _bucket(now)
+    if cache.add(f"presence:v:{b}:{visitor_id}", 1, _TTL):
+        raise_peak(_incr(f"presence:b:{b}"))
+    maybe_snapshot(now)
+
+
+def current_listeners(now: float | None = None) -> int:
+    b = _bucket(now or time.time())
+    counts = cache.get_many([f"presence:b:{b}", f"presence:b:{b - 1}"])
+    return max(counts.values(), default=0)
+
+
+def peak_today() -> int:
+    return cache.get(_peak_key()) or 0
+
+
+def maybe_snapshot(now: float | None = None) -> None:
+    """Persist one LiveSnapshot per SNAPSHOT_S window across all workers; skip idle windows."""
+    now = now or time.time()
+    if not cache.add(f"presence:snap:{int(now // SNAPSHOT_S)}", 1, SNAPSHOT_S * 2):
+        return
+    listeners = current_listeners(now)
+    if not listeners:
+        return
+    try:
+        from .models import LiveSnapshot
+        LiveSnapshot.objects.create(listeners=listeners, peak=peak_today())
+    except Exception:
+        pass
+
+
+def summary(history: int = 60) -> dict:
+    from .models import LiveSnapshot
+    snaps = LiveSnapshot.objects.order_by("-ts").values("ts", "listeners")[:history]
+    return {
+        "current": current_listeners(),
+        "peak_today": peak_today(),
+        "snapshots": [{"ts": s["ts"].isoformat(), "listeners": s["listeners"]} for s in reversed(snaps)],
+    }
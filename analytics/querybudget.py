@@ -0,0 +1,123 @@
+"""
+Query budgets: cap the number of SQL queries a view (or any block) may run.
+
+    @query_budget(12)
+    def staff_dashboard(request): ...
+
+    with query_budget(3, name="sidebar facets"):
+        ...
+
+QUERY_BUDGET_MODE controls what happens when a budget is blown:
+
+  "raise"  raise QueryBudgetExceeded (default with DEBUG on; use in tests/benchmarks)
+  "warn"   log a warning (default in production)
+  "off"    don't wrap connections at all
+
+In "raise" mode the same block also fails when one SQL shape (the statement
+with literals and IN-lists normalized) runs QUERY_BUDGET_REPEAT or more
+times, which is how an N+1 usually looks, even if it is still within budget.
+"""
+import functools
+import logging
+import re
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+log = logging.getLogger(__name__)
+
+REPEAT = getattr(settings, "QUERY_BUDGET_REPEAT", 5)
+_SHAPE_SUBS = [
+    (re.compile(r"\bIN \([^()]*\)", re.I), "IN (...)"),
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def mode() -> str:
+    return getattr(settings, "QUERY_BUDGET_MODE", "raise" if settings.DEBUG else "warn")
+
+
+def sql_shape(sql: str) -> str:
+    for rx, repl in _SHAPE_SUBS:
+        sql = rx.sub(repl, sql)
+    return sql.strip()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class query_budget:
+    """Context manager / decorator asserting at most `max_queries` queries (see module docstring)."""
+
+    def __init__(self, max_queries: int, name: str | None = None, repeat: int | None = None):
+        self.max_queries = max_queries
+        self.name = name
+        self.repeat = REPEAT if repeat is None else repeat
+        self.statements = []
+
+    def __call__(self, func):
+        name = self.name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with query_budget(self.max_queries, name, self.repeat):
+                return func(*args, **kwargs)
+
+        wrapper.query_budget = self.max_queries
+        return wrapper
+
+    def _record(self, execute, sql, params, many, context):
+        self.statements.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._mode = mode()
+        self.statements = []
+        self._stack = ExitStack()
+        if self._mode != "off":
+            for conn in connections.all():
+                self._stack.enter_context(conn.execute_wrapper(self._record))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stack.close()
+        if exc_type is not None or self._mode == "off":
+            return False
+        problems = []
+        if len(self.statements) > self.max_queries:
+            problems.append(f"ran {len(self.statements)} queries (budget {self.max_queries})")
+        if self._mode == "raise":
+            repeated = [(shape, n) for shape, n in Counter(map(sql_shape, self.statements)).items() if n >= self.repeat]
+            problems += [f"repeated {n}x (likely N+1): {shape[:300]}" for shape, n in repeated]
+        if not problems:
+            return False
+        message = f"{self.name or 'query budget'}: " + "; ".join(problems)
+        if self._mode == "raise":
+            raise QueryBudgetExceeded(message + "\n" + "\n".join(f"  {s[:300]}" for s in self.statements))
+        log.warning(message)
+        return False
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+class QueryBudgetAdminMixin:
+    """Budget for ModelAdmin.changelist_view; set `changelist_query_budget` on the admin."""
+    changelist_query_budget = None
+
+    def changelist_view(self, request, extra_context=None):
+        if self.changelist_query_budget is None:
+            return super().changelist_view(request, extra_context)
+        name = f"{type(self).__name__}.changelist_view"
+        with query_budget(self.changelist_query_budget, name):
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, "render"):
+                response.render()  # the list rows are queried while rendering
+        return response
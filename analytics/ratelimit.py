@@ -0,0 +1,195 @@
+"""
+Token-bucket rate limiting for the unauthenticated write endpoints.
+
+event_collect and stream.api.progress_ping are csrf_exempt, take no login
+and write a row per request, so they are wrapped in `@ratelimit.limit(name)`.
+Each request takes one token from each of these buckets:
+
+  ip       the client ip_hash (identity.client_ip, the trusted proxy hop)
+  visitor  the signed v_id cookie, when the request carries one
+  user     the logged-in user, when there is one
+
+Many people can share one address (a church or campus network), so a
+request that carries a signed visitor cookie or a login uses a separate ip
+bucket that is `identified_ip_factor` times larger. An unsigned legacy v_id
+can be made up per request, so it counts as anonymous here. Anonymous floods from that
+address can't drain it, and each identified client still has its own
+visitor/user bucket. With `exempt_authenticated`, logged-in users are not
+limited at all on that endpoint (their writes are attributable anyway).
+
+A bucket refills at `rate` tokens per second up to `burst`. It is stored as
+(tokens, last refill time) and refilled lazily when it is next used, so a
+check is O(1) no matter how many clients there are. A request is refused
+as soon as either bucket is empty.
+
+ANALYTICS_RATE_LIMITS sets `rate`, `burst`, `over`, `identified_ip_factor`
+and `exempt_authenticated` per endpoint. For
+`over`, "drop" answers 204 without doing anything, so a beacon sees no
+difference. "429" answers Too Many Requests with Retry-After. Endpoints
+not listed are not limited.
+
+ANALYTICS_RATE_LIMIT_BACKEND picks where the buckets live:
+
+  "memory"  per process (a bounded LRU of MAX_KEYS buckets); exact, no I/O
+  "cache"   the default cache, shared by every worker; one get_many and one
+            set_many per request. Concurrent updates can let a few extra
+            requests through.
+
+Refused requests are counted per endpoint and bucket in this process.
+counters() returns them; /analytics/api/perf/ and /analytics/metrics/
+export them.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from . import identity
+
+DEFAULT_LIMITS = {
+    "event": {"rate": 1.0, "burst": 30, "over": "drop", "identified_ip_factor": 20},
+    "progress": {"rate": 0.5, "burst": 12, "over": "drop", "identified_ip_factor": 20, "exempt_authenticated": True},
+}
+LIMITS = getattr(settings, "ANALYTICS_RATE_LIMITS", DEFAULT_LIMITS)
+BACKEND = getattr(settings, "ANALYTICS_RATE_LIMIT_BACKEND", "memory")  # "memory" | "cache"
+MAX_KEYS = 50_000
+BY = ("ip", "visitor", "user")
+
+
+class MemoryBuckets:
+    """Buckets in process memory, oldest-used evicted past MAX_KEYS; thread-safe."""
+
+    def __init__(self, max_keys: int = MAX_KEYS):
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.max_keys = max_keys
+
+    def take(self, limits: dict, now: float):
+        """
+        Take a token from every bucket in `limits` ({key: (rate, burst)}) if
+        all have one; returns the first empty key or None.
+        """
+        with self._lock:
+            states = []
+            for key, (rate, burst) in limits.items():
+                tokens, last = self._data.get(key, (burst, now))
+                states.append((key, min(burst, tokens + (now - last) * rate)))
+            empty = next((key for key, tokens in states if tokens < 1), None)
+            for key, tokens in states:
+                self._data[key] = (tokens if empty else tokens - 1, now)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+            return empty
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CacheBuckets:
+    """Buckets in the default cache, shared across workers (read-modify-write, not atomic)."""
+
+    def take(self, limits: dict, now: float):
+        names = {key: f"rl:{key}" for key in limits}
+        got = cache.get_many(list(names.values()))
+        states = []
+        for key, (rate, burst) in limits.items():
+            tokens, last = got.get(names[key], (burst, now))
+            states.append((key, min(burst, tokens + (now - last) * rate)))
+        empty = next((key for key, tokens in states if tokens < 1), None)
+        # a full bucket needn't be stored
+        ttl = None if any(rate <= 0 for rate, _ in limits.values()) else \
+            max(int(burst / rate) + 1 for rate, burst in limits.values())
+        cache.set_many({names[key]: (tokens if empty else tokens - 1, now) for key, tokens in states}, ttl)
+        return empty
+
+    def clear(self):
+        pass
+
+
+buckets = CacheBuckets() if BACKEND == "cache" else MemoryBuckets()
+
+
+# -------- drop counters --------
+
+_lock = threading.Lock()
+_dropped = {}
+
+
+def _count(endpoint: str, by: str) -> None:
+    with _lock:
+        _dropped[(endpoint, by)] = _dropped.get((endpoint, by), 0) + 1
+
+
+def counters() -> dict:
+    """Refused requests in this process: {endpoint: {"ip": n, "visitor": n, "user": n}}."""
+    with _lock:
+        snap = dict(_dropped)
+    return {name: {by: snap.get((name, by), 0) for by in BY} for name in LIMITS}
+
+
+def reset() -> None:
+    with _lock:
+        _dropped.clear()
+    buckets.clear()
+
+
+# -------- checks --------
+
+def _ip_hash(request) -> str:
+    return identity.ip_hash(identity.client_ip(request))
+
+
+def check(endpoint: str, request, now: float = None) -> str:
+    """Take a token for this request; returns "" when allowed, else the bucket that was empty ("ip"/"visitor"/"user")."""
+    conf = LIMITS.get(endpoint)
+    if not conf:
+        return ""
+    user = getattr(request, "user", None)
+    user_id = user.pk if user is not None and user.is_authenticated else None
+    if user_id is not None and conf.get("exempt_authenticated"):
+        return ""
+    rate, burst = conf["rate"], conf["burst"]
+    keys, limits = {}, {}
+    visitor = identity.existing_visitor_id(request)
+    if visitor:
+        keys[f"{endpoint}:v:{visitor}"] = "visitor"
+    if user_id is not None:
+        keys[f"{endpoint}:u:{user_id}"] = "user"
+    ip_hash = _ip_hash(request)
+    if ip_hash:
+        factor = conf.get("identified_ip_factor", 1) if keys else 1
+        key = f"{endpoint}:ip:{ip_hash}" if factor == 1 else f"{endpoint}:ipid:{ip_hash}"
+        keys[key] = "ip"
+        limits[key] = (rate * factor, burst * factor)
+    if not keys:
+        return ""
+    for key in keys:
+        limits.setdefault(key, (rate, burst))
+    empty = buckets.take(limits, now or time.time())
+    if empty is None:
+        return ""
+    _count(endpoint, keys[empty])
+    return keys[empty]
+
+
+def limit(endpoint: str):
+    """View decorator: answer over-limit requests per ANALYTICS_RATE_LIMITS[endpoint]["over"] without running the view."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if not check(endpoint, request):
+                return view(request, *args, **kwargs)
+            conf = LIMITS[endpoint]
+            if str(conf.get("over", "drop")) == "429":
+                response = HttpResponse("Too many requests", status=429, content_type="text/plain")
+                response["Retry-After"] = str(max(1, int(1 / conf["rate"]))) if conf["rate"] > 0 else "60"
+                return response
+            return HttpResponse(status=204)
+        return wrapped
+    return decorator
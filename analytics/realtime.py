@@ -0,0 +1,79 @@
+"""
+In-process fan-out for the staff dashboards.
+
+The ingestion path (VisitMiddleware, event_collect) appends to a bounded
+journal; every open SSE stream keeps its own cursor into it and, once per
+tick, folds the new entries into a delta. Reading the journal is a slice
+under a lock, so a single process can serve many dashboards without
+touching the database. Each process only sees its own traffic, which is
+fine for a single ASGI worker (the deployment this is meant for).
+
+Streams are only offered under ASGI (config.asgi, e.g. `uvicorn
+config.asgi:application`). An open stream holds a WSGI worker for as
+long as the page stays open, so under WSGI the dashboards poll
+/analytics/api/live/ instead.
+"""
+import threading
+from collections import Counter, deque
+from itertools import islice
+
+from django.core.handlers.asgi import ASGIRequest
+
+JOURNAL_SIZE = 20000
+
+
+def streaming_supported(request) -> bool:
+    """Whether this request came through the ASGI handler, where an idle stream costs no worker."""
+    return isinstance(request, ASGIRequest)
+
+
+class LiveHub:
+    def __init__(self, size=JOURNAL_SIZE):
+        self._lock = threading.Lock()
+        self._journal = deque(maxlen=size)  # (kind, slug, title)
+        self._seq = 0                       # sequence number of the next entry
+
+    def _append(self, entry):
+        with self._lock:
+            self._journal.append(entry)
+            self._seq += 1
+
+    def record_visit(self, path: str):
+        self._append(("visit", path, ""))
+
+    def record_event(self, event: str, slug: str = "", title: str = ""):
+        self._append((event, slug, title))
+
+    def cursor(self) -> int:
+        with self._lock:
+            return self._seq
+
+    def delta_since(self, cursor: int):
+        """Return (delta, new_cursor); delta["reset"] is True if the reader fell off the journal."""
+        with self._lock:
+            seq = self._seq
+            oldest = seq - len(self._journal)
+            reset = cursor < oldest
+            start = max(cursor, oldest) - oldest
+            entries = list(islice(self._journal, start, None))
+
+        visits = plays = 0
+        sermons, titles = Counter(), {}
+        for kind, key, title in entries:
+            if kind == "visit":
+                visits += 1
+            elif kind == "play":
+                plays += 1
+                sermons[key] += 1
+                if title:
+                    titles[key] = title
+        delta = {
+            "visits": visits,
+            "plays": plays,
+            "sermons": [{"slug": s, "title": titles.get(s, ""), "plays": n} for s, n in sermons.most_common(10)],
+            "reset": reset,
+        }
+        return delta, seq
+
+
+hub = LiveHub()
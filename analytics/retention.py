@@ -0,0 +1,268 @@
+"""
+Retention for the raw Visit/Event tables.
+
+Hot data lives in monthly RANGE partitions on MySQL (`PARTITION BY RANGE
+(TO_DAYS(ts))`, one partition per UTC month plus a catch-all `p_future`).
+`manage.py rotate_analytics` keeps a few empty partitions ahead of time and,
+for months older than ANALYTICS_RETENTION_MONTHS:
+
+  1. writes daily Rollup rows for every day that is still complete,
+  2. archives the month to gzipped JSONL in private storage (analytics.storages),
+  3. drops the partition (an O(1) metadata change instead of a huge DELETE).
+
+On other databases step 3 falls back to chunked deletes, so the same command
+works on a SQLite dev box.
+
+Partitioning needs every unique key to include `ts`, so `--init` moves the
+primary key to (id, ts). The user FKs are declared with db_constraint=False
+because partitioned InnoDB tables can't have foreign keys.
+"""
+import gzip
+import json
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import attribution, storages
+from .models import Event, PathDim, RefererDim, Rollup, UserAgentDim, Visit
+from .shedding import weighted_distinct
+
+RETENTION_MONTHS = getattr(settings, "ANALYTICS_RETENTION_MONTHS", 13)
+ROLLUP_TOP_N = 500  # per dimension per day; the long tail isn't worth keeping
+DELETE_CHUNK = 5000
+MODELS = (Visit, Event)
+DIMENSIONS = (PathDim, RefererDim, UserAgentDim)
+
+
+# -------- month helpers (UTC, matching TO_DAYS(ts) on UTC-stored datetimes) --------
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def add_months(d: date, n: int) -> date:
+    m = d.month - 1 + n
+    return date(d.year + m // 12, m % 12 + 1, 1)
+
+
+def _utc(d: date) -> datetime:
+    return datetime.combine(d, time.min, tzinfo=dt_timezone.utc)
+
+
+def retention_cutoff(keep_months: int = RETENTION_MONTHS) -> date:
+    """First UTC month that is kept hot; everything before it is archived."""
+    return add_months(month_start(timezone.now().astimezone(dt_timezone.utc).date()), -keep_months)
+
+
+# -------- rollups --------
+
+def _local_bounds(day: date):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(day, time.min), tz)
+    return start, start + timedelta(days=1)
+
+
+def rollup_day(day: date) -> int:
+    """(Re)build the Rollup rows for one local day from raw rows. Idempotent."""
+    start, end = _local_bounds(day)
+    visits = Visit.objects.filter(is_bot=False, ts__gte=start, ts__lt=end)
+    rows = [
+        Rollup(day=day, kind="pageviews", key="", count=visits.aggregate(n=Sum("weight"))["n"] or 0),
+        Rollup(day=day, kind="visitors", key="", count=sum(weighted_distinct(visits).values())),
+    ]
+    for kind, field, qs in (
+        ("path", "path__value", visits),
+        ("referer", "referer__host", visits.filter(referer__isnull=False)),
+        ("country", "country", visits.exclude(country="")),
+        ("play", "slug", Event.objects.filter(event="play", ts__gte=start, ts__lt=end)),
+    ):
+        top = qs.values(field).annotate(n=Sum("weight")).order_by("-n")[:ROLLUP_TOP_N]
+        rows.extend(Rollup(day=day, kind=kind, key=(r[field] or "")[:512], count=r["n"]) for r in top)
+
+    with transaction.atomic():
+        Rollup.objects.filter(day=day).delete()
+        Rollup.objects.bulk_create(rows)
+    attribution.rollup_day(day)
+    return len(rows)
+
+
+def rollup_until(boundary: datetime, log=None) -> int:
+    """Roll up every complete local day that starts before `boundary` and has no rollup yet."""
+    log = log or (lambda msg: None)
+    first = Visit.objects.order_by("ts").values_list("ts", flat=True).first()
+    if not first:
+        return 0
+    day = timezone.localdate(first)
+    last = min(timezone.localdate(boundary), timezone.localdate() - timedelta(days=1))
+    done = set(Rollup.objects.filter(kind="pageviews", day__gte=day, day__lte=last).values_list("day", flat=True))
+    n = 0
+    while day <= last:
+        if day not in done:
+            rollup_day(day)
+            n += 1
+        day += timedelta(days=1)
+    if n:
+        log(f"rolled up {n} days")
+    return n
+
+
+# -------- archive --------
+
+def archive_month(model, month: date, log=None) -> tuple[str, int]:
+    """Stream one UTC month of `model` to <table>/<YYYY-MM>-<hmac>.jsonl.gz in private archive storage."""
+    log = log or (lambda msg: None)
+    start, end = _utc(month), _utc(add_months(month, 1))
+    fields = [f.attname for f in model._meta.concrete_fields]
+    # dimension FKs are archived as their values so the files stand on their own
+    fields += [f"{f.name}__value" for f in model._meta.concrete_fields
+               if f.is_relation and f.related_model in DIMENSIONS]
+    qs = model.objects.filter(ts__gte=start, ts__lt=end).order_by().values(*fields)
+
+    count = 0
+    with NamedTemporaryFile(suffix=".jsonl.gz") as tmp:
+        with gzip.open(tmp, "wt", encoding="utf-8") as gz:
+            for row in qs.iterator(chunk_size=5000):
+                gz.write(json.dumps(row, cls=DjangoJSONEncoder, separators=(",", ":")))
+                gz.write("\n")
+                count += 1
+        if not count:
+            return "", 0
+        tmp.flush()
+        tmp.seek(0)
+        name = storages.signed_name(f"{model._meta.db_table}/{month:%Y-%m}", ".jsonl.gz")
+        name = storages.archives.save(name, File(tmp))
+    log(f"archived {count} {model._meta.db_table} rows to {name}")
+    return name, count
+
+
+# -------- MySQL partitions --------
+
+def is_mysql() -> bool:
+    return connection.vendor == "mysql"
+
+
+def _pname(month: date) -> str:
+    return f"p{month:%Y%m}"
+
+
+def list_partitions(model) -> list[str]:
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION",
+            [model._meta.db_table],
+        )
+        return [r[0] for r in cur.fetchall()]
+
+
+def _partition_clause(month: date) -> str:
+    return f"PARTITION {_pname(month)} VALUES LESS THAN (TO_DAYS('{add_months(month, 1):%Y-%m-%d}'))"
+
+
+def init_partitions(model, ahead: int = 3, dry_run: bool = False, log=None) -> list[str]:
+    """Convert an unpartitioned table: PK -> (id, ts), one partition per month since the oldest row."""
+    log = log or (lambda msg: None)
+    table = model._meta.db_table
+    first = model.objects.order_by("ts").values_list("ts", flat=True).first() or timezone.now()
+    month = month_start(first.astimezone(dt_timezone.utc).date())
+    last = add_months(month_start(timezone.now().astimezone(dt_timezone.utc).date()), ahead)
+    parts = []
+    while month <= last:
+        parts.append(_partition_clause(month))
+        month = add_months(month, 1)
+    parts.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+    statements = [
+        f"ALTER TABLE `{table}` DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `ts`)",
+        f"ALTER TABLE `{table}` PARTITION BY RANGE (TO_DAYS(`ts`)) ({', '.join(parts)})",
+    ]
+    return _run(statements, dry_run, log)
+
+
+def ensure_future_partitions(model, ahead: int = 3, dry_run: bool = False, log=None) -> list[str]:
+    """Split p_future so the next `ahead` months each have their own empty partition."""
+    existing = set(list_partitions(model))
+    month = month_start(timezone.now().astimezone(dt_timezone.utc).date())
+    new = []
+    for i in range(ahead + 1):
+        m = add_months(month, i)
+        if _pname(m) not in existing:
+            new.append(_partition_clause(m))
+    if not new:
+        return []
+    table = model._meta.db_table
+    sql = (f"ALTER TABLE `{table}` REORGANIZE PARTITION p_future INTO "
+           f"({', '.join(new)}, PARTITION p_future VALUES LESS THAN MAXVALUE)")
+    return _run([sql], dry_run, log)
+
+
+def _run(statements, dry_run, log):
+    for sql in statements:
+        log(sql)
+        if not dry_run:
+            with connection.cursor() as cur:
+                cur.execute(sql)
+    return statements
+
+
+# -------- purge --------
+
+def months_before(model, cutoff: date) -> list[date]:
+    first = model.objects.filter(ts__lt=_utc(cutoff)).order_by("ts").values_list("ts", flat=True).first()
+    if not first:
+        return []
+    month, out = month_start(first.astimezone(dt_timezone.utc).date()), []
+    while month < cutoff:
+        out.append(month)
+        month = add_months(month, 1)
+    return out
+
+
+def purge_month(model, month: date, dry_run: bool = False, log=None) -> None:
+    log = log or (lambda msg: None)
+    if is_mysql() and _pname(month) in list_partitions(model):
+        _run([f"ALTER TABLE `{model._meta.db_table}` DROP PARTITION {_pname(month)}"], dry_run, log)
+        return
+    start, end = _utc(month), _utc(add_months(month, 1))
+    qs = model.objects.filter(ts__gte=start, ts__lt=end)
+    if dry_run:
+        log(f"would delete {qs.count()} {model._meta.db_table} rows for {month:%Y-%m}")
+        return
+    deleted = 0
+    while True:
+        ids = list(qs.values_list("id", flat=True)[:DELETE_CHUNK])
+        if not ids:
+            break
+        deleted += model.objects.filter(id__in=ids).delete()[0]
+    log(f"deleted {deleted} {model._meta.db_table} rows for {month:%Y-%m}")
+
+
+def rotate(keep_months: int = RETENTION_MONTHS, ahead: int = 3, init: bool = False, dry_run: bool = False, log=None):
+    log = log or (lambda msg: None)
+    if is_mysql():
+        for model in MODELS:
+            if list_partitions(model):
+                ensure_future_partitions(model, ahead=ahead, dry_run=dry_run, log=log)
+            elif init:
+                init_partitions(model, ahead=ahead, dry_run=dry_run, log=log)
+            else:
+                log(f"{model._meta.db_table} is not partitioned (run with --init)")
+
+    cutoff = retention_cutoff(keep_months)
+    # roll up while every row of the boundary days still exists
+    if not dry_run:
+        rollup_until(_utc(cutoff), log=log)
+
+    for model in MODELS:
+        for month in months_before(model, cutoff):
+            if dry_run:
+                log(f"would archive {model._meta.db_table} {month:%Y-%m}")
+            else:
+                archive_month(model, month, log=log)
+            purge_month(model, month, dry_run=dry_run, log=log)
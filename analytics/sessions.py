@@ -0,0 +1,223 @@
+"""
+Visit sessionization and the session-based reports (cohorts, funnel).
+
+`manage.py sessionize_visits` walks non-bot visits newer than the
+"sessions" Watermark in (visitor_id, ts) order, which the (visitor_id, ts)
+index serves directly. A visitor's visits become VisitSession rows. A gap
+longer than ANALYTICS_SESSION_GAP_S starts a new session. A visitor's
+latest stored session is reopened when their next visit arrives within the
+gap, so runs can be frequent and small.
+
+Visits are processed one time window at a time. Each window's sessions
+and the watermark commit together, so an interrupted run never counts a
+visit twice. Visits newer than ANALYTICS_SESSION_LAG_S are left for the
+next run, which gives slow writers time to land.
+
+Play events are attached afterwards. A session that reached a sermon detail
+page and has a "play" from the same visitor within its time span (plus the
+gap) completes the listing -> detail -> play funnel.
+"""
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Min, Q, Sum
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from .models import Event, PathDim, Visit, VisitSession, Watermark
+from .shedding import weighted_distinct
+
+GAP_S = getattr(settings, "ANALYTICS_SESSION_GAP_S", 30 * 60)
+LAG_S = getattr(settings, "ANALYTICS_SESSION_LAG_S", 5 * 60)
+WINDOW = timedelta(days=1)
+CHUNK = 5000
+WATERMARK = "sessions"
+LISTING, DETAIL, PLAY = 1, 2, 3
+ROUTES = {"stream:past_list": LISTING, "stream:past_detail": DETAIL}
+
+
+def monday(dt):
+    day = timezone.localtime(dt).date()
+    return day - timedelta(days=day.weekday())
+
+
+class PathSteps(dict):
+    """path_id -> funnel step (0 when the path isn't part of the funnel), resolved once per run."""
+
+    def load(self, ids):
+        missing = {i for i in ids if i is not None and i not in self}
+        for pk, value in PathDim.objects.filter(id__in=missing).values_list("id", "value"):
+            try:
+                self[pk] = ROUTES.get(resolve(value).view_name, 0)
+            except Resolver404:
+                self[pk] = 0
+        self.update({i: 0 for i in missing if i not in self})
+
+
+def _visit_chunks(start, end, size=CHUNK):
+    """Non-bot visits with start < ts <= end as (id, visitor_id, ts, path_id, weight), keyset-paged in (visitor_id, ts, id) order."""
+    qs = (Visit.objects.filter(is_bot=False, ts__gt=start, ts__lte=end).exclude(visitor_id="")
+          .order_by("visitor_id", "ts", "id").values_list("id", "visitor_id", "ts", "path_id", "weight"))
+    after = None
+    while True:
+        page = qs
+        if after:
+            v, t, pk = after
+            page = qs.filter(Q(visitor_id__gt=v) | Q(visitor_id=v, ts__gt=t) | Q(visitor_id=v, ts=t, id__gt=pk))
+        rows = list(page[:size])
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][1], rows[-1][2], rows[-1][0]
+
+
+def _sessionize_chunk(rows, steps: PathSteps) -> int:
+    gap = timedelta(seconds=GAP_S)
+    visitors = {r[1] for r in rows}
+    lo = min(r[2] for r in rows)
+    steps.load(r[3] for r in rows)
+
+    latest = {}
+    for s in VisitSession.objects.filter(visitor_id__in=visitors, ended_at__gte=lo - gap).order_by("visitor_id", "-ended_at"):
+        latest.setdefault(s.visitor_id, s)
+    cohorts = dict(VisitSession.objects.filter(visitor_id__in=visitors).values("visitor_id")
+                   .annotate(w=Min("cohort_week")).values_list("visitor_id", "w"))
+
+    new, reopened = [], {}
+    for visitor, visits in groupby(rows, key=lambda r: r[1]):
+        cur, cohort = latest.get(visitor), cohorts.get(visitor)
+        for _, _, ts, path_id, weight in visits:
+            if cur is None or ts - cur.ended_at > gap:
+                week = monday(ts)
+                cur = VisitSession(visitor_id=visitor, started_at=ts, ended_at=ts, entry_path_id=path_id,
+                                   is_return=cohort is not None, week=week, cohort_week=cohort or week)
+                cohort = cohort or week
+                new.append(cur)
+            elif cur.pk:
+                reopened[cur.pk] = cur
+            cur.ended_at = ts
+            cur.exit_path_id = path_id
+            cur.depth += 1
+            cur.duration_s = int((cur.ended_at - cur.started_at).total_seconds())
+            cur.weight = max(cur.weight, weight)
+            if steps.get(path_id) == cur.funnel + 1 and cur.funnel < DETAIL:
+                cur.funnel += 1
+
+    VisitSession.objects.bulk_create(new, batch_size=1000)
+    VisitSession.objects.bulk_update(list(reopened.values()), ["ended_at", "exit_path", "depth", "duration_s", "funnel", "weight"], batch_size=1000)
+    return len(new)
+
+
+def _attach_plays(start, end) -> int:
+    """Mark sessions at the detail step that have a play from the same visitor in their span."""
+    gap = timedelta(seconds=GAP_S)
+    plays = list(Event.objects.filter(event="play", ts__gt=start, ts__lte=end).exclude(visitor_id="")
+                 .values_list("visitor_id", "ts"))
+    if not plays:
+        return 0
+    by_visitor = {}
+    for visitor, ts in plays:
+        by_visitor.setdefault(visitor, []).append(ts)
+    hits = set()
+    for s in VisitSession.objects.filter(
+        visitor_id__in=by_visitor, funnel=DETAIL,
+        started_at__lte=max(ts for _, ts in plays), ended_at__gte=min(ts for _, ts in plays) - gap,
+    ).values("id", "visitor_id", "started_at", "ended_at"):
+        if any(s["started_at"] <= ts <= s["ended_at"] + gap for ts in by_visitor[s["visitor_id"]]):
+            hits.add(s["id"])
+    return VisitSession.objects.filter(id__in=hits).update(funnel=PLAY)
+
+
+def run(log=print) -> int:
+    """Sessionize every visit between the watermark and now - LAG_S; returns sessions created."""
+    until = timezone.now() - timedelta(seconds=LAG_S)
+    mark = Watermark.objects.filter(name=WATERMARK).first()
+    if mark:
+        start = mark.ts
+    else:
+        first = Visit.objects.filter(is_bot=False).aggregate(m=Min("ts"))["m"]
+        if first is None:
+            return 0
+        start = first - timedelta(microseconds=1)
+    steps, created = PathSteps(), 0
+    while start < until:
+        end = min(start + WINDOW, until)
+        with transaction.atomic():
+            n = sum(_sessionize_chunk(rows, steps) for rows in _visit_chunks(start, end))
+            played = _attach_plays(start, end)
+            Watermark.objects.update_or_create(name=WATERMARK, defaults={"ts": end})
+        created += n
+        log(f"  {timezone.localtime(end):%Y-%m-%d %H:%M}: {n} new sessions, {played} reached play")
+        start = end
+    return created
+
+
+def reset() -> None:
+    """Forget every session so the next run rebuilds them from the raw visits still kept."""
+    with transaction.atomic():
+        VisitSession.objects.all().delete()
+        Watermark.objects.filter(name=WATERMARK).delete()
+
+
+# -------- reports --------
+
+def _cached(key, fn):
+    data = cache.get(key)
+    if data is None:
+        data = fn()
+        cache.set(key, data, getattr(settings, "ANALYTICS_SUMMARY_TTL", 60))
+    return data
+
+
+def overview(days: int) -> dict:
+    """Per-session engagement over the last `days` days (feeds the dashboard footer)."""
+    def build():
+        qs = VisitSession.objects.filter(started_at__gte=timezone.now() - timedelta(days=days))
+        agg = qs.aggregate(
+            sessions=Sum("weight"), bounces=Sum("weight", filter=Q(depth=1)),
+            returning=Sum("weight", filter=Q(is_return=True)),
+            depth=Sum(F("depth") * F("weight")), duration=Sum(F("duration_s") * F("weight")),
+        )
+        n = agg["sessions"] or 0
+        return {
+            "sessions": n,
+            "bounce_rate": round((agg["bounces"] or 0) / n * 100, 1) if n else None,
+            "returning_rate": round((agg["returning"] or 0) / n * 100, 1) if n else None,
+            "pages_per_session": round(agg["depth"] / n, 2) if n else 0,
+            "avg_minutes": round(agg["duration"] / n / 60, 1) if n else 0,
+        }
+    return _cached(f"analytics:sessions:overview:{days}", build)
+
+
+def funnel(days: int) -> dict:
+    """Sessions reaching each step of listing -> detail -> play (in that order) in the last `days` days."""
+    def build():
+        qs = VisitSession.objects.filter(started_at__gte=timezone.now() - timedelta(days=days))
+        agg = qs.aggregate(sessions=Sum("weight"), **{
+            name: Sum("weight", filter=Q(funnel__gte=i)) for i, name in enumerate(VisitSession.FUNNEL_STEPS, 1)
+        })
+        return {"sessions": agg.pop("sessions") or 0,
+                "steps": [{"step": name, "count": agg[name] or 0} for name in VisitSession.FUNNEL_STEPS]}
+    return _cached(f"analytics:sessions:funnel:{days}", build)
+
+
+def cohorts(weeks: int) -> dict:
+    """Weekly returning-visitor cohorts: distinct visitors of each first-visit week active N weeks later."""
+    def build():
+        first = monday(timezone.now()) - timedelta(weeks=weeks - 1)
+        cells = {}
+        counts = weighted_distinct(VisitSession.objects.filter(cohort_week__gte=first), ("cohort_week", "week"))
+        for (cohort, week), n in counts.items():
+            cells[(cohort, (week - cohort).days // 7)] = n
+        rows = []
+        for i in range(weeks):
+            week = first + timedelta(weeks=i)
+            size = cells.get((week, 0), 0)
+            counts = [cells.get((week, k), 0) for k in range(weeks - i)]
+            rows.append({"week": week.isoformat(), "size": size, "counts": counts,
+                         "rates": [round(c / size * 100, 1) if size else 0 for c in counts]})
+        return {"weeks": weeks, "rows": rows}
+    return _cached(f"analytics:sessions:cohorts:{weeks}", build)
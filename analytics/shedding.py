@@ -0,0 +1,210 @@
+"""
+Adaptive load shedding for Visit/Event ingestion.
+
+VisitMiddleware and event_collect ask `controller.admit(visitor_id, is_bot)`
+before handing a row to analytics.spool. The controller watches the
+signals that show analytics writes holding up requests. Which ones count
+depends on where requests write (ANALYTICS_INGEST):
+
+  inline  write_ms   EWMA of the time one INSERT statement takes (spool.write_rows)
+          inflight   inline writes running at this moment in this process
+  spool   append_ms  EWMA of the time one spool append takes in the request
+          backlog    bytes of closed spool segments not loaded yet
+          inflight   inline fallback writes when an append failed
+
+In spool mode requests never INSERT, so the loader thread's write_ms isn't
+a request cost. A slow database shows up as a growing backlog instead.
+
+Pressure is the worst of the signals divided by its threshold
+(ANALYTICS_SHED_WRITE_MS / _APPEND_MS / _INFLIGHT / _BACKLOG_MB). The
+controller then picks a mode:
+
+  full       pressure < 1: every row is stored
+  drop_bots  pressure < 2: bot rows are dropped, human rows are all stored
+  sample     pressure >= 2: bots are dropped and 1 in `weight` visitors are kept,
+             where weight is the next power of two of the pressure
+             (up to ANALYTICS_SHED_MAX_WEIGHT)
+
+Sampling is by visitor (a hash of visitor_id), so a kept visitor keeps
+whole sessions and their plays. Because weights are powers of two, the
+visitors kept at weight 8 are a subset of those kept at 4. Each stored row
+carries its `weight`, and the dashboards count Sum("weight") instead of
+rows (and weighted_distinct for distinct visitors, which counts a visitor
+stored at several weights once, at the highest).
+
+Pressure is re-evaluated at most every EVAL_S seconds, so admit() costs
+O(1) per request. A higher pressure takes effect at once. A lower one only
+takes effect after it has held for ANALYTICS_SHED_COOLDOWN_S. State is per
+process (the backlog is shared through the spool directory), and
+`state()` is reported by /analytics/api/perf/ and /analytics/metrics/.
+"""
+import os
+import random
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+ENABLED = getattr(settings, "ANALYTICS_SHEDDING", True)
+WRITE_MS = getattr(settings, "ANALYTICS_SHED_WRITE_MS", 250)
+APPEND_MS = getattr(settings, "ANALYTICS_SHED_APPEND_MS", 50)
+INFLIGHT = getattr(settings, "ANALYTICS_SHED_INFLIGHT", 8)
+BACKLOG_MB = getattr(settings, "ANALYTICS_SHED_BACKLOG_MB", 64)
+MAX_WEIGHT = getattr(settings, "ANALYTICS_SHED_MAX_WEIGHT", 64)
+COOLDOWN_S = getattr(settings, "ANALYTICS_SHED_COOLDOWN_S", 30)
+EVAL_S = 1.0
+EWMA_ALPHA = 0.2
+FULL, DROP_BOTS, SAMPLE = "full", "drop_bots", "sample"
+
+
+def weight_for(pressure: float) -> int:
+    """Sampling weight for a pressure: 1 below 2, else the next power of two (capped)."""
+    if pressure < 2:
+        return 1
+    w = 2
+    while w < pressure and w < MAX_WEIGHT:
+        w *= 2
+    return w
+
+
+def _mode(pressure: float) -> str:
+    return FULL if pressure < 1 else DROP_BOTS if pressure < 2 else SAMPLE
+
+
+class Controller:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.write_ms = 0.0
+        self.append_ms = 0.0
+        self.inflight = 0
+        self.backlog = 0
+        self.pressure = 0.0
+        self.mode = FULL
+        self.weight = 1
+        self.changed_at = time.time()
+        self._evaluated = 0.0
+        self._calm_since = None
+        self.admitted = 0
+        self.dropped = {DROP_BOTS: 0, SAMPLE: 0}
+
+    # -------- signals --------
+
+    def observe_write(self, ms: float, statements: int = 1) -> None:
+        per = ms / max(statements, 1)
+        self.write_ms += EWMA_ALPHA * (per - self.write_ms)
+
+    def observe_append(self, ms: float) -> None:
+        self.append_ms += EWMA_ALPHA * (ms - self.append_ms)
+
+    def write_started(self) -> None:
+        with self._lock:
+            self.inflight += 1
+
+    def write_finished(self) -> None:
+        with self._lock:
+            self.inflight -= 1
+
+    def _backlog(self) -> int:
+        from . import spool
+
+        try:
+            with os.scandir(spool.SPOOL_DIR) as it:
+                return sum(e.stat().st_size for e in it if e.name.endswith(".seg"))
+        except OSError:
+            return 0
+
+    # -------- decision --------
+
+    def evaluate(self, now: float = None) -> None:
+        from . import spool
+
+        now = now or time.time()
+        self._evaluated = now
+        if spool.MODE == "spool":
+            self.backlog = self._backlog()
+            signals = (self.append_ms / APPEND_MS, self.backlog / (BACKLOG_MB * 1024 * 1024))
+        else:
+            self.backlog = 0
+            signals = (self.write_ms / WRITE_MS,)
+        self.pressure = max(*signals, self.inflight / INFLIGHT)
+        mode, weight = _mode(self.pressure), weight_for(self.pressure)
+        rank = (mode != FULL) + (mode == SAMPLE) * weight
+        current = (self.mode != FULL) + (self.mode == SAMPLE) * self.weight
+        if rank >= current:
+            self._calm_since = None
+            if rank > current:
+                self.mode, self.weight, self.changed_at = mode, weight, now
+        elif self._calm_since is None:
+            self._calm_since = now
+        elif now - self._calm_since >= COOLDOWN_S:
+            self.mode, self.weight, self.changed_at, self._calm_since = mode, weight, now, None
+
+    def admit(self, visitor_id: str = "", is_bot: bool = False) -> int:
+        """Weight to store this row with, or 0 to drop it."""
+        if not ENABLED:
+            return 1
+        now = time.time()
+        if now - self._evaluated >= EVAL_S:
+            with self._lock:
+                if now - self._evaluated >= EVAL_S:
+                    self.evaluate(now)
+        if self.mode == FULL:
+            self.admitted += 1
+            return 1
+        if is_bot:
+            self.dropped[DROP_BOTS] += 1
+            return 0
+        if self.mode == SAMPLE:
+            w = self.weight
+            bucket = zlib.crc32(visitor_id.encode()) if visitor_id else random.getrandbits(32)
+            if bucket & (w - 1):
+                self.dropped[SAMPLE] += 1
+                return 0
+            self.admitted += 1
+            return w
+        self.admitted += 1
+        return 1
+
+    def state(self) -> dict:
+        return {
+            "mode": self.mode, "weight": self.weight, "pressure": round(self.pressure, 2),
+            "write_ms": round(self.write_ms, 1), "append_ms": round(self.append_ms, 2),
+            "inflight": self.inflight, "backlog_bytes": self.backlog,
+            "since": self.changed_at, "admitted": self.admitted, "dropped": dict(self.dropped),
+        }
+
+
+controller = Controller()
+
+
+# -------- re-weighted counts for dashboard queries --------
+
+def weighted_distinct(qs, group_by=(), field="visitor_id") -> dict:
+    """
+    Distinct `field` per group of `qs`, each counted `weight` times:
+    {group tuple: estimate}. Exact while nothing was sampled.
+
+    A visitor stored at several weights in one group (shedding changed
+    mid-day) counts once, at the highest; only such groups are recounted
+    per visitor.
+    """
+    out, mixed = {}, set()
+    for r in qs.values(*group_by, "weight").annotate(n=Count(field, distinct=True)).order_by():
+        key = tuple(r[f] for f in group_by)
+        if key in out:
+            mixed.add(key)
+        out[key] = out.get(key, 0) + r["n"] * r["weight"]
+    if not mixed:
+        return out
+    per_visitor = qs.values(*group_by, field).annotate(w=Max("weight")).order_by()
+    if len(group_by) == 1:
+        per_visitor = per_visitor.filter(**{f"{group_by[0]}__in": [key[0] for key in mixed]})
+    for key in mixed:
+        out[key] = 0
+    for r in per_visitor.iterator():
+        key = tuple(r[f] for f in group_by)
+        if key in mixed:
+            out[key] += r["w"]
+    return out
@@ -0,0 +1,390 @@
+"""
+Durable local spool for Visit/Event ingestion.
+
+With ANALYTICS_INGEST = "spool", VisitMiddleware and event_collect don't
+touch the database. They append one record to this process's open segment
+file in ANALYTICS_SPOOL_DIR, so a slow or unavailable database no longer
+slows pages down or loses rows. Records are cleaned first (clean(): every
+field coerced and cut to its column), and a record is
+
+    4-byte length | 4-byte CRC32 | JSON [kind, fields]
+
+written with an unbuffered write (it survives a process crash at once).
+The file is fsync'ed every SYNC_EVERY records or SYNC_S seconds. A segment
+is closed ("*.open" renamed to "*.seg") once it reaches SEGMENT_BYTES or
+ROTATE_S seconds, and on exit.
+
+The loader claims a ready segment by renaming it to
+"*.<host>-<pid>.loading" (atomic, so several loaders, on one host or
+several, can share a directory). It resolves dimensions, bulk_creates the
+rows in one transaction and deletes the file.
+
+- Lost connection: if the database can't be reached, the segment is put
+  back for the next attempt.
+- Bad records: any other failure retries the segment row by row. Rows
+  that still fail go to "*.bad" for inspection, and the rest is loaded, so
+  one bad record never holds up the spool.
+- Crashed processes: segments left ".open" or ".loading" by a process of
+  this host that no longer exists are recovered on the next pass. Files of
+  other hosts are left to them.
+- Torn tail: a torn record at the end of a segment, from a crash mid-write,
+  is skipped, and everything before it is loaded.
+- At-least-once: a crash between the commit and the delete loads that
+  segment again.
+
+Loading runs in a daemon thread of each web process
+(ANALYTICS_SPOOL_LOADER = "thread"), which also publishes its process's
+idle segment, or from cron with `manage.py load_analytics_spool`
+("command"), where an idle segment is published by the next record.
+"""
+import atexit
+import ipaddress
+import json
+import logging
+import math
+import os
+import re
+import socket
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone as dt_timezone
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, transaction
+
+from .shedding import controller
+
+log = logging.getLogger(__name__)
+
+MODE = getattr(settings, "ANALYTICS_INGEST", "inline")  # "inline" | "spool"
+SPOOL_DIR = Path(getattr(settings, "ANALYTICS_SPOOL_DIR", Path(settings.BASE_DIR) / "var" / "analytics-spool"))
+LOADER = getattr(settings, "ANALYTICS_SPOOL_LOADER", "thread")  # "thread" | "command"
+SEGMENT_BYTES = 8 * 1024 * 1024
+ROTATE_S = 5
+SYNC_EVERY = 64
+SYNC_S = 1.0
+LOAD_EVERY_S = 2
+BATCH_SIZE = 1000
+HEADER = struct.Struct(">II")
+HOST = re.sub(r"[^A-Za-z0-9]", "_", socket.gethostname())[:24]  # in file names, so no "-" or "."
+TRANSIENT = (OperationalError, InterfaceError)  # the loader retries these; anything else is a bad record
+
+
+# -------- records -> rows (shared by inline ingest and the loader) --------
+
+def _ts(value) -> datetime:
+    return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+
+
+def _visit(r: dict):
+    from . import dimensions
+    from .models import Visit
+
+    return Visit(
+        ts=_ts(r["ts"]), session_key=r.get("session_key", ""), visitor_id=r.get("visitor_id", ""),
+        user_id=r.get("user_id"), path_id=dimensions.path_id(r.get("path", "")), method=r.get("method", ""),
+        status_code=r.get("status_code"), response_ms=r.get("response_ms"),
+        referer_id=dimensions.referer_id(r.get("referer", "")), ua_id=dimensions.ua_id(r.get("ua", "")),
+        utm_id=dimensions.utm_id(r.get("utm") or {}), ip=r.get("ip"), ip_hash=r.get("ip_hash", ""),
+        is_bot=r.get("is_bot", False), country=r.get("country", ""), country_name=r.get("country_name", ""),
+        city=r.get("city", ""), weight=r.get("weight", 1),
+    )
+
+
+def _event(r: dict):
+    from .models import Event
+
+    return Event(
+        ts=_ts(r["ts"]), event=r["event"], slug=r.get("slug", ""), title=r.get("title", ""), path=r.get("path", ""),
+        ua=r.get("ua", ""), ip=r.get("ip"), ip_hash=r.get("ip_hash", ""), session_key=r.get("session_key", ""),
+        visitor_id=r.get("visitor_id", ""), user_id=r.get("user_id"), country=r.get("country", ""),
+        country_name=r.get("country_name", ""), city=r.get("city", ""), weight=r.get("weight", 1),
+    )
+
+
+BUILDERS = {"visit": _visit, "event": _event}
+RAW_LIMITS = {"path": 512, "referer": 1024, "ua": 500}  # values that become dimension rows, and Event.ua
+INT_RANGES = {"status_code": (-32768, 32767), "response_ms": (0, 2**31 - 1), "user_id": (1, 2**31 - 1),
+              "weight": (1, 32767)}
+
+
+@lru_cache(maxsize=None)
+def _limits(kind: str) -> dict:
+    from django.apps import apps
+    from django.db.models import CharField
+
+    model = apps.get_model("analytics", kind)
+    return {**RAW_LIMITS, **{f.name: f.max_length for f in model._meta.concrete_fields
+                             if isinstance(f, CharField) and f.max_length}}
+
+
+def clean(kind: str, fields: dict) -> dict:
+    """
+    The record with every field coerced to its type and cut to its column, so
+    that nothing a client sends can make the insert fail (strict MySQL rejects
+    over-long strings and out-of-range numbers).
+    """
+    from .dimensions import UTM_KEYS
+
+    if kind not in BUILDERS:
+        raise ValueError(f"unknown record kind {kind!r}")
+    out = {k: str(fields[k] or "")[:n] for k, n in _limits(kind).items() if k in fields}
+    for k, (lo, hi) in INT_RANGES.items():
+        if fields.get(k) is not None:
+            try:
+                out[k] = min(max(int(fields[k]), lo), hi)
+            except (TypeError, ValueError, OverflowError):
+                out[k] = 1 if k == "weight" else None
+    try:
+        out["ip"] = str(ipaddress.ip_address(fields["ip"])) if fields.get("ip") else None
+    except ValueError:
+        out["ip"] = None
+    if kind == "visit":
+        out["is_bot"] = bool(fields.get("is_bot"))
+        utm = fields.get("utm") if isinstance(fields.get("utm"), dict) else {}
+        out["utm"] = {k: str(utm[k])[:64] for k in UTM_KEYS if utm.get(k)}
+    try:
+        ts = float(fields.get("ts") or time.time())
+    except (TypeError, ValueError):
+        ts = time.time()
+    out["ts"] = ts if math.isfinite(ts) else time.time()
+    return out
+
+
+def write_rows(records) -> int:
+    """Insert (kind, fields) records, one bulk_create per kind inside a single transaction."""
+    by_kind = {}
+    for kind, fields in records:
+        by_kind.setdefault(kind, []).append(BUILDERS[kind](fields))
+    t0 = time.perf_counter()
+    with transaction.atomic():
+        for objs in by_kind.values():
+            type(objs[0]).objects.bulk_create(objs, batch_size=BATCH_SIZE)
+    statements = sum(-(-len(objs) // BATCH_SIZE) for objs in by_kind.values())
+    controller.observe_write((time.perf_counter() - t0) * 1000, statements)
+    return sum(len(objs) for objs in by_kind.values())
+
+
+# -------- writer --------
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SpoolWriter:
+    def __init__(self, directory: Path):
+        self.dir = directory
+        self._lock = threading.Lock()
+        self._fd = None
+        self._path = None
+        self._seq = 0
+
+    def _open(self, now):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._seq += 1
+        name = f"{int(now * 1000):013d}-{HOST}-{os.getpid()}-{self._seq}.open"
+        self._path = self.dir / name
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o640)
+        self._opened, self._size, self._unsynced, self._synced_at = now, 0, 0, now
+
+    def _close(self):
+        """fsync and publish the open segment (caller holds the lock)."""
+        if self._fd is None:
+            return
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        if self._size:
+            os.replace(self._path, self._path.with_suffix(".seg"))
+        else:
+            self._path.unlink(missing_ok=True)
+
+    def append(self, kind: str, fields: dict) -> None:
+        payload = json.dumps([kind, fields], separators=(",", ":"), default=str).encode()
+        record = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        now = time.time()
+        with self._lock:
+            if self._fd is None:
+                self._open(now)
+            os.write(self._fd, record)
+            self._size += len(record)
+            self._unsynced += 1
+            if self._size >= SEGMENT_BYTES or now - self._opened >= ROTATE_S:
+                self._close()
+            elif self._unsynced >= SYNC_EVERY or now - self._synced_at >= SYNC_S:
+                os.fsync(self._fd)
+                self._unsynced, self._synced_at = 0, now
+
+    def flush(self, max_age: float = 0) -> None:
+        """Publish the open segment if it is older than `max_age` seconds (used when traffic is idle)."""
+        with self._lock:
+            if self._fd is not None and time.time() - self._opened >= max_age:
+                self._close()
+
+
+writer = SpoolWriter(SPOOL_DIR)
+atexit.register(writer.flush)
+
+
+# -------- loader --------
+
+def read_segment(path: Path) -> list:
+    """Records of one segment, stopping at a torn or corrupt tail."""
+    data = path.read_bytes()
+    records, pos = [], 0
+    while pos + HEADER.size <= len(data):
+        length, crc = HEADER.unpack_from(data, pos)
+        payload = data[pos + HEADER.size:pos + HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            log.warning("spool segment %s: skipping %d bytes after a torn record", path.name, len(data) - pos)
+            break
+        pos += HEADER.size + length
+        try:
+            records.append(json.loads(payload))
+        except ValueError:
+            log.error("spool segment %s: skipping an undecodable record", path.name)
+    return records
+
+
+def _owner(path: Path):
+    """(host, pid) of the process holding an ".open" or ".loading" file, or None for names it can't parse."""
+    try:
+        if path.suffix == ".open":
+            _, host, pid, _ = path.stem.split("-")
+        else:
+            host, pid = path.stem.rsplit(".", 1)[1].split("-")
+        return host, int(pid)
+    except ValueError:
+        return None
+
+
+def recover(directory: Path = SPOOL_DIR) -> int:
+    """
+    Republish segments left open or half-loaded by processes of this host that are gone.
+    Files owned by other hosts (a shared directory) are left to those hosts.
+    """
+    n = 0
+    for path in [*directory.glob("*.open"), *directory.glob("*.loading")]:
+        owner = _owner(path)
+        if owner is None or owner[0] != HOST or owner[1] == os.getpid() or _alive(owner[1]):
+            continue
+        target = path.with_suffix(".seg") if path.suffix == ".open" else path.with_name(path.stem.rsplit(".", 1)[0] + ".seg")
+        try:
+            os.replace(path, target)
+        except FileNotFoundError:
+            continue  # recovered by another loader of this host
+        n += 1
+    return n
+
+
+def _quarantine(path: Path, records: list) -> None:
+    with open(path.with_suffix(".bad"), "a") as f:
+        for record in records:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+def load_segment(path: Path, records: list) -> int:
+    """
+    Insert a segment's records. If the batch fails for any reason but a lost
+    connection, retry it row by row (each in a savepoint) and set the rows
+    that still fail aside in "<segment>.bad", so one bad record can't hold
+    up the rest of the spool.
+    """
+    try:
+        return write_rows(records)
+    except TRANSIENT:
+        raise
+    except Exception:
+        log.exception("spool segment %s failed as a batch; loading it row by row", path.name)
+    rows, bad = 0, []
+    with transaction.atomic():
+        for record in records:
+            try:
+                rows += write_rows([record])
+            except TRANSIENT:
+                raise
+            except Exception:
+                bad.append(record)
+    if bad:
+        _quarantine(path, bad)
+        log.error("spool segment %s: %d bad records set aside in %s", path.name, len(bad), path.with_suffix(".bad").name)
+    return rows
+
+
+def load(directory: Path = SPOOL_DIR, limit: int | None = None) -> tuple[int, int]:
+    """Load ready segments (oldest first); returns (segments, rows)."""
+    if not directory.exists():
+        return 0, 0
+    recover(directory)
+    segments = rows = 0
+    for path in sorted(directory.glob("*.seg"))[:limit]:
+        claimed = path.with_name(f"{path.stem}.{HOST}-{os.getpid()}.loading")
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue  # another loader got it
+        try:
+            rows += load_segment(path, read_segment(claimed))
+        except Exception:  # the database is unreachable: keep the segment for the next pass
+            os.replace(claimed, path)
+            raise
+        claimed.unlink()
+        segments += 1
+    return segments, rows
+
+
+def _loader_loop():
+    while True:
+        time.sleep(LOAD_EVERY_S)
+        try:
+            writer.flush(max_age=ROTATE_S)
+            load()
+        except Exception:
+            log.exception("analytics spool load failed; segments stay for the next pass")
+        finally:
+            close_old_connections()
+
+
+_loader_started = False
+_loader_lock = threading.Lock()
+
+
+def _start_loader():
+    global _loader_started
+    with _loader_lock:
+        if not _loader_started:
+            threading.Thread(target=_loader_loop, name="analytics-spool-loader", daemon=True).start()
+            _loader_started = True
+
+
+# -------- ingest entry point --------
+
+def submit(kind: str, fields: dict) -> None:
+    """Record one Visit/Event: appended to the spool, or inserted now when ANALYTICS_INGEST = "inline"
+    (and as a fallback when the spool can't be written)."""
+    fields = clean(kind, fields)
+    if MODE == "spool":
+        try:
+            t0 = time.perf_counter()
+            writer.append(kind, fields)
+            controller.observe_append((time.perf_counter() - t0) * 1000)
+            if LOADER == "thread" and not _loader_started:
+                _start_loader()
+            return
+        except OSError:
+            log.exception("analytics spool write failed; inserting inline")
+    controller.write_started()
+    try:
+        write_rows([(kind, fields)])
+    finally:
+        controller.write_finished()
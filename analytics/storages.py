@@ -0,0 +1,44 @@
+"""
+Storage for analytics files that hold visitor data (visitor_id, ip_hash,
+user_id, user agents).
+
+These never go to default (media) storage, because that is a public bucket.
+Background exports are written to ANALYTICS_EXPORT_DIR, a private directory
+on local disk (0700/0600, like accounts.member_export). They are only read
+back through the staff-only download in the ExportJob admin.
+
+Monthly archives have to outlive the app servers, so with USE_S3 they go
+to config.storages.PrivateStorage (private ACL, signed URLs only), else to
+the private local ANALYTICS_ARCHIVE_DIR.
+
+File names carry an HMAC keyed by SECRET_KEY, so they can't be guessed even
+if a directory or bucket prefix is ever exposed.
+"""
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.crypto import salted_hmac
+
+EXPORT_DIR = Path(getattr(settings, "ANALYTICS_EXPORT_DIR", Path(settings.BASE_DIR) / "var" / "analytics-exports"))
+ARCHIVE_DIR = Path(getattr(settings, "ANALYTICS_ARCHIVE_DIR", Path(settings.BASE_DIR) / "var" / "analytics-archive"))
+
+
+def private_dir(location) -> FileSystemStorage:
+    return FileSystemStorage(location=location, file_permissions_mode=0o600, directory_permissions_mode=0o700)
+
+
+def signed_name(stem: str, suffix: str) -> str:
+    """`<stem>-<hmac>.<suffix>`: unguessable, but stable for the same stem."""
+    return f"{stem}-{salted_hmac('analytics.storages', stem).hexdigest()[:20]}{suffix}"
+
+
+def _archive_storage():
+    if getattr(settings, "USE_S3", False):
+        from config.storages import PrivateStorage
+        return PrivateStorage()
+    return private_dir(ARCHIVE_DIR)
+
+
+exports = private_dir(EXPORT_DIR)
+archives = _archive_storage()
@@ -1,3 +1,582 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+import zlib
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.db import connection, transaction
+from django.contrib import admin
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from stream.models import Sermon
+
+from . import (attribution, bots, counters, dimensions, exporting, identity, instrumentation, presence, ratelimit,
+               retention, sessions, shedding, spool, storages)
+from .querybudget import QueryBudgetExceeded, query_budget
+from .models import AttributionDaily, Event, ExportJob, PathDim, SermonStats, Visit, VisitSession
+
+User = get_user_model()
+
+
+def setUpModule():
+    # test-client requests insert their Visit rows inline (rolled back with the test) instead of
+    # appending to the real spool directory, where a later run's loader would pick them up
+    patcher = mock.patch.object(spool, "MODE", "inline")
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+
+
+def write_segment(directory: Path, name: str, records) -> Path:
+    path = directory / name
+    with open(path, "wb") as f:
+        for record in records:
+            payload = json.dumps(record).encode()
+            f.write(spool.HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+    return path
+
+
+class SpoolLoadTests(TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_poisoned_segment_is_quarantined_and_later_segments_load(self):
+        now = time.time()
+        write_segment(self.dir, f"0000000000001-{spool.HOST}-1-1.seg", [
+            ["event", {"ts": now, "event": "play", "slug": "a"}],
+            ["event", {"ts": "not a time", "event": "play"}],
+            ["nope", {"ts": now}],
+            ["visit", {"ts": now, "path": "/one/", "method": "GET"}],
+        ])
+        write_segment(self.dir, f"0000000000002-{spool.HOST}-1-1.seg", [
+            ["visit", {"ts": now, "path": "/two/", "method": "GET"}],
+            ["event", {"ts": now, "event": "pause", "slug": "b"}],
+        ])
+
+        segments, rows = spool.load(self.dir)
+
+        self.assertEqual((segments, rows), (2, 4))
+        self.assertEqual(Visit.objects.count(), 2)
+        self.assertEqual(sorted(Event.objects.values_list("event", flat=True)), ["pause", "play"])
+        self.assertEqual(list(self.dir.glob("*.seg")), [])
+        bad = self.dir / f"0000000000001-{spool.HOST}-1-1.bad"
+        self.assertEqual([json.loads(line)[0] for line in bad.read_text().splitlines()], ["event", "nope"])
+
+    def test_clean_cuts_fields_to_their_columns(self):
+        record = spool.clean("event", {"event": "x" * 40, "slug": "s" * 300, "ip": "not-an-ip",
+                                       "user_id": "12abc", "weight": 10**9, "ts": float("inf")})
+        self.assertEqual(len(record["event"]), 32)
+        self.assertEqual(len(record["slug"]), 160)
+        self.assertIsNone(record["ip"])
+        self.assertIsNone(record["user_id"])
+        self.assertEqual(record["weight"], 32767)
+        self.assertLessEqual(record["ts"], time.time())
+
+    def test_recover_leaves_other_hosts_segments_alone(self):
+        dead = 2 ** 22 + 12345  # above the default pid_max, so no such process
+        ours = write_segment(self.dir, f"0000000000001-{spool.HOST}-{dead}-1.open", [])
+        theirs = write_segment(self.dir, f"0000000000002-otherhost-{dead}-1.open", [])
+        claimed = write_segment(self.dir, f"0000000000003-otherhost-7-1.otherhost-{dead}.loading", [])
+
+        self.assertEqual(spool.recover(self.dir), 1)
+        self.assertFalse(ours.exists())
+        self.assertTrue(ours.with_suffix(".seg").exists())
+        self.assertTrue(theirs.exists())
+        self.assertTrue(claimed.exists())
+        self.assertNotEqual(os.getpid(), dead)
+
+
+class AttributionTests(TestCase):
+    def visit(self, ts, referer):
+        Visit.objects.create(ts=ts, session_key="s", visitor_id=f"v{Visit.objects.count()}", method="GET",
+                             referer_id=dimensions.referer_id(referer))
+
+    def test_today_is_never_frozen_by_a_rollup(self):
+        now = timezone.now()
+        self.visit(now, "https://www.google.com/search?q=a")
+        attribution.rollup(since=timezone.localdate())  # ran mid-day: must not touch today
+        self.assertFalse(AttributionDaily.objects.filter(day=timezone.localdate()).exists())
+
+        self.visit(now, "https://www.google.com/search?q=b")
+        today = timezone.localdate()
+        self.assertEqual(attribution.top_sources(today, today), [{"kind": "search", "host": "google.com", "count": 2}])
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        ratelimit.reset()
+        self.addCleanup(ratelimit.reset)
+        self.factory = RequestFactory()
+
+    def request(self, user=None, visitor=None, xff="198.51.100.1, 203.0.113.5"):
+        request = self.factory.post("/x/", HTTP_X_FORWARDED_FOR=xff, REMOTE_ADDR="10.0.0.1")
+        request.user = user or AnonymousUser()
+        if visitor:
+            request.COOKIES[identity.COOKIE] = visitor
+        return request
+
+    def signed(self, visitor):
+        return signing.get_cookie_signer(salt=identity.COOKIE + identity.SALT).sign(visitor)
+
+    def test_ip_is_the_trusted_hop_not_the_client_supplied_entry(self):
+        self.assertEqual(identity.client_ip(self.request()), "203.0.113.5")
+        self.assertEqual(identity.client_ip(self.request(xff="")), "10.0.0.1")
+
+    def test_identified_clients_get_a_larger_ip_budget(self):
+        now = time.time()
+        burst = int(ratelimit.LIMITS["event"]["burst"])
+        anonymous = [ratelimit.check("event", self.request(), now) for _ in range(burst + 1)]
+        self.assertEqual(anonymous[-1], "ip")
+        # the same address, but each request from its own visitor: not limited by the anonymous flood
+        visitors = [self.signed(str(uuid.uuid4())) for _ in range(burst * 2)]
+        self.assertEqual({ratelimit.check("event", self.request(visitor=v), now) for v in visitors}, {""})
+
+    def test_unsigned_visitor_ids_count_as_anonymous(self):
+        now = time.time()
+        burst = int(ratelimit.LIMITS["event"]["burst"])
+        made_up = [ratelimit.check("event", self.request(visitor=str(uuid.uuid4())), now) for _ in range(burst + 1)]
+        self.assertEqual(made_up[-1], "ip")
+
+    def test_authenticated_progress_is_exempt(self):
+        user = User.objects.create_user(email="listener@example.org", password="x")
+        now = time.time()
+        self.assertEqual({ratelimit.check("progress", self.request(user=user), now) for _ in range(100)}, {""})
+        self.assertEqual(ratelimit.check("event", self.request(user=user), now), "")
+
+
+class IdentityTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def request(self, cookie=None):
+        request = self.factory.get("/sermons/")
+        if cookie is not None:
+            request.COOKIES[identity.COOKIE] = cookie
+        return request
+
+    def reissue(self, request):
+        response = HttpResponse()
+        vid, set_cookie = identity.visitor_id(request)
+        if set_cookie:
+            identity.set_cookie(response, vid)
+        return vid, response.cookies.get(identity.COOKIE)
+
+    def test_new_visitors_get_a_signed_cookie_that_round_trips(self):
+        vid, morsel = self.reissue(self.request())
+        self.assertEqual(morsel["max-age"], identity.MAX_AGE)
+        again = self.request(morsel.value)
+        self.assertEqual(identity.visitor_id(again), (vid, False))
+        self.assertEqual(identity.existing_visitor_id(again), vid)
+
+    def test_a_tampered_cookie_is_not_an_identity(self):
+        vid, morsel = self.reissue(self.request())
+        forged = morsel.value.replace(vid, str(uuid.uuid4()))
+        self.assertEqual(identity.existing_visitor_id(self.request(forged)), "")
+        minted, reissued = self.reissue(self.request(forged))
+        self.assertNotEqual(minted, vid)
+        self.assertIsNotNone(reissued)
+
+    @mock.patch.object(identity, "LEGACY_UNTIL", "2999-12-31")
+    def test_legacy_ids_are_reissued_signed_and_trusted_only_then(self):
+        legacy = str(uuid.uuid4())
+        # beacons and rate limits never take an unsigned id
+        self.assertEqual(identity.existing_visitor_id(self.request(legacy)), "")
+        # the first page view keeps the id and signs it
+        vid, morsel = self.reissue(self.request(legacy))
+        self.assertEqual(vid, legacy)
+        self.assertEqual(identity.existing_visitor_id(self.request(morsel.value)), legacy)
+        self.assertIsNone(self.reissue(self.request(morsel.value))[1])
+
+    @mock.patch.object(identity, "LEGACY_UNTIL", "2000-01-01")
+    def test_legacy_ids_are_dropped_after_the_migration_window(self):
+        legacy = str(uuid.uuid4())
+        vid, morsel = self.reissue(self.request(legacy))
+        self.assertNotEqual(vid, legacy)
+        self.assertIsNotNone(morsel)
+
+
+class LiveStreamTests(TestCase):
+    def test_wsgi_gets_no_stream_and_the_dashboards_poll(self):
+        staff = User.objects.create_user(email="ops@example.org", password="x", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse("analytics:live_stream"))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(response.streaming)
+        self.assertNotContains(self.client.get(reverse("stream:staff_dashboard")), "data-stream=")
+
+
+@mock.patch.object(bots, "RATE_LIMIT", 3)
+class BotRateTests(TestCase):
+    ua = "Mozilla/5.0 (iPhone) Safari/604.1"
+
+    def setUp(self):
+        cache.clear()
+
+    def test_only_page_views_count(self):
+        now = time.time()
+        for _ in range(10):
+            self.assertEqual(bots.classify(self.ua, "203.0.113.7", "h", now, page_view=False), "")
+        self.assertEqual([bots.classify(self.ua, "203.0.113.7", "h", now) for _ in range(4)], ["", "", "", "rate"])
+        factory = RequestFactory()
+        self.assertTrue(bots.is_page_view(factory.get("/some-sermon/")))
+        self.assertFalse(bots.is_page_view(factory.get("/api/search.json")))
+        self.assertFalse(bots.is_page_view(factory.post("/analytics/event/")))
+
+    def test_rate_verdict_is_not_kept_for_the_address(self):
+        now = time.time()
+        [bots.classify(self.ua, "203.0.113.7", "h", now) for _ in range(5)]
+        self.assertIsNone(cache.get("bots:ip:h"))
+        later = now + bots.WINDOW_S + bots._SLOT_S
+        self.assertEqual(bots.classify(self.ua, "203.0.113.7", "h", later), "")
+
+
+class SummaryParamTests(TestCase):
+    def test_bad_or_huge_numbers_are_bounded_not_errors(self):
+        url = reverse("analytics:api_summary")
+        for query in ({"days": "abc", "limit": "x"}, {"days": "-5", "limit": "10000000"}, {"days": "1e9"}):
+            response = self.client.get(url, {**query, "panels": "top_pages"})
+            self.assertEqual(response.status_code, 200, query)
+
+
+class ExportJobTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        storage = storages.private_dir(directory)
+        for patcher in (mock.patch.object(storages, "exports", storage),
+                        mock.patch.object(ExportJob._meta.get_field("file"), "storage", storage)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        Visit.objects.create(ts=timezone.now(), session_key="s", visitor_id="v", method="GET")
+
+    def test_exports_are_private_and_only_served_to_staff(self):
+        job = ExportJob.objects.create(model="analytics.visit", fmt="jsonl.gz")
+        job = exporting.run_job(job, Visit.objects.all())
+        self.assertEqual(job.status, ExportJob.DONE)
+        self.assertRegex(job.file.name, r"^analytics_visit-\d{8}-\d{6}-[0-9a-f]{20}\.jsonl\.gz$")
+        self.assertEqual(os.stat(job.file.path).st_mode & 0o777, 0o600)
+
+        url = reverse("admin:analytics_exportjob_download", args=[job.pk])
+        view = resolve(url).func  # called directly: a client request would spool a Visit for the page
+
+        def get(user):
+            request = RequestFactory().get(url)
+            request.user = user
+            return view(request, pk=job.pk)
+
+        self.assertEqual(get(User.objects.create_user(email="member@example.org", password="x")).status_code, 302)
+        response = get(User.objects.create_superuser(email="admin@example.org", password="x"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("attachment", response["Content-Disposition"])
+        response.close()
+
+    def test_jobs_orphaned_by_a_restart_are_marked_failed(self):
+        old = timezone.now() - timezone.timedelta(seconds=exporting.STALE_S + 60)
+        stuck = ExportJob.objects.create(model="analytics.visit", fmt="csv", status=ExportJob.RUNNING)
+        ExportJob.objects.filter(pk=stuck.pk).update(created_at=old, heartbeat_at=old)
+        live = ExportJob.objects.create(model="analytics.visit", fmt="csv", status=ExportJob.RUNNING,
+                                        heartbeat_at=timezone.now())
+
+        self.assertEqual(exporting.fail_stale_jobs(), 1)
+        stuck.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual((stuck.status, live.status), (ExportJob.FAILED, ExportJob.RUNNING))
+        self.assertTrue(stuck.error)
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = mock.patch.object(storages, "archives", storages.private_dir(directory))
+        self.storage = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_archive_then_delete_round_trip(self):
+        month = retention.add_months(retention.retention_cutoff(), -2)
+        inside = retention._utc(month) + timezone.timedelta(days=3)
+        for i in range(3):
+            Visit.objects.create(ts=inside, session_key="s", visitor_id=f"v{i}", method="GET",
+                                 path_id=dimensions.path_id(f"/sermons/{i}/"))
+        kept = Visit.objects.create(ts=retention._utc(retention.add_months(month, 1)), session_key="s",
+                                    visitor_id="next", method="GET")
+
+        name, count = retention.archive_month(Visit, month)
+        retention.purge_month(Visit, month)
+
+        self.assertEqual(count, 3)
+        self.assertRegex(name, rf"^analytics_visit/{month:%Y-%m}-[0-9a-f]{{20}}\.jsonl\.gz$")
+        self.assertEqual(os.stat(self.storage.path(name)).st_mode & 0o777, 0o600)
+        with self.storage.open(name) as fh:
+            rows = [json.loads(line) for line in gzip.open(fh, "rt")]
+        self.assertEqual(sorted(r["visitor_id"] for r in rows), ["v0", "v1", "v2"])
+        self.assertEqual(sorted(r["path__value"] for r in rows), ["/sermons/0/", "/sermons/1/", "/sermons/2/"])
+        self.assertEqual(list(Visit.objects.values_list("pk", flat=True)), [kept.pk])
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(counters, "buffer", counters.CounterBuffer())
+        self.buffer = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.a, self.b, self.c = (Sermon.objects.create(title=t, audio="audio/x.mp3", duration_s=60) for t in "ABC")
+        counters.rebase(counters.landmark(time.time()))
+
+    def test_top_adds_pending_counts_without_flushing(self):
+        SermonStats.objects.create(sermon=self.a, plays=5, trending_base=counters.landmark(time.time()))
+        SermonStats.objects.create(sermon=self.c, plays=6, trending_base=counters.landmark(time.time()))
+        self.buffer.add(self.a.pk, plays=2)
+        self.buffer.add(self.b.pk, plays=9)  # no SermonStats row yet
+
+        with self.assertNumQueries(2):
+            rows = counters.top("plays", 2)
+
+        self.assertEqual([(r["slug"], r["plays"]) for r in rows], [(self.b.slug, 9), (self.a.slug, 7)])
+        self.assertEqual(self.buffer.pending(), {self.a.pk: (2, 0, 0), self.b.pk: (9, 0, 0)})
+        self.assertEqual(SermonStats.objects.get(pk=self.a.pk).plays, 5)
+
+    def test_write_updates_every_sermon_in_one_statement(self):
+        SermonStats.objects.create(sermon=self.a, plays=5, trending_base=counters.landmark(time.time()))
+        pending = {self.a.pk: [1, 0, 15], self.b.pk: [2, 1, 30]}
+
+        with self.assertNumQueries(2):  # insert the missing row, then one UPDATE
+            counters.write(pending, time.time())
+
+        stats = {s.pk: (s.plays, s.completions, s.listen_s) for s in SermonStats.objects.all()}
+        self.assertEqual(stats, {self.a.pk: (6, 0, 15), self.b.pk: (2, 1, 30)})
+
+
+class DimensionTests(TestCase):
+    def test_ids_from_a_rolled_back_transaction_are_not_cached(self):
+        dimensions.paths.clear()
+        self.addCleanup(dimensions.paths.clear)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            gone = dimensions.path_id("/rolled-back/")
+            raise RuntimeError
+        self.assertFalse(PathDim.objects.filter(pk=gone).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            kept = dimensions.path_id("/rolled-back/")
+        self.assertTrue(PathDim.objects.filter(pk=kept).exists())
+        with self.assertNumQueries(0):
+            self.assertEqual(dimensions.path_id("/rolled-back/"), kept)
+
+    def test_converting_a_fresh_database_is_a_no_op(self):
+        out = io.StringIO()
+        call_command("migrate_visit_dimensions", "all", stdout=out)
+        self.assertIn("nothing to convert", out.getvalue())
+
+
+class SessionTests(TestCase):
+    def setUp(self):
+        self.t0 = timezone.now() - timezone.timedelta(hours=3)
+        self.listing = reverse("stream:past_list")
+        self.detail = reverse("stream:past_detail", kwargs={"slug": "a-sermon"})
+
+    def visit(self, visitor, minutes, path="/about/"):
+        return Visit.objects.create(ts=self.t0 + timezone.timedelta(minutes=minutes), session_key="",
+                                    visitor_id=visitor, method="GET", path_id=dimensions.path_id(path))
+
+    def sessions(self, visitor):
+        return list(VisitSession.objects.filter(visitor_id=visitor).order_by("started_at"))
+
+    def test_a_visitor_split_across_chunks_keeps_one_session(self):
+        for m in (0, 1, 2):
+            self.visit("a", m)
+        self.visit("b", 0)
+        steps = sessions.PathSteps()
+        chunks = list(sessions._visit_chunks(self.t0 - timezone.timedelta(seconds=1), timezone.now(), size=2))
+        self.assertEqual([[r[1] for r in rows] for rows in chunks], [["a", "a"], ["a", "b"]])
+        for rows in chunks:
+            sessions._sessionize_chunk(rows, steps)
+        [a] = self.sessions("a")
+        self.assertEqual((a.depth, a.duration_s), (3, 120))
+
+    def test_a_gap_longer_than_the_limit_starts_a_returning_session(self):
+        gap_m = sessions.GAP_S // 60
+        for m in (0, 10, 10 + gap_m + 1):
+            self.visit("a", m)
+        sessions.run(log=lambda *a: None)
+        first, second = self.sessions("a")
+        self.assertEqual((first.depth, first.is_return), (2, False))
+        self.assertEqual((second.depth, second.is_return), (1, True))
+        self.assertEqual(second.cohort_week, first.week)
+
+    def test_a_play_completes_the_funnel_of_a_detail_session_only(self):
+        for visitor in ("a", "b"):
+            self.visit(visitor, 0, self.listing)
+        self.visit("a", 1, self.detail)
+        played = self.t0 + timezone.timedelta(minutes=2)
+        for visitor in ("a", "b"):
+            Event.objects.create(ts=played, visitor_id=visitor, event="play", slug="a-sermon")
+        sessions.run(log=lambda *a: None)
+        [a], [b] = self.sessions("a"), self.sessions("b")
+        self.assertEqual(a.funnel, sessions.PLAY)
+        self.assertEqual(b.funnel, sessions.LISTING)
+
+
+class QueryBudgetTests(TestCase):
+    def queries(self, n, shape="SELECT %s"):
+        with connection.cursor() as cur:
+            for i in range(n):
+                cur.execute(shape, [i])
+
+    @override_settings(QUERY_BUDGET_MODE="raise")
+    def test_raise_mode_fails_over_budget(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, "ran 3 queries (budget 2)"):
+            with query_budget(2, repeat=10):
+                self.queries(3)
+        with query_budget(3, repeat=10) as budget:
+            self.queries(3)
+        self.assertEqual(budget.count, 3)
+
+    @override_settings(QUERY_BUDGET_MODE="warn")
+    def test_warn_mode_logs_instead(self):
+        with self.assertLogs("analytics.querybudget", "WARNING") as logs:
+            with query_budget(1, name="block"):
+                self.queries(5)  # repeats alone are only checked in raise mode
+        self.assertEqual(logs.output, ["WARNING:analytics.querybudget:block: ran 5 queries (budget 1)"])
+
+    @override_settings(QUERY_BUDGET_MODE="raise")
+    def test_repeated_statement_fails_within_budget(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, "repeated 3x (likely N+1): SELECT ?"):
+            with query_budget(10, repeat=3):
+                self.queries(3, "SELECT %s")
+        with query_budget(10, repeat=3):
+            self.queries(2, "SELECT %s")
+            self.queries(2, "SELECT %s + 1")
+
+    @override_settings(QUERY_BUDGET_MODE="raise")
+    def test_admin_changelist_is_budgeted_while_rendering(self):
+        for title in ("One", "Two", "Three"):
+            Sermon.objects.create(title=title, audio="audio/x.mp3", duration_s=60)
+        model_admin = admin.site._registry[Sermon]
+        request = RequestFactory().get("/admin/stream/sermon/")
+        request.user = User.objects.create_superuser(email="admin@example.org", password="x")
+
+        self.assertEqual(model_admin.changelist_view(request).status_code, 200)
+        with mock.patch.object(type(model_admin), "changelist_query_budget", 1):
+            with self.assertRaisesMessage(QueryBudgetExceeded, "SermonAdmin.changelist_view: ran"):
+                model_admin.changelist_view(request)
+
+
+class SheddingTests(TestCase):
+    def test_spool_mode_sheds_on_append_latency_and_backlog_not_loader_writes(self):
+        controller = shedding.Controller()
+        controller.write_ms = shedding.WRITE_MS * 10  # the loader thread's INSERTs: not a request cost
+        with mock.patch.object(spool, "MODE", "spool"), mock.patch.object(controller, "_backlog", return_value=0):
+            controller.evaluate()
+            self.assertEqual(controller.mode, shedding.FULL)
+            for _ in range(30):
+                controller.observe_append(shedding.APPEND_MS * 1.5)
+            controller.evaluate()
+            self.assertEqual(controller.mode, shedding.DROP_BOTS)
+        with mock.patch.object(spool, "MODE", "spool"), \
+                mock.patch.object(controller, "_backlog", return_value=shedding.BACKLOG_MB * 1024 * 1024 * 4):
+            controller.evaluate()
+            self.assertEqual((controller.mode, controller.weight), (shedding.SAMPLE, 4))
+
+    def test_inline_mode_sheds_on_insert_latency(self):
+        controller = shedding.Controller()
+        controller.write_ms = shedding.WRITE_MS * 1.5
+        with mock.patch.object(spool, "MODE", "inline"):
+            controller.evaluate()
+        self.assertEqual(controller.mode, shedding.DROP_BOTS)
+
+    def test_weighted_distinct_counts_each_visitor_once(self):
+        now = timezone.now()
+        for visitor, weight in (("a", 1), ("a", 2), ("a", 2), ("b", 2), ("c", 1)):
+            Visit.objects.create(ts=now, session_key="s", visitor_id=visitor, method="GET", weight=weight)
+        # a at its highest weight (2), b (2), c (1); summing per weight would count a twice
+        self.assertEqual(shedding.weighted_distinct(Visit.objects.all()), {(): 5})
+        day = timezone.localdate(now)
+        self.assertEqual(shedding.weighted_distinct(Visit.objects.all(), ("ts__date",)), {(day,): 5})
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        instrumentation.histograms.reset()
+        self.addCleanup(instrumentation.histograms.reset)
+
+    def test_server_timing_is_sent_to_staff_only(self):
+        self.client.force_login(User.objects.create_user(email="ops@example.org", password="x", is_staff=True))
+        response = self.client.get(reverse("stream:staff_dashboard"))
+        phases = {part.split(";")[0] for part in response["Server-Timing"].split(", ")}
+        self.assertLessEqual({"db", "tpl", "app", "total"}, phases)
+
+        self.client.logout()
+        with mock.patch.object(instrumentation, "SERVER_TIMING_ALL", False):
+            response = self.client.get(reverse("analytics:api_top_sermons"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Server-Timing", response)
+
+    def test_json_serialization_is_its_own_phase(self):
+        trace = instrumentation.RequestTrace()
+        token = instrumentation._current.set(trace)
+        try:
+            instrumentation.JsonResponse({"rows": list(range(1000))})
+        finally:
+            instrumentation._current.reset(token)
+        self.assertIn("ser", trace.phases)
+
+    @override_settings(ANALYTICS_METRICS_TOKEN="s3cret")
+    def test_metrics_needs_the_bearer_token_or_staff(self):
+        url = reverse("analytics:metrics")
+        self.client.get(reverse("analytics:api_top_sermons"))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer nope").status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('http_request_duration_ms_count{method="GET",route="/analytics/api/top-sermons/"} 1', body)
+        self.assertIn("analytics_ingest_mode", body)
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_heartbeats_count_each_visitor_once_per_bucket(self):
+        now = time.time()
+        for visitor in ("a", "b", "a", "c"):
+            presence.heartbeat(visitor, now)
+        self.assertEqual((presence.current_listeners(now), presence.peak_today()), (3, 3))
+
+    def test_peak_never_goes_down(self):
+        presence.raise_peak(7)
+        presence.raise_peak(5)
+        self.assertEqual(presence.peak_today(), 7)
+
+    def test_peak_survives_a_slower_writer_overwriting_it(self):
+        presence.raise_peak(4)
+        real_set, raced = cache.set, []
+
+        def racing_set(key, value, timeout=None):
+            real_set(key, value, timeout)
+            if not raced:  # a writer that read the old peak stores its smaller count right after ours
+                raced.append(True)
+                real_set(key, 5, timeout)
+
+        with mock.patch.object(cache, "set", side_effect=racing_set):
+            presence.raise_peak(6)
+        self.assertEqual(presence.peak_today(), 6)
+
+    def test_per_process_cache_is_warned_about(self):
+        with mock.patch.object(presence, "SHARED", False), mock.patch.object(presence, "_warned", False):
+            with self.assertLogs("analytics.presence", "WARNING"):
+                presence.heartbeat("a")
@@ -5,6 +5,7 @@ app_name = "analytics"
 
 urlpatterns = [
     path("dashboard/", views.dashboard, name="dashboard"),
+    path("api/summary/", views.api_summary, name="api_summary"),
     path("api/timeseries/", views.api_timeseries, name="api_timeseries"),
     path("api/top-pages/", views.api_top_pages, name="api_top_pages"),
     path("api/top-referrers/", views.api_top_referrers, name="api_top_referrers"),
@@ -15,5 +16,16 @@ urlpatterns = [
     path("api/geo/cities/", views.api_geo_cities, name="api_geo_cities"),
     
     path("api/top-sermons/", views.api_top_sermons, name="api_top_sermons"),
+    path("api/listening/<slug:slug>/", views.api_listening, name="api_listening"),
+    path("api/sessions/", views.api_sessions, name="api_sessions"),
+    path("api/funnel/", views.api_funnel, name="api_funnel"),
+    path("api/cohorts/", views.api_cohorts, name="api_cohorts"),
+    path("api/attribution/", views.api_attribution, name="api_attribution"),
     path("event/", views.event_collect, name="event_collect"),
+    path("api/live/", views.api_live, name="api_live"),
+    path("api/live/heartbeat/", views.live_heartbeat, name="live_heartbeat"),
+    path("api/stream/", views.live_stream, name="live_stream"),
+    path("api/bots/", views.api_bots, name="api_bots"),
+    path("api/perf/", views.api_perf, name="api_perf"),
+    path("metrics/", views.metrics, name="metrics"),
 ]
\ No newline at end of file
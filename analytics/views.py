@@ -1,21 +1,39 @@
+import asyncio
+import hashlib
 import json
 from datetime import timedelta
-from django.db.models import Count
-from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
+from asgiref.sync import sync_to_async
+from django.db.models import Sum
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
 from django.shortcuts import render
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from .models import Visit, Event
+from django.core.cache import cache
+from django.contrib.auth.decorators import login_required, user_passes_test
+from . import attribution, bots, counters, dimensions, identity, instrumentation, presence, ratelimit, sessions, shedding, spool
+from .instrumentation import JsonResponse
+from .realtime import hub, streaming_supported
+from .summary import PANELS, build_summary, ua_panels
+from .models import Visit, ListeningProfile, PathDim
 
 def dashboard(request):
-    return render(request, "analytics/dashboard.html")
+    return render(request, "analytics/dashboard.html", {"live_stream": streaming_supported(request)})
 
 def _base_qs():
     return Visit.objects.filter(is_bot=False)
 
+MAX_LIMIT = 100  # rows any top-N endpoint returns at most
+
+def _int_param(request, name, default, hi):
+    try:
+        return max(1, min(int(request.GET.get(name, default)), hi))
+    except ValueError:
+        return default
+
 def api_timeseries(request):
-    days = int(request.GET.get("days", 30))
+    days = _int_param(request, "days", 30, 366)
     end = timezone.now().date()
     start = end - timedelta(days=days - 1)
 
@@ -23,20 +41,13 @@ def api_timeseries(request):
 
     pv = (
         qs.values("ts__date")
-        .annotate(count=Count("id"))
-        .order_by("ts__date")
-    )
-
-    uv = (
-        qs.values("ts__date", "visitor_id").distinct()
-        .values("ts__date")
-        .annotate(count=Count("visitor_id"))
+        .annotate(count=Sum("weight"))
         .order_by("ts__date")
     )
 
     dates = [start + timedelta(days=i) for i in range(days)]
     pv_map = {row["ts__date"]: row["count"] for row in pv}
-    uv_map = {row["ts__date"]: row["count"] for row in uv}
+    uv_map = {day: n for (day,), n in shedding.weighted_distinct(qs, ("ts__date",)).items()}
 
     data = {
         "labels": [d.strftime("%Y-%m-%d") for d in dates],
@@ -45,96 +56,93 @@ def api_timeseries(request):
     }
     return JsonResponse(data)
 
+def api_summary(request):
+    """
+    Every dashboard panel in one response, cached per (days, limit, panels).
+    ?panels=timeseries,devices,... selects a subset; default is all of them.
+    """
+    days = _int_param(request, "days", 30, 366)
+    limit = _int_param(request, "limit", 0, MAX_LIMIT) if request.GET.get("limit") else None
+    requested = [p for p in (request.GET.get("panels") or "").split(",") if p in PANELS] or list(PANELS)
+    limits = {k: limit for k in ("top_pages", "top_referrers", "countries", "cities", "top_sermons")} if limit else None
+
+    key = f"analytics:summary:{days}:{limit or ''}:{','.join(sorted(requested))}"
+    data = cache.get(key)
+    if data is None:
+        data = build_summary(days, requested, limits)
+        cache.set(key, data, getattr(settings, "ANALYTICS_SUMMARY_TTL", 60))
+    return JsonResponse(data)
+
 def api_top_pages(request):
-    limit = int(request.GET.get("limit", 10))
+    limit = _int_param(request, "limit", 10, MAX_LIMIT)
     rows = (
         _base_qs()
         .values("path")
-        .annotate(count=Count("id"))
+        .annotate(count=Sum("weight"))
         .order_by("-count")[:limit]
     )
-    return JsonResponse({"rows": list(rows)})
+    return JsonResponse({"rows": dimensions.resolve(rows, "path", PathDim)})
 
 def api_top_referrers(request):
-    limit = int(request.GET.get("limit", 10))
-    rows = (
-        _base_qs()
-        .exclude(referer="")
-        .values("referer")
-        .annotate(count=Count("id"))
-        .order_by("-count")[:limit]
-    )
-    return JsonResponse({"rows": list(rows)})
+    """Top external referring hosts over the last ?days= (default 30)."""
+    limit = _int_param(request, "limit", 10, MAX_LIMIT)
+    end = timezone.localdate()
+    start = end - timedelta(days=_int_param(request, "days", 30, 366) - 1)
+    rows = attribution.top_sources(start, end, "host", limit)
+    return JsonResponse({"rows": [{"referer": r["host"], "kind": r["kind"], "count": r["count"]} for r in rows]})
 
-def api_devices(request):
-    qs = _base_qs()
-    total = qs.count() or 1
 
-    def bucket(q):
-        return (
-            q.filter(ua__iregex=r"mobile|iphone|android").count(),
-            q.filter(ua__iregex=r"ipad|tablet").count(),
-            q.filter(ua__iregex=r"windows|macintosh|linux").count(),
-        )
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def api_attribution(request):
+    """Visits by ?by=kind (default) | host | campaign over the last ?days= (default 30)."""
+    days = _int_param(request, "days", 30, 366)
+    by = request.GET.get("by", "kind")
+    limit = _int_param(request, "limit", 20, 200)
+    key = f"analytics:attribution:{days}:{by}:{limit}"
+    data = cache.get(key)
+    if data is None:
+        end = timezone.localdate()
+        try:
+            rows = attribution.top_sources(end - timedelta(days=days - 1), end, by, limit, exclude=())
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        data = {"days": days, "by": by, "rows": rows}
+        cache.set(key, data, getattr(settings, "ANALYTICS_SUMMARY_TTL", 60))
+    return JsonResponse(data)
 
-    mobile, tablet, desktop = bucket(qs)
-    return JsonResponse({
-        "labels": ["Mobile", "Tablet", "Desktop"],
-        "values": [mobile, tablet, desktop],
-        "total": total,
-    })
+def api_devices(request):
+    return JsonResponse(ua_panels(_base_qs())["devices"])
 
 def api_os(request):
-    """OS share by naive UA regex."""
-    qs = _base_qs()
-    def c(rx): return qs.filter(ua__iregex=rx).count()
-    android = c(r"android")
-    ios = c(r"iphone|ipad|ipod|ios")
-    windows = c(r"windows nt")
-    macos = c(r"macintosh|mac os x")
-    linux = c(r"linux(?!.*android)")
-    other = max(qs.count() - (android+ios+windows+macos+linux), 0)
-    return JsonResponse({
-        "labels": ["Android", "iOS", "Windows", "macOS", "Linux", "Other"],
-        "values": [android, ios, windows, macos, linux, other],
-    })
+    """OS share by naive UA regex (classified per distinct UA, see analytics.summary)."""
+    return JsonResponse(ua_panels(_base_qs())["os"])
 
 def api_browsers(request):
-    """Browser share by naive UA regex."""
-    qs = _base_qs()
-    def c(rx): return qs.filter(ua__iregex=rx).count()
-    chrome = c(r"chrome|crios|chromium") - c(r"edg/")  # avoid double-counting Edge
-    safari = c(r"safari") - c(r"chrome|chromium|crios") # pure Safari
-    edge = c(r"edg/")
-    firefox = c(r"firefox")
-    opera = c(r"opera|opr/")
-    other = max(qs.count() - (chrome+safari+edge+firefox+opera), 0)
-    return JsonResponse({
-        "labels": ["Chrome", "Safari", "Edge", "Firefox", "Opera", "Other"],
-        "values": [chrome, safari, edge, firefox, opera, other],
-    })
+    """Browser share by naive UA regex (classified per distinct UA, see analytics.summary)."""
+    return JsonResponse(ua_panels(_base_qs())["browsers"])
 
 def api_geo_countries(request):
     """Top countries (needs ANALYTICS_GEOIP=True + DB present)."""
-    limit = int(request.GET.get("limit", 12))
+    limit = _int_param(request, "limit", 12, MAX_LIMIT)
     rows = (_base_qs()
             .exclude(country="")
             .values("country", "country_name")
-            .annotate(count=Count("id"))
+            .annotate(count=Sum("weight"))
             .order_by("-count")[:limit])
     return JsonResponse({"rows": list(rows)})
 
 def api_geo_cities(request):
     """Top cities within the last N days (optional)."""
-    limit = int(request.GET.get("limit", 12))
-    days = int(request.GET.get("days", 30))
+    limit = _int_param(request, "limit", 12, MAX_LIMIT)
+    days = _int_param(request, "days", 30, 366)
     end = timezone.now()
     start = end - timedelta(days=days)
     rows = (_base_qs()
             .filter(ts__range=(start, end))
             .exclude(city="")
             .values("country", "city")
-            .annotate(count=Count("id"))
+            .annotate(count=Sum("weight"))
             .order_by("-count")[:limit])
     return JsonResponse({"rows": list(rows)})
 
@@ -160,6 +168,7 @@ def _geo_lookup(ip: str):
         return ("", "", "")
 
 @csrf_exempt
+@ratelimit.limit("event")
 def event_collect(request):
     if request.method != "POST":
         return HttpResponseBadRequest("POST only")
@@ -167,40 +176,177 @@ def event_collect(request):
         payload = json.loads(request.body or "{}")
     except Exception:
         payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
 
-    evt = (payload.get("event") or "").strip().lower()
+    evt = str(payload.get("event") or "").strip().lower()
     if not evt:
         return HttpResponseBadRequest("Missing event")
+    if len(evt) > 32:
+        return HttpResponseBadRequest("Event name too long")
 
-    slug  = (payload.get("slug") or "")[:160]
-    title = (payload.get("title") or "")[:256]
+    slug  = str(payload.get("slug") or "")[:160]
+    title = str(payload.get("title") or "")[:256]
 
     ua = request.META.get("HTTP_USER_AGENT", "")[:500]
-    ip = (request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")[0].strip()
-          or request.META.get("REMOTE_ADDR"))
+    ip = identity.client_ip(request) or None
     store_ip = getattr(settings, "ANALYTICS_STORE_IP", False)
     ip_to_save = ip if store_ip else None
-    ip_hash = (ip and __import__("hashlib").sha256(ip.encode()).hexdigest()[:32]) or ""
-
-    country, country_name, city = _geo_lookup(ip)
+    ip_hash = identity.ip_hash(ip or "")
 
-    visitor_id = request.COOKIES.get("v_id", "")
+    visitor_id = identity.existing_visitor_id(request)
     session_key = getattr(getattr(request, "session", None), "session_key", "") or ""
 
-    Event.objects.create(
-        event=evt, slug=slug, title=title, path=request.META.get("PATH_INFO", ""),
-        ua=ua, ip=ip_to_save, ip_hash=ip_hash,
-        session_key=session_key, visitor_id=visitor_id,
-        user=(getattr(request, "user", None) and request.user.is_authenticated) and request.user or None,
-        country=country, country_name=country_name, city=city,
-    )
+    weight = shedding.controller.admit(visitor_id)  # 0: shed under database pressure (see analytics.shedding)
+    if weight:
+        country, country_name, city = _geo_lookup(ip)
+        spool.submit("event", {
+            "event": evt, "slug": slug, "title": title, "path": request.META.get("PATH_INFO", ""),
+            "ua": ua, "ip": ip_to_save, "ip_hash": ip_hash,
+            "session_key": session_key, "visitor_id": visitor_id,
+            "user_id": request.user.pk if getattr(request, "user", None) and request.user.is_authenticated else None,
+            "country": country, "country_name": country_name, "city": city, "weight": weight,
+        })
+    hub.record_event(evt, slug, title)
+    counters.record_event(evt, slug)
     return HttpResponse(status=204)
 
 def api_top_sermons(request):
-    """Most played sermons by event='play'."""
-    limit = int(request.GET.get("limit", 5))
-    rows = (Event.objects.filter(event="play")
-            .values("slug", "title")
-            .annotate(count=Count("id"))
-            .order_by("-count")[:limit])
-    return JsonResponse({"rows": list(rows)})
+    """Most played sermons from SermonStats; ?by=trending|completions|listen_s for other rankings."""
+    limit = _int_param(request, "limit", 5, MAX_LIMIT)
+    try:
+        rows = counters.top(request.GET.get("by", "plays"), limit)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return JsonResponse({"rows": rows})
+
+
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def api_listening(request, slug):
+    """Retention curve and listening totals for one sermon (computed by `manage.py compute_listening`)."""
+    p = ListeningProfile.objects.select_related("sermon").filter(sermon__slug=slug).first()
+    if p is None:
+        return JsonResponse({"error": "no listening data for this sermon yet"}, status=404)
+    return JsonResponse({
+        "slug": p.sermon.slug,
+        "title": p.sermon.title,
+        "duration_s": p.duration_s,
+        "sessions": p.sessions,
+        "listeners": p.listeners,
+        "minutes": round(p.listen_s / 60, 1),
+        "completion_rate": p.completion_rate,
+        "computed_at": p.computed_at,
+        "labels": list(range(101)),
+        "retention": p.retention_curve(),
+    })
+
+
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def api_sessions(request):
+    """Bounce rate, returning rate, pages per session and average minutes over ?days= (default 30)."""
+    return JsonResponse(sessions.overview(_int_param(request, "days", 30, 366)))
+
+
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def api_funnel(request):
+    """Sessions reaching listing -> sermon detail -> play over ?days= (default 30)."""
+    return JsonResponse(sessions.funnel(_int_param(request, "days", 30, 366)))
+
+
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def api_cohorts(request):
+    """Weekly returning-visitor cohorts for the last ?weeks= (default 8) weeks."""
+    return JsonResponse(sessions.cohorts(_int_param(request, "weeks", 8, 52)))
+
+
+@csrf_exempt
+def live_heartbeat(request):
+    """Beacon from the live page; counted in the cache, never written per request."""
+    if request.method != "POST":
+        return HttpResponseBadRequest("POST only")
+    visitor_id = identity.existing_visitor_id(request)
+    if not visitor_id:
+        ip = identity.client_ip(request)
+        ua = request.META.get("HTTP_USER_AGENT", "")
+        visitor_id = hashlib.sha256(f"{ip}|{ua}".encode()).hexdigest()[:32]
+    presence.heartbeat(visitor_id)
+    return HttpResponse(status=204)
+
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def api_live(request):
+    """Current / peak concurrent live listeners plus recent snapshots."""
+    history = _int_param(request, "history", 60, 1440)
+    return JsonResponse(presence.summary(history))
+
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def api_bots(request):
+    """Bot visits skipped by ANALYTICS_BOT_MODE over the last ?days= days, by reason."""
+    days = _int_param(request, "days", 7, 8)
+    today = timezone.localdate()
+    rows = [bots.counters(today - timedelta(days=i)) for i in range(days)]
+    return JsonResponse({"mode": bots.MODE, "rows": rows})
+
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def api_perf(request):
+    """Per-endpoint latency/query stats and recent slow-request SQL traces (this worker only)."""
+    data = instrumentation.summary()
+    if request.GET.get("sql") != "1":
+        for t in data["slow"]:
+            t["sql"] = len(t["sql"])
+    return JsonResponse(data)
+
+def metrics(request):
+    """Prometheus text exposition; staff session or `Authorization: Bearer <ANALYTICS_METRICS_TOKEN>`."""
+    token = getattr(settings, "ANALYTICS_METRICS_TOKEN", "")
+    user = getattr(request, "user", None)
+    if not (user and user.is_authenticated and user.is_staff):
+        if not token or not constant_time_compare(request.META.get("HTTP_AUTHORIZATION", ""), f"Bearer {token}"):
+            return HttpResponseForbidden()
+    return HttpResponse(instrumentation.prometheus_text(), content_type="text/plain; version=0.0.4")
+
+SSE_TICK_S = 2
+SSE_KEEPALIVE_S = 15
+
+async def live_stream(request):
+    """
+    Server-sent events for the staff dashboards (serve under ASGI).
+    Every tick sends the plays/visits/top-sermon delta since the last message
+    plus the current live listener count; idle ticks only send a keep-alive.
+    Under WSGI the stream would pin a worker, so it answers 204, which tells
+    EventSource not to reconnect; the dashboards then poll api_live.
+    """
+    user = await request.auser()
+    if not (user.is_authenticated and user.is_staff):
+        return HttpResponseForbidden()
+    if not streaming_supported(request):
+        return HttpResponse(status=204)
+
+    async def events():
+        cursor = hub.cursor()
+        last_listeners, idle = None, 0.0
+        yield "retry: 5000\n\n"
+        while True:
+            await asyncio.sleep(SSE_TICK_S)
+            delta, cursor = hub.delta_since(cursor)
+            listeners = await sync_to_async(presence.current_listeners)()
+            if delta["visits"] or delta["plays"] or delta["reset"] or listeners != last_listeners:
+                delta["listeners"] = last_listeners = listeners
+                yield f"event: delta\ndata: {json.dumps(delta)}\n\n"
+                idle = 0.0
+            else:
+                idle += SSE_TICK_S
+                if idle >= SSE_KEEPALIVE_S:
+                    yield ": keep-alive\n\n"
+                    idle = 0.0
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # don't let nginx buffer the stream
+    return response
@@ -0,0 +1,82 @@
+"""Staff analytics APIs over the generated Visit/Event tables."""
+import pytest
+from django.core.cache import cache
+from django.test import Client
+
+# whole-request query budgets (session + user + Visit insert included)
+BUDGETS = {
+    "summary": 28,
+    "api": 20,
+    "live": 12,
+    "event": 14,
+    "dashboard": 20,
+    "admin": 20,
+}
+
+
+@pytest.fixture
+def staff_get(client_get, staff_user):
+    client = Client(HTTP_USER_AGENT="Mozilla/5.0 (benchmarks) Chrome/126.0", REMOTE_ADDR="10.9.9.8")
+    client.force_login(staff_user)
+
+    def get(path, budget=None, **kw):
+        return client_get(path, budget, client=client, **kw)
+
+    return get
+
+
+@pytest.mark.parametrize("days", [7, 30, 90])
+def bench_api_summary_cold(benchmark, staff_get, days):
+    """Full dashboard payload with the cache cleared before every call."""
+    def call():
+        cache.clear()
+        return staff_get(f"/analytics/api/summary/?days={days}", BUDGETS["summary"])
+
+    _, queries = call()
+    benchmark.extra_info["queries"] = queries
+    benchmark(call)
+
+
+def bench_api_summary_cached(benchmark, staff_get):
+    _, queries = staff_get("/analytics/api/summary/", BUDGETS["summary"])
+    benchmark.extra_info["queries"] = queries
+    benchmark(staff_get, "/analytics/api/summary/", BUDGETS["summary"])
+
+
+@pytest.mark.parametrize("endpoint", [
+    "timeseries/?days=30", "top-pages/", "top-referrers/", "devices/", "os/", "browsers/",
+    "geo/countries/", "geo/cities/", "top-sermons/",
+])
+def bench_analytics_api(benchmark, staff_get, endpoint):
+    path = f"/analytics/api/{endpoint}"
+    _, queries = staff_get(path, BUDGETS["api"])
+    benchmark.extra_info["queries"] = queries
+    benchmark(staff_get, path, BUDGETS["api"])
+
+
+def bench_api_live(benchmark, staff_get):
+    _, queries = staff_get("/analytics/api/live/", BUDGETS["live"])
+    benchmark.extra_info["queries"] = queries
+    benchmark(staff_get, "/analytics/api/live/", BUDGETS["live"])
+
+
+def bench_event_collect(benchmark, client_get):
+    body = '{"event": "play", "slug": "bench", "title": "Bench"}'
+    kw = {"method": "post", "data": body, "content_type": "application/json"}
+    _, queries = client_get("/analytics/event/", BUDGETS["event"], **kw)
+    benchmark.extra_info["queries"] = queries
+    benchmark(client_get, "/analytics/event/", BUDGETS["event"], **kw)
+
+
+def bench_staff_dashboard(benchmark, staff_get):
+    _, queries = staff_get("/dashboard/", BUDGETS["dashboard"])
+    benchmark.extra_info["queries"] = queries
+    benchmark(staff_get, "/dashboard/", BUDGETS["dashboard"])
+
+
+@pytest.mark.parametrize("model", ["stream/sermon", "stream/playevent", "analytics/visit", "analytics/event"])
+def bench_admin_changelist(benchmark, staff_get, model):
+    path = f"/admin/{model}/"
+    _, queries = staff_get(path, BUDGETS["admin"])
+    benchmark.extra_info["queries"] = queries
+    benchmark(staff_get, path, BUDGETS["admin"])
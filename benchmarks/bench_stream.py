@@ -0,0 +1,53 @@
+"""Public sermon endpoints, through the full middleware stack."""
+import pytest
+
+# whole-request query budgets (session + user + Visit insert included)
+BUDGETS = {
+    "list": 15,
+    "sermons_json": 12,
+    "sidebar": 13,
+    "search": 14,
+    "detail": 12,
+    "progress": 15,
+}
+
+
+@pytest.mark.parametrize("query", ["", "?q=faith", "?tag=prayer", "?year=2020", "?page=5"])
+def bench_sermon_list_view(benchmark, client_get, query):
+    _, queries = client_get(f"/{query}", BUDGETS["list"])
+    benchmark.extra_info["queries"] = queries
+    benchmark(client_get, f"/{query}", BUDGETS["list"])
+
+
+@pytest.mark.parametrize("query", ["", "?q=sunday+service", "?tag=gospel&page=3", "?speaker=pastor"])
+def bench_sermons_list_json(benchmark, client_get, query):
+    _, queries = client_get(f"/api/sermons/{query}", BUDGETS["sermons_json"])
+    benchmark.extra_info["queries"] = queries
+    benchmark(client_get, f"/api/sermons/{query}", BUDGETS["sermons_json"])
+
+
+def bench_sidebar_summary_json(benchmark, client_get):
+    _, queries = client_get("/api/sidebar/summary/", BUDGETS["sidebar"])
+    benchmark.extra_info["queries"] = queries
+    benchmark(client_get, "/api/sidebar/summary/", BUDGETS["sidebar"])
+
+
+@pytest.mark.parametrize("q", ["grace", "corinthians", "zzzz-no-match"])
+def bench_search_json(benchmark, client_get, q):
+    _, queries = client_get(f"/api/search.json?q={q}", BUDGETS["search"])
+    benchmark.extra_info["queries"] = queries
+    benchmark(client_get, f"/api/search.json?q={q}", BUDGETS["search"])
+
+
+def bench_sermon_detail(benchmark, client_get, dataset):
+    path = f"/{dataset['slug']}/"
+    _, queries = client_get(path, BUDGETS["detail"])
+    benchmark.extra_info["queries"] = queries
+    benchmark(client_get, path, BUDGETS["detail"])
+
+
+def bench_progress_ping(benchmark, client_get, dataset):
+    data = {"slug": dataset["slug"], "progress_s": "120"}
+    _, queries = client_get("/api/progress/", BUDGETS["progress"], method="post", data=data)
+    benchmark.extra_info["queries"] = queries
+    benchmark(client_get, "/api/progress/", BUDGETS["progress"], method="post", data=data)
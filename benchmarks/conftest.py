@@ -0,0 +1,127 @@
+"""
+Fixtures for the microbenchmarks.
+
+    python -m pytest benchmarks                       # 1k sermons / 100k visits on SQLite
+    BENCH_SERMONS=100000 BENCH_VISITS=1000000 python -m pytest benchmarks
+    BENCH_DB=mysql MYSQL_NAME=stream_bench python -m pytest benchmarks
+
+The dataset is generated once into the benchmark database and reused
+across runs. With pytest-benchmark installed its `benchmark` fixture is
+used; otherwise a small timer with the same call signature stands in.
+Every benchmark also records the number of SQL queries per call and runs
+under the query budget it passes to `client_get` (benchmarks.settings sets
+QUERY_BUDGET_MODE="raise"). Budgets count the whole request, middleware
+included (session, user, Visit insert).
+"""
+import importlib.util
+import os
+import statistics
+import time
+from contextlib import ExitStack
+
+import pytest
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from analytics.querybudget import query_budget  # noqa: E402
+
+SERMONS = int(os.environ.get("BENCH_SERMONS", 1000))
+VISITS = int(os.environ.get("BENCH_VISITS", 100_000))
+HAVE_PYTEST_BENCHMARK = importlib.util.find_spec("pytest_benchmark") is not None
+
+
+@pytest.fixture(scope="session")
+def dataset():
+    from analytics.models import Visit
+    from benchmarks import datagen
+    from stream.models import Sermon
+
+    datagen.ensure_schema()
+    if Sermon.objects.count() < SERMONS or Visit.objects.count() < VISITS:
+        datagen.generate(SERMONS, VISITS, log=lambda msg: None)
+    return {"sermons": Sermon.objects.count(), "visits": Visit.objects.count(),
+            "slug": Sermon.objects.order_by("-date").values_list("slug", flat=True).first()}
+
+
+@pytest.fixture(scope="session")
+def staff_user(dataset):
+    from accounts.models import User
+
+    user = User.objects.filter(email="bench@example.com").first()
+    if user is None:
+        user = User.objects.create_superuser(email="bench@example.com", password="bench")
+    return user
+
+
+@pytest.fixture
+def client_get(dataset):
+    """
+    Returns get(path, budget=None, client=None) -> (response, query_count) that
+    asserts a status below 400 and, with a budget, runs the request under
+    analytics.querybudget.query_budget: more queries than the budget, or one
+    SQL shape repeated QUERY_BUDGET_REPEAT times (an N+1), fails the benchmark.
+    """
+    default = Client(HTTP_USER_AGENT="Mozilla/5.0 (benchmarks) Chrome/126.0", REMOTE_ADDR="10.9.9.9")
+
+    def get(path, budget=None, client=None, method="get", **extra):
+        with ExitStack() as stack:
+            if budget is not None:
+                stack.enter_context(query_budget(budget, name=f"{method.upper()} {path}"))
+            ctx = stack.enter_context(CaptureQueriesContext(connection))
+            response = getattr(client or default, method)(path, **extra)
+        assert response.status_code < 400, f"{path} -> {response.status_code}"
+        return response, len(ctx)
+
+    return get
+
+
+if not HAVE_PYTEST_BENCHMARK:
+    class _Timer:
+        """Minimal stand-in for pytest-benchmark's fixture: benchmark(fn, *args) / .extra_info."""
+
+        def __init__(self, name, rounds=20, warmup=2):
+            self.name, self.rounds, self.warmup = name, rounds, warmup
+            self.extra_info = {}
+            self.stats = None
+
+        def __call__(self, fn, *args, **kwargs):
+            for _ in range(self.warmup):
+                fn(*args, **kwargs)
+            times, result = [], None
+            for _ in range(self.rounds):
+                t0 = time.perf_counter()
+                result = fn(*args, **kwargs)
+                times.append((time.perf_counter() - t0) * 1000)
+            times.sort()
+            self.stats = {
+                "min": times[0], "median": statistics.median(times), "mean": statistics.fmean(times),
+                "p95": times[min(len(times) - 1, int(0.95 * len(times)))], "max": times[-1],
+            }
+            return result
+
+    _results = []
+
+    @pytest.fixture
+    def benchmark(request):
+        timer = _Timer(request.node.name, rounds=int(os.environ.get("BENCH_ROUNDS", 20)))
+        yield timer
+        if timer.stats:
+            _results.append((timer.name, timer.stats, timer.extra_info))
+
+    def pytest_terminal_summary(terminalreporter):
+        if not _results:
+            return
+        tr = terminalreporter
+        tr.section("benchmarks (ms)")
+        tr.write_line(f"{'name':48} {'min':>8} {'median':>8} {'mean':>8} {'p95':>8} {'max':>8}  queries")
+        for name, s, extra in _results:
+            tr.write_line(f"{name:48} {s['min']:8.2f} {s['median']:8.2f} {s['mean']:8.2f} {s['p95']:8.2f} "
+                          f"{s['max']:8.2f}  {extra.get('queries', '')}")
@@ -0,0 +1,195 @@
+"""
+Synthetic data for benchmarks, seeded from the sermon fixtures in db.json.
+
+    DJANGO_SETTINGS_MODULE=benchmarks.settings python -m benchmarks.datagen --sermons 10000 --visits 1000000
+
+Titles, speakers, descriptions and tag vocabulary come from db.json; dates,
+tag mixes and traffic are drawn from a seeded RNG so runs are reproducible.
+Visits/events follow a Zipf-like popularity curve over sermon pages, with a
+realistic spread of user agents, referrers and UTM campaigns. Generation is
+additive: existing rows are counted and only the missing ones are inserted.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+FIXTURE = Path(__file__).resolve().parent.parent / "db.json"
+BATCH = 5000
+
+FALLBACK_SEED = {
+    "titles": ["Sunday Service", "Midweek Bible Study", "Prayer Meeting"],
+    "speakers": ["Guest Minister"],
+    "descriptions": ["A teaching from the scriptures."],
+    "tags": ["faith", "prayer", "gospel", "bible teaching", "sunday service"],
+}
+USER_AGENTS = [
+    ("Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1", 30),
+    ("Mozilla/5.0 (Linux; Android 14; SM-A546E) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Mobile Safari/537.36", 35),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36", 15),
+    ("Mozilla/5.0 (Macintosh; Intel Mac OS X 14_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15", 6),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36 Edg/126.0.0.0", 4),
+    ("Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0", 2),
+    ("Mozilla/5.0 (iPad; CPU OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1", 3),
+    ("Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)", 3),
+    ("facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)", 2),
+]
+REFERERS = [("", 55), ("https://www.google.com/", 20), ("https://l.facebook.com/", 10), ("https://web.whatsapp.com/", 8),
+            ("https://t.co/", 3), ("https://www.youtube.com/", 4)]
+UTMS = [({}, 85), ({"utm_source": "whatsapp", "utm_medium": "social", "utm_campaign": "sunday"}, 8),
+        ({"utm_source": "facebook", "utm_medium": "cpc", "utm_campaign": "conference"}, 5),
+        ({"utm_source": "newsletter", "utm_medium": "email"}, 2)]
+COUNTRIES = [("NG", "Nigeria", "Lagos", 60), ("NG", "Nigeria", "Abuja", 15), ("GB", "United Kingdom", "London", 10),
+             ("US", "United States", "Houston", 8), ("", "", "", 7)]
+
+
+def load_seed(path=FIXTURE) -> dict:
+    """Sermon vocabulary from the fixture; tolerant of a truncated or cp1252-encoded dump."""
+    from stream.importer import _iter_json_array
+
+    try:
+        raw = Path(path).read_bytes()
+    except OSError:
+        return FALLBACK_SEED
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        text = raw.decode("cp1252", errors="replace")
+    seed = {"titles": [], "speakers": set(), "descriptions": [], "tags": set()}
+    try:
+        for obj in _iter_json_array(io.StringIO(text)):
+            if obj.get("model") != "stream.sermon":
+                continue
+            f = obj.get("fields", {})
+            seed["titles"].append(f.get("title", ""))
+            seed["speakers"].add(f.get("speaker", ""))
+            seed["descriptions"].append(f.get("description", ""))
+            seed["tags"].update(t.strip().lower() for t in (f.get("tags") or "").split(",") if t.strip())
+    except ValueError:
+        pass  # truncated dump: keep what parsed
+    if not seed["titles"]:
+        return FALLBACK_SEED
+    return {k: sorted(v) if isinstance(v, set) else v for k, v in seed.items()}
+
+
+def generate_sermons(n: int, rng: random.Random, seed: dict, log=print) -> int:
+    from django.utils.text import slugify
+    from stream.models import Sermon
+
+    have = Sermon.objects.count()
+    start = date(2015, 1, 4)
+    batch, made = [], 0
+    for i in range(have, n):
+        title = f"{rng.choice(seed['titles'])} {i + 1}"[:200]
+        tags = rng.sample(seed["tags"], k=min(len(seed["tags"]), rng.randint(2, 6)))
+        batch.append(Sermon(
+            title=title, slug=f"{slugify(title)[:200]}-{i + 1}", speaker=rng.choice(seed["speakers"]),
+            date=start + timedelta(days=(i * 3650) // max(n, 1)), description=rng.choice(seed["descriptions"]),
+            tags=", ".join(tags)[:200], audio=f"audio/bench/{i + 1}.mp3", duration_s=rng.randint(900, 7200),
+        ))
+        if len(batch) >= BATCH:
+            Sermon.objects.bulk_create(batch)
+            made += len(batch)
+            batch = []
+            log(f"  sermons {have + made}/{n}")
+    if batch:
+        Sermon.objects.bulk_create(batch)
+        made += len(batch)
+    return made
+
+
+def generate_traffic(visits: int, events: int, rng: random.Random, days: int = 90, log=print) -> tuple[int, int]:
+    from analytics import dimensions
+    from analytics.bots import ua_is_bot
+    from analytics.models import Event, Visit
+    from stream.models import Sermon
+
+    slugs = list(Sermon.objects.order_by("-date").values_list("slug", "title")[:5000])
+    if not slugs:
+        raise SystemExit("generate sermons first")
+    pages = ["/", "/api/sermons/", "/api/sidebar/summary/"] + [f"/{s}/" for s, _ in slugs]
+    # Zipf-ish popularity: page i gets weight 1/(i+1)
+    page_ids = [dimensions.path_id(p) for p in pages]
+    page_w = [1.0 / (i + 1) for i in range(len(pages))]
+    uas = [(dimensions.ua_id(ua), ua_is_bot(ua)) for ua, _ in USER_AGENTS]
+    ua_w = [w for _, w in USER_AGENTS]
+    refs = [dimensions.referer_id(r) for r, _ in REFERERS]
+    ref_w = [w for _, w in REFERERS]
+    utms = [dimensions.utm_id(u) for u, _ in UTMS]
+    utm_w = [w for _, w in UTMS]
+    geo = [c[:3] for c in COUNTRIES]
+    geo_w = [c[3] for c in COUNTRIES]
+    visitors = [f"{rng.getrandbits(128):032x}" for _ in range(max(1000, visits // 20))]
+    now = datetime.now(dt_timezone.utc)
+    span = days * 86400
+
+    have_v = Visit.objects.count()
+    t0, done = time.perf_counter(), have_v
+    while done < visits:
+        k = min(BATCH, visits - done)
+        rows = zip(rng.choices(page_ids, page_w, k=k), rng.choices(uas, ua_w, k=k), rng.choices(refs, ref_w, k=k),
+                   rng.choices(utms, utm_w, k=k), rng.choices(geo, geo_w, k=k), rng.choices(visitors, k=k))
+        Visit.objects.bulk_create([
+            Visit(ts=now - timedelta(seconds=rng.randrange(span)), session_key="", visitor_id=visitor,
+                  path_id=path_id, method="GET", status_code=200, response_ms=int(rng.lognormvariate(3.5, 0.6)),
+                  referer_id=ref_id, ua_id=ua_id, ip_hash=f"{rng.getrandbits(64):016x}", utm_id=utm_id,
+                  is_bot=is_bot, country=country, country_name=country_name, city=city)
+            for path_id, (ua_id, is_bot), ref_id, utm_id, (country, country_name, city), visitor in rows
+        ])
+        done += k
+        if done % (BATCH * 20) == 0:
+            log(f"  visits {done}/{visits} ({(done - have_v) / (time.perf_counter() - t0):.0f}/s)")
+
+    have_e = Event.objects.count()
+    slug_w = [1.0 / (i + 1) for i in range(len(slugs))]
+    done = have_e
+    while done < events:
+        k = min(BATCH, events - done)
+        rows = zip(rng.choices(slugs, slug_w, k=k), rng.choices(["play", "pause", "complete"], [70, 20, 10], k=k),
+                   rng.choices(visitors, k=k))
+        Event.objects.bulk_create([
+            Event(ts=now - timedelta(seconds=rng.randrange(span)), visitor_id=visitor, event=evt,
+                  slug=slug, title=title[:256], path=f"/{slug}/")
+            for (slug, title), evt, visitor in rows
+        ])
+        done += k
+    return max(visits - have_v, 0), max(events - have_e, 0)
+
+
+def ensure_schema():
+    from django.core.management import call_command
+    call_command("migrate", run_syncdb=True, verbosity=0)
+
+
+def generate(sermons: int, visits: int, events: int | None = None, seed: int = 42, log=print) -> dict:
+    ensure_schema()
+    rng = random.Random(seed)
+    events = visits // 10 if events is None else events
+    t0 = time.perf_counter()
+    s = generate_sermons(sermons, rng, load_seed(), log=log)
+    v, e = generate_traffic(visits, events, rng, log=log)
+    stats = {"sermons_added": s, "visits_added": v, "events_added": e, "elapsed_s": round(time.perf_counter() - t0, 1)}
+    log(json.dumps(stats))
+    return stats
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--sermons", type=int, default=1000)
+    p.add_argument("--visits", type=int, default=100_000)
+    p.add_argument("--events", type=int, default=None, help="default: visits / 10")
+    p.add_argument("--seed", type=int, default=42)
+    args = p.parse_args(argv)
+
+    import django
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    django.setup()
+    generate(args.sermons, args.visits, args.events, args.seed)
+
+
+if __name__ == "__main__":
+    main()
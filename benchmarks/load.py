@@ -0,0 +1,249 @@
+"""
+HTTP load scenario for the public sermon endpoints (stdlib asyncio only).
+
+    python -m benchmarks.load --base http://127.0.0.1:8000 --concurrency 50 --duration 30
+
+N workers loop over a weighted mix of page, JSON and beacon requests for
+--duration seconds over keep-alive connections and report per-endpoint
+count, error count, p50/p95/p99 latency and mean SQL queries. Query counts
+come from the Server-Timing header (analytics.instrumentation), which
+benchmarks.settings turns on for every response.
+
+`python -m benchmarks.load --matrix` runs the scenario at every size in
+MATRIX: for each it generates (or tops up) its own database with
+benchmarks.datagen, starts `manage.py runserver` on it and writes the
+combined report to benchmarks/.data/load-<timestamp>.json. On SQLite,
+generation runs at roughly 5k visits/s, so the 10M tier takes a while.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlsplit
+
+ROOT = Path(__file__).resolve().parent.parent
+DATA_DIR = Path(os.environ.get("BENCH_DATA_DIR", ROOT / "benchmarks" / ".data"))
+MATRIX = [(1_000, 1_000_000), (10_000, 1_000_000), (100_000, 1_000_000), (10_000, 10_000_000)]
+QUERIES_RX = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+SCENARIO = [  # (name, weight, method, path template)
+    ("list", 30, "GET", "/"),
+    ("list_search", 8, "GET", "/?q={word}"),
+    ("list_tag", 6, "GET", "/?tag={tag}"),
+    ("detail", 20, "GET", "/{slug}/"),
+    ("sermons_json", 12, "GET", "/api/sermons/?page={page}"),
+    ("sermons_json_q", 6, "GET", "/api/sermons/?q={word}"),
+    ("sidebar", 8, "GET", "/api/sidebar/summary/"),
+    ("search_json", 6, "GET", "/api/search.json?q={word}"),
+    ("progress", 4, "POST", "/api/progress/?slug={slug}"),
+]
+WORDS = ["faith", "grace", "prayer", "service", "gospel", "spirit", "corinthians", "love"]
+TAGS = ["faith", "prayer", "gospel", "bible teaching", "sunday service"]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+class Conn:
+    """One keep-alive HTTP/1.1 connection; reconnects on failure."""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b"", content_type="application/x-www-form-urlencoded"):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"User-Agent: Mozilla/5.0 (load test) Chrome/126.0\r\nAccept: */*\r\n"
+                f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: keep-alive\r\n\r\n")
+        self.writer.write(head.encode() + body)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        if "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, headers
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run_load(base, concurrency=20, duration=20.0, slugs=None, seed=1):
+    url = urlsplit(base)
+    host, port = url.hostname, url.port or 80
+    rng = random.Random(seed)
+    slugs = slugs or ["missing"]
+    names, weights = [s[0] for s in SCENARIO], [s[1] for s in SCENARIO]
+    spec = {s[0]: s for s in SCENARIO}
+    lat = defaultdict(list)
+    queries = defaultdict(list)
+    errors = defaultdict(int)
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        conn = Conn(host, port)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            _, _, method, tpl = spec[name]
+            path = tpl.format(word=rng.choice(WORDS), tag=rng.choice(TAGS).replace(" ", "+"),
+                              slug=rng.choice(slugs), page=rng.randint(1, 20))
+            body = b""
+            if method == "POST":  # form fields go in the body, like the player's beacon
+                path, _, query = path.partition("?")
+                body = f"{query}&progress_s={rng.randint(1, 3600)}".encode()
+            t0 = time.perf_counter()
+            try:
+                status, headers = await conn.request(method, path, body)
+            except Exception:
+                conn.close()
+                errors[name] += 1
+                continue
+            lat[name].append((time.perf_counter() - t0) * 1000)
+            if status >= 400 and not (name == "detail" and status == 404):
+                errors[name] += 1
+            m = QUERIES_RX.search(headers.get("server-timing", ""))
+            if m:
+                queries[name].append(int(m.group(1)))
+        conn.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    report = {"concurrency": concurrency, "duration_s": round(elapsed, 1), "endpoints": {}}
+    total = 0
+    for name in names:
+        values = sorted(lat[name])
+        total += len(values)
+        report["endpoints"][name] = {
+            "count": len(values), "errors": errors[name],
+            "p50_ms": round(percentile(values, 0.50), 1), "p95_ms": round(percentile(values, 0.95), 1),
+            "p99_ms": round(percentile(values, 0.99), 1),
+            "queries_mean": round(sum(queries[name]) / len(queries[name]), 1) if queries[name] else None,
+        }
+    report["rps"] = round(total / elapsed, 1) if elapsed else 0
+    return report
+
+
+def print_report(report, label=""):
+    print(f"\n{label}  {report['rps']} req/s, concurrency {report['concurrency']}, {report['duration_s']}s")
+    print(f"{'endpoint':16} {'count':>7} {'err':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8}")
+    for name, r in report["endpoints"].items():
+        print(f"{name:16} {r['count']:7} {r['errors']:5} {r['p50_ms']:8} {r['p95_ms']:8} {r['p99_ms']:8} "
+              f"{r['queries_mean'] if r['queries_mean'] is not None else '-':>8}")
+
+
+def _slugs(limit=2000):
+    from stream.models import Sermon
+    return list(Sermon.objects.order_by("?").values_list("slug", flat=True)[:limit])
+
+
+def _wait_for(base, timeout=60):
+    url = urlsplit(base)
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            with socket.create_connection((url.hostname, url.port or 80), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.5)
+    raise SystemExit(f"server at {base} did not come up")
+
+
+def _sizes(value):
+    return [tuple(int(n) for n in pair.split("x")) for pair in value.split(",")]
+
+
+def run_matrix(args):
+    results = []
+    for sermons, visits in args.sizes or MATRIX:
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE="benchmarks.settings")
+        if env.get("BENCH_DB", "sqlite") == "sqlite":
+            env["BENCH_SQLITE"] = str(DATA_DIR / f"bench-{sermons}-{visits}.sqlite3")
+        subprocess.run([sys.executable, "-m", "benchmarks.datagen", "--sermons", str(sermons),
+                        "--visits", str(visits)], cwd=ROOT, env=env, check=True)
+        port = args.port
+        cmd = [sys.executable, "manage.py", "runserver", f"127.0.0.1:{port}", "--noreload"]
+        if args.single_thread:
+            cmd.append("--nothreading")
+        server = subprocess.Popen(
+            cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            base = f"http://127.0.0.1:{port}"
+            _wait_for(base)
+            slugs = json.loads(subprocess.run(
+                [sys.executable, "-c", "import django,json;django.setup();"
+                 "from benchmarks.load import _slugs;print(json.dumps(_slugs()))"],
+                cwd=ROOT, env=env, check=True, capture_output=True, text=True).stdout)
+            report = asyncio.run(run_load(base, args.concurrency, args.duration, slugs))
+        finally:
+            server.terminate()
+            server.wait()
+        report.update(sermons=sermons, visits=visits, db=os.environ.get("BENCH_DB", "sqlite"))
+        print_report(report, f"{sermons} sermons / {visits} visits")
+        results.append(report)
+    out = DATA_DIR / f"load-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out.write_text(json.dumps(results, indent=2))
+    print(f"\nwrote {out}")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="HTTP load scenario for the sermon endpoints")
+    p.add_argument("--base", default="http://127.0.0.1:8000")
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--duration", type=float, default=20.0)
+    p.add_argument("--matrix", action="store_true", help="generate each dataset size and run against it")
+    p.add_argument("--sizes", type=_sizes, help="--matrix: override sizes, e.g. 1000x1000000,10000x10000000")
+    p.add_argument("--port", type=int, default=8765, help="runserver port for --matrix")
+    p.add_argument("--single-thread", action="store_true", help="--matrix: run the server with --nothreading")
+    p.add_argument("--json", help="also write the report here")
+    args = p.parse_args(argv)
+
+    if args.matrix:
+        return run_matrix(args)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    import django
+    django.setup()
+    report = asyncio.run(run_load(args.base, args.concurrency, args.duration, _slugs()))
+    print_report(report, args.base)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
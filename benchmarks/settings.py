@@ -0,0 +1,50 @@
+"""
+Settings for benchmarks: the project settings with local storage and a
+benchmark database.
+
+  BENCH_DB=sqlite (default)  BENCH_SQLITE=<path>, default benchmarks/.data/bench.sqlite3
+  BENCH_DB=mysql             MYSQL_NAME / MYSQL_USER / MYSQL_PASSWORD / MYSQL_HOST / MYSQL_PORT
+                             (use a throwaway schema; the generator bulk-inserts into it)
+"""
+import os
+from pathlib import Path
+
+for key, value in {
+    "SECRET_KEY": "benchmarks-not-secret",
+    "DEBUG": "False",
+    "ALLOWED_HOSTS": "*",
+    "USE_S3": "False",
+    "MYSQL_NAME": "stream_bench", "MYSQL_USER": "root", "MYSQL_PASSWORD": "",
+    "MYSQL_HOST": "127.0.0.1", "MYSQL_PORT": "3306",
+}.items():
+    os.environ.setdefault(key, value)
+
+from config.settings import *  # noqa: E402,F401,F403
+from config.settings import BASE_DIR, DATABASES  # noqa: E402
+
+DATA_DIR = Path(os.environ.get("BENCH_DATA_DIR", BASE_DIR / "benchmarks" / ".data"))
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+if os.environ.get("BENCH_DB", "sqlite") == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("BENCH_SQLITE", str(DATA_DIR / "bench.sqlite3")),
+        }
+    }
+
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+MEDIA_ROOT = DATA_DIR / "media"
+SESSION_COOKIE_SECURE = False
+CSRF_COOKIE_SECURE = False
+ANALYTICS_GEOIP = False
+ANALYTICS_SERVER_TIMING = True  # the load script reads query counts from Server-Timing
+ANALYTICS_TRACE_SAMPLE = 0.0
+ANALYTICS_SPOOL_DIR = DATA_DIR / "spool"
+ANALYTICS_SPOOL_LOADER = "command"  # no background loader competing for the SQLite file
+# every benchmark request comes from one client: keep the token-bucket check on the path, never refuse
+ANALYTICS_RATE_LIMITS = {name: {"rate": 1e6, "burst": 1e9, "over": "drop"} for name in ("event", "progress")}
+QUERY_BUDGET_MODE = "raise"  # budgets in the benchmarks fail instead of logging
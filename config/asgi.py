@@ -3,6 +3,13 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the site from here with a single worker (``uvicorn config.asgi:application
+--workers 1``) for live server-sent updates on the staff dashboards
+(analytics.views.live_stream). The live hub (analytics.realtime) lives in
+process memory, so with more workers each stream would only see the traffic
+its own worker handled. Scale out with several WSGI workers instead; under
+config.wsgi everything else works the same and the dashboards poll.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -32,8 +32,40 @@ AUTH_USER_MODEL = 'accounts.User'
 ALLOWED_HOSTS = config('ALLOWED_HOSTS', cast=Csv())
 USE_S3 = config('USE_S3', default=True, cast=bool)
 
+# One cache for sessions, auth lookups and the analytics counters. LocMem is a per-process
+# stand-in (fine for one worker / dev); with several workers point CACHE_BACKEND at Redis or
+# memcached (e.g. django.core.cache.backends.redis.RedisCache + redis://host:6379/1).
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default="stream-live"),
+    }
+}
+
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
-SESSION_SAVE_EVERY_REQUEST = True
+# sessions are written when they change; accounts.middleware.SessionRefreshMiddleware
+# re-saves an unchanged session at most every SESSION_REFRESH_S to keep its expiry sliding
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_REFRESH_S = 300
+# A per-process cache can't carry logouts, deactivations or permission changes to the other
+# workers, so session and auth caching are only on when CACHE_BACKEND is shared.
+SHARED_CACHE = CACHES["default"]["BACKEND"] not in (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+# cached_db: reads come from the cache, writes go to both. "...backends.signed_cookies" keeps
+# sessions out of the DB entirely; "...backends.cache" alone needs a shared, persistent cache
+SESSION_ENGINE = config(
+    "SESSION_ENGINE",
+    default="django.contrib.sessions.backends.cached_db" if SHARED_CACHE else "django.contrib.sessions.backends.db",
+)
+
+AUTHENTICATION_BACKENDS = ["accounts.backends.CachedModelBackend"]
+AUTH_CACHE_TTL = 300 if SHARED_CACHE else 0  # seconds a cached user / permission set lives (signals invalidate earlier); 0 = off
+MEMBER_EXPORT_DIR = BASE_DIR / "var" / "member-exports"  # dashboard member exports cached on private local disk ...
+MEMBER_EXPORT_TTL = 600                    # ... and served (with Range/resume) for this many seconds
+MEMBER_EXPORT_WORKERS = 4                  # threads rendering keyset ranges in parallel
+KPI_CACHE_TTL = 300 if SHARED_CACHE else 0  # home dashboard KPIs, per (campus, window); member writes invalidate; 0 = off
 
 CSRF_TRUSTED_ORIGINS = [
     "https://layersoftruth.org",
@@ -60,9 +92,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "analytics.instrumentation.InstrumentationMiddleware",  # first, so its timings cover the rest
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
+    "accounts.middleware.SessionRefreshMiddleware",
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -75,7 +109,7 @@ ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'analytics.instrumentation.TimedTemplates',  # DjangoTemplates + "tpl" Server-Timing phase
         'DIRS': [ "templates" ],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -151,8 +185,54 @@ MEDIA_ROOT = BASE_DIR / "media"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 ANALYTICS_STORE_IP = False 
+ANALYTICS_IDENTITY = config("ANALYTICS_IDENTITY", default="cookie")  # cookie: signed v_id only | session: force a session per visitor
+ANALYTICS_LEGACY_VID_UNTIL = config("ANALYTICS_LEGACY_VID_UNTIL", default="2027-04-30")  # unsigned v_id cookies are re-issued signed until then, ignored after
 ANALYTICS_GEOIP = True                     # enable geo lookup
 ANALYTICS_GEOIP_DB_PATH = BASE_DIR / "geo/GeoLite2-City.mmdb"
+ANALYTICS_PRESENCE_BUCKET_S = 30           # live heartbeat bucket width (cache-backed)
+ANALYTICS_PRESENCE_SNAPSHOT_S = 60         # at most one LiveSnapshot row per window
+ANALYTICS_SUMMARY_TTL = 60                 # seconds the dashboard summary payload is cached
+ANALYTICS_RETENTION_MONTHS = 13            # raw Visit/Event months kept hot (older: rollup + archive + drop)
+ANALYTICS_COUNTER_FLUSH_S = 10             # SermonStats increments are buffered per process this long
+ANALYTICS_TRENDING_HALF_LIFE_H = 48        # trending score half-life (hours)
+ANALYTICS_LISTENING_CHUNK = 200_000        # PlayEvent samples per compute_listening batch
+ANALYTICS_LISTENING_GAP_S = 1800           # a pause longer than this starts a new listening session
+ANALYTICS_SESSION_GAP_S = 1800             # visits further apart than this belong to different sessions
+ANALYTICS_SESSION_LAG_S = 300              # sessionize_visits leaves visits newer than this for the next run
+ANALYTICS_INTERNAL_HOSTS = None            # referers from these hosts count as "internal" (default: ALLOWED_HOSTS)
+ANALYTICS_INGEST = config("ANALYTICS_INGEST", default="spool")  # spool: append to local segment files, bulk-loaded | inline: INSERT per request
+ANALYTICS_SPOOL_DIR = BASE_DIR / "var" / "analytics-spool"
+ANALYTICS_SPOOL_LOADER = config("ANALYTICS_SPOOL_LOADER", default="thread")  # thread: each web process loads | command: load_analytics_spool
+ANALYTICS_SHEDDING = True                  # drop bots, then sample visitors, while analytics writes are slow
+ANALYTICS_SHED_WRITE_MS = 250              # INSERT statement latency (EWMA) at which shedding starts (inline ingest)
+ANALYTICS_SHED_APPEND_MS = 50              # spool append latency (EWMA) at which shedding starts (spool ingest)
+ANALYTICS_SHED_INFLIGHT = 8                # concurrent inline analytics writes per process at which shedding starts
+ANALYTICS_SHED_BACKLOG_MB = 64             # unloaded spool segments at which shedding starts
+ANALYTICS_SHED_MAX_WEIGHT = 64             # lowest sample rate is 1 in this many visitors
+ANALYTICS_SHED_COOLDOWN_S = 30             # pressure must stay lower this long before shedding eases
+# token buckets per ip_hash, visitor and user for the unauthenticated write endpoints (analytics.ratelimit);
+# rate = tokens/second, burst = bucket size, over = "drop" (204, discarded) | "429",
+# identified_ip_factor = ip budget multiplier for requests with a signed v_id cookie or login,
+# exempt_authenticated = don't limit logged-in users
+ANALYTICS_RATE_LIMITS = {
+    "event": {"rate": 1.0, "burst": 30, "over": "drop", "identified_ip_factor": 20},
+    "progress": {"rate": 0.5, "burst": 12, "over": "drop", "identified_ip_factor": 20, "exempt_authenticated": True},
+}
+ANALYTICS_TRUSTED_PROXIES = config("ANALYTICS_TRUSTED_PROXIES", default=1, cast=int)  # reverse proxies appending to X-Forwarded-For
+ANALYTICS_RATE_LIMIT_BACKEND = config("ANALYTICS_RATE_LIMIT_BACKEND", default="memory")  # memory: per process | cache: shared
+ANALYTICS_ARCHIVE_DIR = BASE_DIR / "var" / "analytics-archive"  # private local dir for monthly archives without USE_S3
+ANALYTICS_EXPORT_DIR = BASE_DIR / "var" / "analytics-exports"  # private local dir for background exports (never media storage)
+ANALYTICS_EXPORT_STALE_S = 900             # running exports with no progress this long are marked failed (worker restarted)
+ANALYTICS_BOT_MODE = config("ANALYTICS_BOT_MODE", default="store")  # store | sample | drop bot visits
+ANALYTICS_BOT_SAMPLE = 10                  # "sample" keeps 1 in N bot visits
+ANALYTICS_BOT_RATE_LIMIT = config("ANALYTICS_BOT_RATE_LIMIT", default=120, cast=int)  # page views per window from one ip_hash before
+ANALYTICS_BOT_WINDOW_S = config("ANALYTICS_BOT_WINDOW_S", default=60, cast=int)       # ... the rest count as bot (0 = no rate check)
+ANALYTICS_BOT_IP_RANGES = []               # extra crawler CIDRs on top of analytics.bots.DEFAULT_IP_RANGES
+ANALYTICS_INSTRUMENT = True                # per-request query/DB/phase timings (analytics.instrumentation)
+ANALYTICS_SERVER_TIMING = DEBUG            # Server-Timing header for everyone (staff always get it)
+ANALYTICS_SLOW_MS = 500                    # traced requests slower than this keep their SQL
+ANALYTICS_TRACE_SAMPLE = 0.1               # fraction of requests that record SQL text
+ANALYTICS_METRICS_TOKEN = config("ANALYTICS_METRICS_TOKEN", default="")  # bearer token for /analytics/metrics/
 
 # Static & Media Files
 
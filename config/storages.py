@@ -10,3 +10,12 @@ class StaticStorage(S3Boto3Storage):
 class MediaStorage(S3Boto3Storage):
     location = "dashboard/media"
     file_overwrite = False
+
+
+class PrivateStorage(S3Boto3Storage):
+    # visitor data (analytics archives): private objects, reachable only through signed URLs
+    location = "dashboard/private"
+    default_acl = "private"
+    querystring_auth = True
+    custom_domain = None
+    file_overwrite = False
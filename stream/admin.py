@@ -1,12 +1,48 @@
 # stream/admin.py
-from django.contrib import admin
+import os
+from tempfile import NamedTemporaryFile
+
+from django.contrib import admin, messages
+from django.shortcuts import redirect, render
+from django.urls import path
 from import_export import resources
 from import_export.admin import ImportExportModelAdmin
 
-from .models import Library, PlayEvent, Playlist, PlaylistItem, Sermon
+from analytics.querybudget import QueryBudgetAdminMixin
 
+from .forms import SermonBulkImportForm
+from .importer import SermonImporter, probe_missing_durations
+from .models import Library, PlayEvent, Playlist, PlaylistItem, Sermon
+from .slugs import unique_slugs
+
+
+class UniqueSlugResourceMixin:
+    """Fill blank slugs for a whole import in one pass (also covers use_bulk, which skips save())."""
+    slug_fallback = "item"
+
+    def before_import(self, dataset, **kwargs):
+        super().before_import(dataset, **kwargs)
+        headers = dataset.headers or []
+        if "slug" not in headers or "title" not in headers:
+            return
+        slug_i, title_i = headers.index("slug"), headers.index("title")
+        blank = [i for i, row in enumerate(dataset) if not row[slug_i]]
+        if not blank:
+            return
+        model = self._meta.model
+        # allocated slugs must step around the explicit ones in this file, which aren't in the DB yet
+        explicit = {row[slug_i] for row in dataset if row[slug_i]}
+        slugs = unique_slugs(model, [dataset[i][title_i] or "" for i in blank], fallback=self.slug_fallback,
+                             taken=explicit)
+        for i, slug in zip(blank, slugs):
+            row = list(dataset[i])
+            row[slug_i] = slug
+            dataset[i] = row
+
+
+class SermonResource(UniqueSlugResourceMixin, resources.ModelResource):
+    slug_fallback = "sermon"
 
-class SermonResource(resources.ModelResource):
     class Meta:
         model = Sermon
         fields = (
@@ -26,21 +62,76 @@ class SermonResource(resources.ModelResource):
 
 
 @admin.register(Sermon)
-class SermonAdmin(ImportExportModelAdmin):
+class SermonAdmin(QueryBudgetAdminMixin, ImportExportModelAdmin):
     resource_class = SermonResource
     list_display = ("title", "speaker", "date", "uploaded_by", "duration_readable")
+    list_select_related = ("uploaded_by",)
+    changelist_query_budget = 7
     search_fields = ("title", "speaker", "tags", "description", "uploaded_by__email")
     list_filter = ("speaker", "date", "uploaded_by")
     prepopulated_fields = {"slug": ("title",)}
     readonly_fields = ("duration_s",)
+    change_list_template = "admin/stream/sermon/change_list.html"
+    actions = ["probe_durations"]
 
     def duration_readable(self, obj):
         return obj.duration_hm()
 
     duration_readable.short_description = "Duration"
 
+    def get_urls(self):
+        urls = [
+            path("bulk-import/", self.admin_site.admin_view(self.bulk_import_view), name="stream_sermon_bulk_import"),
+        ]
+        return urls + super().get_urls()
+
+    def bulk_import_view(self, request):
+        if not self.has_add_permission(request):
+            return redirect("admin:stream_sermon_changelist")
+        form = SermonBulkImportForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            upload = form.cleaned_data["file"]
+            suffix = os.path.splitext(upload.name)[1].lower()
+            with NamedTemporaryFile(suffix=suffix) as tmp:
+                for chunk in upload.chunks():
+                    tmp.write(chunk)
+                tmp.flush()
+                try:
+                    stats = SermonImporter(
+                        chunk_size=form.cleaned_data["chunk_size"], uploaded_by=request.user,
+                    ).run(tmp.name)
+                except ValueError as e:
+                    messages.error(request, f"Import failed: {e}")
+                    return redirect("admin:stream_sermon_bulk_import")
+            for err in stats["errors"][:10]:
+                messages.warning(request, err)
+            rate = stats["read"] / stats["elapsed_s"] if stats["elapsed_s"] else 0
+            messages.success(
+                request,
+                f"Imported {stats['created']} sermons ({stats['skipped']} skipped, {stats['invalid']} invalid) "
+                f"in {stats['elapsed_s']}s ({rate:.0f} rows/s).",
+            )
+            # probing fetches every audio file; that belongs in a command, not in this request
+            if Sermon.objects.filter(duration_s=0).exists():
+                messages.info(request, "Some sermons have no duration yet; run `manage.py probe_durations` to fill them in.")
+            return redirect("admin:stream_sermon_changelist")
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "form": form,
+            "title": "Bulk import sermons",
+        }
+        return render(request, "admin/stream/sermon/bulk_import.html", context)
+
+    @admin.action(description="Probe audio durations (missing only)")
+    def probe_durations(self, request, queryset):
+        n = probe_missing_durations(queryset)
+        self.message_user(request, f"Probed {n} durations.", messages.SUCCESS)
+
+
+class PlaylistResource(UniqueSlugResourceMixin, resources.ModelResource):
+    slug_fallback = "playlist"
 
-class PlaylistResource(resources.ModelResource):
     class Meta:
         model = Playlist
         fields = ("id", "title", "slug", "owner", "is_public", "created_at")
@@ -53,9 +144,11 @@ class PlaylistItemInline(admin.TabularInline):
 
 
 @admin.register(Playlist)
-class PlaylistAdmin(ImportExportModelAdmin):
+class PlaylistAdmin(QueryBudgetAdminMixin, ImportExportModelAdmin):
     resource_class = PlaylistResource
     list_display = ("title", "owner", "is_public", "created_at")
+    list_select_related = ("owner",)
+    changelist_query_budget = 5
     search_fields = ("title",)
     inlines = [PlaylistItemInline]
 
@@ -68,9 +161,11 @@ class LibraryResource(resources.ModelResource):
 
 
 @admin.register(Library)
-class LibraryAdmin(ImportExportModelAdmin):
+class LibraryAdmin(QueryBudgetAdminMixin, ImportExportModelAdmin):
     resource_class = LibraryResource
     list_display = ("user", "sermon", "saved_at")
+    list_select_related = ("user", "sermon")
+    changelist_query_budget = 5
     search_fields = ("user__email", "sermon__title")
 
 
@@ -82,7 +177,9 @@ class PlayEventResource(resources.ModelResource):
 
 
 @admin.register(PlayEvent)
-class PlayEventAdmin(ImportExportModelAdmin):
+class PlayEventAdmin(QueryBudgetAdminMixin, ImportExportModelAdmin):
     resource_class = PlayEventResource
     list_display = ("sermon", "user", "progress_s", "started_at", "completed_at")
+    list_select_related = ("sermon", "user")
+    changelist_query_budget = 6
     list_filter = ("sermon",)
@@ -1,5 +1,8 @@
 # stream/api.py
-from django.http import JsonResponse, HttpResponseForbidden, Http404
+import logging
+import math
+
+from django.http import HttpResponseBadRequest, HttpResponseForbidden, Http404
 from django.views.decorators.http import require_GET, require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import get_object_or_404
@@ -7,6 +10,13 @@ from django.utils import timezone
 from django.utils.dateformat import format as datefmt
 from .models import Sermon, Library, PlayEvent
 from django.urls import reverse
+from analytics import counters, identity, ratelimit
+from analytics.instrumentation import JsonResponse
+
+log = logging.getLogger(__name__)
+
+# ceiling for progress on a sermon whose duration hasn't been probed yet
+MAX_PROGRESS_S = 6 * 3600
 
 def _sermon_dict(s: Sermon):
     return {
@@ -62,19 +72,30 @@ def library_toggle(request):
 
 @csrf_exempt  # allow beacon pings without CSRF
 @require_POST
+@ratelimit.limit("progress")
 def progress_ping(request):
     slug = request.POST.get("slug")
     try:
         progress_s = float(request.POST.get("progress_s", "0") or 0)
     except ValueError:
         progress_s = 0.0
+    if not math.isfinite(progress_s):
+        return HttpResponseBadRequest("progress_s must be a finite number")
     s = get_object_or_404(Sermon, slug=slug)
+    progress_s = min(max(progress_s, 0.0), float(s.duration_s or MAX_PROGRESS_S))
+    listener = identity.existing_visitor_id(request) or identity.ip_hash(identity.client_ip(request))
     pe = PlayEvent.objects.create(
         user=request.user if request.user.is_authenticated else None,
         sermon=s,
         progress_s=progress_s,
+        listener=listener,
     )
-    if s.duration_s and progress_s >= 0.9 * s.duration_s and pe.completed_at is None:
+    completed = bool(s.duration_s and progress_s >= 0.9 * s.duration_s)
+    if completed and pe.completed_at is None:
         pe.completed_at = timezone.now()
         pe.save(update_fields=["completed_at"])
+    try:
+        counters.record_progress(s.slug, int(progress_s), listener, completed)
+    except Exception:
+        log.exception("recording progress for %s failed", s.slug)
     return JsonResponse({"ok": True})
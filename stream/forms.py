@@ -14,3 +14,8 @@ class SermonForm(forms.ModelForm):
         # Ensure correct display/parse format
         self.fields["date"].widget.format = "%Y-%m-%d"
         self.fields["date"].input_formats = ["%Y-%m-%d"]
+
+
+class SermonBulkImportForm(forms.Form):
+    file = forms.FileField(help_text="db.json-style dump, JSONL or CSV")
+    chunk_size = forms.IntegerField(initial=500, min_value=50, max_value=5000)
@@ -0,0 +1,274 @@
+# stream/importer.py
+"""
+Bulk sermon import: stream records from a db.json-style dump, JSONL or CSV,
+validate them in chunks, allocate slugs per chunk and bulk_create. Duration
+probing is left to `probe_missing_durations` (rows with duration_s=0 are the
+queue), so the import itself never touches the audio files.
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+
+from .models import Sermon
+from .slugs import unique_slug, unique_slugs
+
+SERMON_FIELDS = ("title", "slug", "speaker", "date", "description", "tags", "cover", "audio", "duration_s")
+
+
+# -------- readers --------
+
+def _iter_json_array(fh, bufsize=1 << 16):
+    """Yield objects from a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buf, pos, started = "", 0, False
+    while True:
+        chunk = fh.read(bufsize)
+        buf = buf[pos:] + (chunk or "")
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if not started:
+                if pos < len(buf) and buf[pos] == "[":
+                    started, pos = True, pos + 1
+                    continue
+                if pos < len(buf):
+                    raise ValueError("Expected a JSON array")
+                break
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # need more data
+            pos = end
+            yield obj
+        if not chunk:
+            if buf[pos:].strip():
+                raise ValueError("Truncated JSON input")
+            return
+
+
+def _from_fixture(obj):
+    # db.json rows look like {"model": "stream.sermon", "pk": 1, "fields": {...}}
+    if "fields" in obj:
+        if (obj.get("model") or "stream.sermon").lower() != "stream.sermon":
+            return None
+        return dict(obj["fields"])
+    return obj
+
+
+def iter_records(path):
+    """Yield plain dicts for sermon rows from .json, .jsonl/.ndjson or .csv."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as fh:
+            yield from csv.DictReader(fh)
+        return
+    with open(path, encoding="utf-8", errors="replace") as fh:
+        if ext in (".jsonl", ".ndjson"):
+            rows = (json.loads(line) for line in fh if line.strip())
+        else:
+            rows = _iter_json_array(fh)
+        for obj in rows:
+            rec = _from_fixture(obj)
+            if rec is not None:
+                yield rec
+
+
+# -------- validation --------
+
+def build_sermon(rec: dict) -> Sermon:
+    """Turn one raw record into an unsaved Sermon; raises ValidationError."""
+    data = {k: rec.get(k) for k in SERMON_FIELDS if rec.get(k) not in (None, "")}
+    if isinstance(data.get("date"), str):
+        try:
+            data["date"] = date.fromisoformat(data["date"][:10])
+        except ValueError:
+            raise ValidationError({"date": "Invalid date"})
+    try:
+        data["duration_s"] = int(float(data.get("duration_s") or 0))
+    except (TypeError, ValueError):
+        data["duration_s"] = 0
+    s = Sermon(**data)
+    # slug is allocated per chunk; unique checks would cost a query per row
+    s.full_clean(exclude=["slug", "uploaded_by"], validate_unique=False)
+    return s
+
+
+# -------- checkpoint --------
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def save_checkpoint(path, state):
+    if not path:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as fh:
+        json.dump(state, fh)
+    os.replace(tmp, path)
+
+
+# -------- pipeline --------
+
+class SermonImporter:
+    def __init__(self, chunk_size=500, checkpoint=None, dry_run=False, uploaded_by=None, log=None):
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint
+        self.dry_run = dry_run
+        self.uploaded_by = uploaded_by
+        self.log = log or (lambda msg: None)
+        # a dry run counts what it would insert as "would_create"; "created" stays 0
+        self.stats = {"read": 0, "created": 0, "would_create": 0, "skipped": 0, "invalid": 0, "errors": []}
+
+    def run(self, path):
+        state = load_checkpoint(self.checkpoint)
+        resume_at = state.get("offset", 0) if state.get("source") == os.path.abspath(path) else 0
+        if resume_at:
+            self.log(f"Resuming after row {resume_at}")
+
+        started = time.perf_counter()
+        chunk, offset = [], 0
+        for offset, rec in enumerate(iter_records(path), start=1):
+            if offset <= resume_at:
+                continue
+            chunk.append((offset, rec))
+            if len(chunk) >= self.chunk_size:
+                self._flush(chunk, path)
+                chunk = []
+                self._report(started)
+        if chunk:
+            self._flush(chunk, path)
+        self._report(started)
+        self.stats["elapsed_s"] = round(time.perf_counter() - started, 3)
+        return self.stats
+
+    def _report(self, started):
+        elapsed = time.perf_counter() - started
+        rate = self.stats["read"] / elapsed if elapsed else 0
+        created = f"would_create={self.stats['would_create']}" if self.dry_run else f"created={self.stats['created']}"
+        self.log(
+            f"read={self.stats['read']} {created} "
+            f"skipped={self.stats['skipped']} invalid={self.stats['invalid']} ({rate:.0f} rows/s)"
+        )
+
+    def _flush(self, chunk, path):
+        sermons = []
+        for offset, rec in chunk:
+            self.stats["read"] += 1
+            try:
+                s = build_sermon(rec)
+            except ValidationError as e:
+                self.stats["invalid"] += 1
+                if len(self.stats["errors"]) < 50:
+                    self.stats["errors"].append(f"row {offset}: {'; '.join(e.messages)}")
+                continue
+            if self.uploaded_by is not None:
+                s.uploaded_by = self.uploaded_by
+            sermons.append(s)
+
+        # explicit slugs are normalised like allocated ones; one that slugifies
+        # to nothing (or is too long for the column) is allocated from the title
+        max_len = Sermon._meta.get_field("slug").max_length
+        for s in sermons:
+            if s.slug:
+                slug = slugify(s.slug)
+                s.slug = slug if len(slug) <= max_len else ""
+
+        # rows that carry a slug already present are treated as imported (idempotent re-runs)
+        given = [s.slug for s in sermons if s.slug]
+        existing = set(Sermon.objects.filter(slug__in=given).values_list("slug", flat=True)) if given else set()
+        fresh, seen = [], set()
+        for s in sermons:
+            if s.slug and (s.slug in existing or s.slug in seen):
+                self.stats["skipped"] += 1
+                continue
+            if s.slug:
+                seen.add(s.slug)
+            fresh.append(s)
+
+        # allocated slugs must also step around the explicit ones in this chunk
+        unslugged = [s for s in fresh if not s.slug]
+        slugs = unique_slugs(Sermon, [s.title for s in unslugged], fallback="sermon", taken=seen)
+        for s, slug in zip(unslugged, slugs):
+            s.slug = slug
+
+        if not self.dry_run and fresh:
+            try:
+                with transaction.atomic():
+                    Sermon.objects.bulk_create(fresh, batch_size=self.chunk_size)
+            except IntegrityError:
+                # a concurrent writer took one of our slugs: retry row by row
+                fresh = self._create_each(fresh, unslugged, chunk)
+        self.stats["would_create" if self.dry_run else "created"] += len(fresh)
+        if not self.dry_run:
+            save_checkpoint(self.checkpoint, {
+                "source": os.path.abspath(path),
+                "offset": chunk[-1][0],
+                "created": self.stats["created"],
+            })
+
+
+    def _create_each(self, sermons, allocated, chunk):
+        """Insert rows one at a time (a savepoint each); returns the ones created."""
+        allocated = set(map(id, allocated))
+        created = []
+        for s in sermons:
+            for attempt in range(2):
+                try:
+                    with transaction.atomic():
+                        Sermon.objects.bulk_create([s])
+                    created.append(s)
+                    break
+                except IntegrityError as e:
+                    if attempt == 0 and id(s) in allocated:
+                        s.slug = unique_slug(Sermon, s.title, fallback="sermon")
+                        continue
+                    self.stats["invalid"] += 1
+                    if len(self.stats["errors"]) < 50:
+                        self.stats["errors"].append(
+                            f"rows {chunk[0][0]}-{chunk[-1][0]}: {s.slug!r} not created ({e})"
+                        )
+                    break
+        return created
+
+
+def probe_missing_durations(queryset=None, workers=4, batch_size=100, log=None):
+    """
+    Drain the probe queue (sermons with duration_s=0) with a small thread pool;
+    mutagen work is I/O bound (S3 downloads), results are written with bulk_update.
+    """
+    log = log or (lambda msg: None)
+    qs = (queryset if queryset is not None else Sermon.objects.all()).filter(duration_s=0).exclude(audio="")
+    qs = qs.only("id", "audio", "duration_s").order_by("id")
+    done = 0
+    last_id = 0
+    while True:
+        batch = list(qs.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1].id
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            durations = list(pool.map(lambda s: s._probe_audio_duration(), batch))
+        changed = []
+        for s, dur in zip(batch, durations):
+            if dur:
+                s.duration_s = dur
+                changed.append(s)
+        if changed:
+            Sermon.objects.bulk_update(changed, ["duration_s"])
+        done += len(changed)
+        log(f"probed {done} so far")
+    return done
@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from stream.importer import SermonImporter, probe_missing_durations
+
+
+class Command(BaseCommand):
+    help = "Bulk import sermons from a db.json-style dump, JSONL or CSV (streamed, chunked, resumable)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Input file (.json, .jsonl or .csv)")
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--checkpoint", help="Checkpoint file; re-running with it resumes after the last committed chunk")
+        parser.add_argument("--uploaded-by", help="Email of the user to attribute the sermons to")
+        parser.add_argument("--dry-run", action="store_true", help="Validate and allocate slugs without writing")
+        parser.add_argument("--probe", action="store_true", help="Probe audio durations after the import")
+        parser.add_argument("--workers", type=int, default=4, help="Threads used for --probe")
+
+    def handle(self, *args, **opts):
+        uploader = None
+        if opts["uploaded_by"]:
+            try:
+                uploader = get_user_model().objects.get(email=opts["uploaded_by"])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user with email {opts['uploaded_by']}")
+
+        importer = SermonImporter(
+            chunk_size=opts["chunk_size"],
+            checkpoint=opts["checkpoint"],
+            dry_run=opts["dry_run"],
+            uploaded_by=uploader,
+            log=self.stdout.write,
+        )
+        try:
+            stats = importer.run(opts["path"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for err in stats["errors"]:
+            self.stderr.write(err)
+        rate = stats["read"] / stats["elapsed_s"] if stats["elapsed_s"] else 0
+        done = f"Dry run: would create {stats['would_create']}" if opts["dry_run"] else f"Imported {stats['created']}"
+        self.stdout.write(self.style.SUCCESS(
+            f"{done} sermons ({stats['skipped']} skipped, {stats['invalid']} invalid) "
+            f"in {stats['elapsed_s']}s — {rate:.0f} rows/s"
+        ))
+
+        if opts["probe"] and not opts["dry_run"]:
+            n = probe_missing_durations(workers=opts["workers"], log=self.stdout.write)
+            self.stdout.write(self.style.SUCCESS(f"Probed {n} durations"))
+        elif not opts["dry_run"]:
+            self.stdout.write("Run `manage.py probe_durations` to fill in missing durations.")
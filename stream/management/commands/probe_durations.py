@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from stream.importer import probe_missing_durations
+
+
+class Command(BaseCommand):
+    help = "Fill duration_s for sermons that still have 0 (e.g. after a bulk import)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **opts):
+        n = probe_missing_durations(workers=opts["workers"], batch_size=opts["batch_size"], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"Probed {n} durations"))
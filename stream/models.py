@@ -1,7 +1,6 @@
 # stream/models.py
-from django.db import models, transaction, IntegrityError
+from django.db import models
 from django.urls import reverse
-from django.utils.text import slugify
 from django.utils import timezone
 from django.conf import settings
 from tempfile import NamedTemporaryFile
@@ -9,6 +8,8 @@ from mutagen import File as MutagenFile
 import shutil
 import os
 
+from .slugs import save_with_unique_slug
+
 def cover_upload_to(instance, filename):
     d = getattr(instance, "date", None) or timezone.localdate()
     return f"covers/{d.strftime('%Y/%m')}/{filename}"
@@ -41,13 +42,6 @@ class Sermon(models.Model):
     def __str__(self):
         return f"{self.title} ({self.date})"
 
-    def _base_slug(self) -> str:
-        return slugify(self.title) or "sermon"
-
-    def _trim_slug_to_field(self, base: str, suffix_len: int = 0) -> str:
-        max_len = self._meta.get_field("slug").max_length
-        return base[: max_len - suffix_len]
-
     def duration_hm(self) -> str:
         m, s = divmod(self.duration_s or 0, 60)
         h, m = divmod(m, 60)
@@ -60,24 +54,15 @@ class Sermon(models.Model):
         return reverse("stream:past_detail", args=[self.slug])
 
     def save(self, *args, **kwargs):
-        # set initial slug if missing
-        if not self.slug:
-            self.slug = self._trim_slug_to_field(self._base_slug())
-
-        # unique slug collision handling
-        base = self._base_slug()
-        attempt = 1
-        while True:
-            try:
-                with transaction.atomic():
-                    super().save(*args, **kwargs)
-                break
-            except IntegrityError:
-                attempt += 1
-                if attempt > 50:
-                    raise
-                suffix = f"-{attempt}"
-                self.slug = self._trim_slug_to_field(base, suffix_len=len(suffix)) + suffix
+        # unique slug: one prefix query picks the next free suffix
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "slug" not in update_fields:
+            super().save(*args, **kwargs)
+        else:
+            save_with_unique_slug(
+                self, lambda: super(Sermon, self).save(*args, **kwargs),
+                self.slug or self.title, fallback="sermon",
+            )
 
         # probe duration once the file exists
         if self.audio and (self.duration_s or 0) == 0:
@@ -116,10 +101,13 @@ class Playlist(models.Model):
         return self.title
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base = slugify(self.title) or "playlist"
-            self.slug = base[:170]
-        return super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "slug" not in update_fields:
+            return super().save(*args, **kwargs)
+        return save_with_unique_slug(
+            self, lambda: super(Playlist, self).save(*args, **kwargs),
+            self.slug or self.title, fallback="playlist",
+        )
 
 class PlaylistItem(models.Model):
     playlist = models.ForeignKey(Playlist, related_name="items", on_delete=models.CASCADE)
@@ -146,6 +134,7 @@ class PlayEvent(models.Model):
     started_at  = models.DateTimeField(auto_now_add=True)
     progress_s  = models.FloatField(default=0)
     completed_at = models.DateTimeField(null=True, blank=True)
+    listener    = models.CharField(max_length=64, blank=True, default="")  # visitor id or ip hash (anonymous plays)
 
     class Meta:
         indexes = [models.Index(fields=["sermon", "started_at"])]
@@ -0,0 +1,109 @@
+# stream/slugs.py
+import re
+
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+
+# Room kept at the end of the field for "-<n>" when trimming long bases.
+SUFFIX_RESERVE = 8
+
+
+def _trim(base: str, max_len: int, suffix: str = "") -> str:
+    return base[: max_len - len(suffix)].rstrip("-") + suffix
+
+
+def _taken_suffixes(model, field: str, base: str, max_len: int, exclude_pk=None):
+    """
+    One indexed prefix query (`slug LIKE 'base%'`) returning
+    (base_taken, highest_numeric_suffix) for the given base.
+    """
+    prefix = _trim(base, max_len - SUFFIX_RESERVE)
+    qs = model._default_manager.filter(**{f"{field}__startswith": prefix})
+    if exclude_pk is not None:
+        qs = qs.exclude(pk=exclude_pk)
+
+    trimmed = _trim(base, max_len)
+    rx = re.compile(r"^(?P<stem>.+)-(?P<n>\d+)$")
+    base_taken, highest = False, 1
+    for slug in qs.values_list(field, flat=True).iterator():
+        if slug == trimmed:
+            base_taken = True
+            continue
+        m = rx.match(slug)
+        if not m or not base.startswith(m.group("stem")):
+            continue
+        n = int(m.group("n"))
+        # only count suffixes that this base could actually have produced
+        if _trim(base, max_len, f"-{n}") == slug:
+            highest = max(highest, n)
+    return base_taken, highest
+
+
+def unique_slug(model, value: str, field: str = "slug", fallback: str = "item", exclude_pk=None) -> str:
+    """Return the next free slug for `value` on `model.<field>`."""
+    max_len = model._meta.get_field(field).max_length
+    base = slugify(value) or fallback
+    base_taken, highest = _taken_suffixes(model, field, base, max_len, exclude_pk=exclude_pk)
+    if not base_taken and highest == 1:
+        return _trim(base, max_len)
+    return _trim(base, max_len, f"-{highest + 1}")
+
+
+def unique_slugs(model, values, field: str = "slug", fallback: str = "item", taken=()):
+    """
+    Bulk variant for imports: one prefix query per distinct base, then
+    suffixes are handed out in memory so rows in the same batch never clash.
+    `taken` holds slugs that are not in the table yet but will be (explicit
+    slugs from the same batch). Returns a list of slugs in the same order as
+    `values`.
+    """
+    max_len = model._meta.get_field(field).max_length
+    state = {}  # base -> [base_taken, highest]
+    out = []
+    for value in values:
+        base = slugify(value) or fallback
+        if base not in state:
+            entry = list(_taken_suffixes(model, field, base, max_len))
+            trimmed = _trim(base, max_len)
+            for slug in taken:
+                if slug == trimmed:
+                    entry[0] = True
+                    continue
+                _, _, n = slug.rpartition("-")
+                if n.isdigit() and _trim(base, max_len, f"-{n}") == slug:
+                    entry[1] = max(entry[1], int(n))
+            state[base] = entry
+        entry = state[base]
+        if not entry[0] and entry[1] == 1:
+            entry[0] = True
+            out.append(_trim(base, max_len))
+        else:
+            entry[1] += 1
+            out.append(_trim(base, max_len, f"-{entry[1]}"))
+    return out
+
+
+def save_with_unique_slug(instance, save, value: str, field: str = "slug", fallback: str = "item", retries: int = 3):
+    """
+    Allocate a slug and save. The unique index is still the source of truth:
+    if a concurrent writer grabbed the same slug between our prefix query and
+    the INSERT, re-run the allocation (which now sees their row) and retry.
+
+    An instance keeps the slug it already has (so re-saving an existing row
+    never changes its public URL) unless it is blank, not a valid slug, or
+    held by another row.
+    """
+    model = type(instance)
+    max_len = model._meta.get_field(field).max_length
+    for attempt in range(retries):
+        current = getattr(instance, field) or ""
+        keep = (current and current == slugify(current) and len(current) <= max_len
+                and not model._default_manager.filter(**{field: current}).exclude(pk=instance.pk).exists())
+        if not keep:
+            setattr(instance, field, unique_slug(model, value, field=field, fallback=fallback, exclude_pk=instance.pk))
+        try:
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            if attempt == retries - 1:
+                raise
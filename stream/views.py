@@ -3,7 +3,7 @@ from collections import Counter
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.db.models import Count, Q
+from django.db.models import Count, Q, Sum
 from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
@@ -12,6 +12,10 @@ from django.utils.dateformat import format as datefmt
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import DetailView, ListView
 
+from analytics import counters, presence
+from analytics.instrumentation import timed
+from analytics.querybudget import query_budget
+from analytics.realtime import streaming_supported
 from analytics.models import Event, Visit
 
 from .forms import SermonForm
@@ -40,24 +44,21 @@ def upload_sermon(request):
 
 @login_required
 @user_passes_test(lambda u: u.is_staff)
+@query_budget(12)  # measured worst case: 4 totals, a trending rebase, 2x (top + pending sermons), 3 recent lists
 def staff_dashboard(request):
     now = timezone.now()
     since = now - timedelta(days=7)
 
     sermons_total = Sermon.objects.count()
     sermons_week = Sermon.objects.filter(date__gte=since.date()).count()
-    plays_week = Event.objects.filter(event="play", ts__gte=since).count()
-    visits_week = Visit.objects.filter(ts__gte=since).count()
-
-    top_sermons = (
-        Event.objects.filter(event="play")
-        .values("slug", "title")
-        .annotate(count=Count("id"))
-        .order_by("-count")[:5]
-    )
-    recent_sermons = Sermon.objects.order_by("-date", "-id")[:6]
-    recent_events = Event.objects.filter(event="play").order_by("-ts")[:8]
-    recent_visits = Visit.objects.order_by("-ts")[:8]
+    plays_week = Event.objects.filter(event="play", ts__gte=since).aggregate(n=Sum("weight"))["n"] or 0
+    visits_week = Visit.objects.filter(ts__gte=since).aggregate(n=Sum("weight"))["n"] or 0
+
+    top_sermons = counters.top("plays", 5)
+    trending_sermons = counters.top("trending", 5)
+    recent_sermons = Sermon.objects.select_related("uploaded_by").order_by("-date", "-id")[:6]
+    recent_events = Event.objects.filter(event="play").select_related("user").order_by("-ts")[:8]
+    recent_visits = Visit.objects.select_related("path").order_by("-ts")[:8]
 
     context = {
         "sermons_total": sermons_total,
@@ -65,9 +66,13 @@ def staff_dashboard(request):
         "plays_week": plays_week,
         "visits_week": visits_week,
         "top_sermons": top_sermons,
+        "trending_sermons": trending_sermons,
         "recent_sermons": recent_sermons,
         "recent_events": recent_events,
         "recent_visits": recent_visits,
+        "live_current": presence.current_listeners(),
+        "live_peak": presence.peak_today(),
+        "live_stream": streaming_supported(request),
     }
     return render(request, "stream/staff_dashboard.html", context)
 
@@ -127,11 +132,12 @@ class SermonListView(ListView):
 
         # Top tags (simple Python counter over comma-separated tags)
         tag_counter = Counter()
-        for row in Sermon.objects.values_list("tags", flat=True):
-            if not row:
-                continue
-            for t in [s.strip() for s in row.split(",") if s.strip()]:
-                tag_counter[t.lower()] += 1
+        with timed("facets"):
+            for row in Sermon.objects.values_list("tags", flat=True):
+                if not row:
+                    continue
+                for t in [s.strip() for s in row.split(",") if s.strip()]:
+                    tag_counter[t.lower()] += 1
         ctx["top_tags"] = sorted(tag_counter.items(), key=lambda x: (-x[1], x[0]))[:12]
 
         # Top speakers